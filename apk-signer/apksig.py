@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+
+from apkzip import APK_SIG_BLOCK_MAGIC, patch_eocd
+from config import SIGN_DIGEST_THREADS
+
+logger = logging.getLogger(__name__)
+
+# APK Signature Scheme v2/v3 constants
+CHUNK_SIZE = 1024 * 1024
+V2_BLOCK_ID = 0x7109871a
+V3_BLOCK_ID = 0xf05368c0
+STRIPPING_PROTECTION_ATTR_ID = 0xbeeff00d  # Tells v2 verifiers a v3 block must exist
+
+SIG_RSA_PKCS1_SHA256 = 0x0103
+SIG_ECDSA_SHA256 = 0x0201
+
+V3_MIN_SDK = 28  # Android 9, first release that reads v3 blocks
+V3_MAX_SDK = 0x7fffffff
+
+class APKSignatureError(Exception):
+    """Raised when an APK cannot be parsed or signed"""
+    pass
+
+class SignerKey:
+    """A private key and its certificate, ready to produce APK signatures"""
+
+    def __init__(self, private_key, certificate: x509.Certificate):
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            self.algorithm = SIG_RSA_PKCS1_SHA256
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey):
+            self.algorithm = SIG_ECDSA_SHA256
+        else:
+            raise APKSignatureError(f"Unsupported key type: {type(private_key).__name__}")
+
+        self.private_key = private_key
+        self.certificate = certificate
+        self.certificate_der = certificate.public_bytes(serialization.Encoding.DER)
+        self.key_id = hashlib.sha256(self.certificate_der).hexdigest()  # Stable ID for caching outputs
+        self.public_key_der = private_key.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        certificate_key_der = certificate.public_key().public_bytes(
+            serialization.Encoding.DER,
+            serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        if certificate_key_der != self.public_key_der:
+            raise APKSignatureError("Certificate does not belong to the private key")
+
+    def sign(self, data: bytes) -> bytes:
+        if self.algorithm == SIG_RSA_PKCS1_SHA256:
+            return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+
+# Digests
+_digest_executor: Optional[ThreadPoolExecutor] = None
+
+def get_digest_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by the v1 and v2/v3 digest stages"""
+    # Created lazily so each signing worker process gets its own threads
+    global _digest_executor
+    if _digest_executor is None:
+        _digest_executor = ThreadPoolExecutor(
+            max_workers=SIGN_DIGEST_THREADS, thread_name_prefix='apk-digest'
+        )
+    return _digest_executor
+
+def _chunk_digest(chunk, algorithm: str = 'sha256') -> bytes:
+    # hashlib releases the GIL for large buffers, so chunks hash in parallel
+    digest = hashlib.new(algorithm, b'\xa5' + struct.pack('<I', len(chunk)))
+    digest.update(chunk)
+    return digest.digest()
+
+def compute_chunk_digests(sections: Sequence, algorithm: str = 'sha256') -> List[bytes]:
+    """Digest of every 1 MB chunk of the given sections, in order (SHA-512 only for verifying)"""
+    chunks = []
+    for section in sections:
+        view = memoryview(section)
+        chunks.extend(view[i:i + CHUNK_SIZE] for i in range(0, len(view), CHUNK_SIZE))
+
+    if len(chunks) < 2:
+        return [_chunk_digest(chunk, algorithm) for chunk in chunks]
+    return list(get_digest_executor().map(_chunk_digest, chunks, [algorithm] * len(chunks)))
+
+def content_digest(chunk_digests: Sequence[bytes], algorithm: str = 'sha256') -> bytes:
+    """Top-level v2/v3 digest over the chunk digests"""
+    digest = hashlib.new(algorithm, b'\x5a' + struct.pack('<I', len(chunk_digests)))
+    for chunk in chunk_digests:
+        digest.update(chunk)
+    return digest.digest()
+
+# Signing block encoding
+def _lp(data: bytes) -> bytes:
+    """uint32 length-prefixed bytes"""
+    return struct.pack('<I', len(data)) + data
+
+def _lp_seq(items: Sequence[bytes]) -> bytes:
+    """uint32 length-prefixed sequence of length-prefixed items"""
+    return _lp(b''.join(_lp(item) for item in items))
+
+def _v2_signer(key: SignerKey, digest: bytes, with_v3: bool) -> bytes:
+    attributes = []
+    if with_v3:
+        attributes.append(struct.pack('<II', STRIPPING_PROTECTION_ATTR_ID, 3))
+    signed_data = (
+        _lp_seq([struct.pack('<I', key.algorithm) + _lp(digest)]) +
+        _lp_seq([key.certificate_der]) +
+        _lp_seq(attributes)
+    )
+    signature = struct.pack('<I', key.algorithm) + _lp(key.sign(signed_data))
+    return _lp(signed_data) + _lp_seq([signature]) + _lp(key.public_key_der)
+
+def _v3_signer(key: SignerKey, digest: bytes) -> bytes:
+    sdk_range = struct.pack('<II', V3_MIN_SDK, V3_MAX_SDK)
+    signed_data = (
+        _lp_seq([struct.pack('<I', key.algorithm) + _lp(digest)]) +
+        _lp_seq([key.certificate_der]) +
+        sdk_range +
+        _lp_seq([])
+    )
+    signature = struct.pack('<I', key.algorithm) + _lp(key.sign(signed_data))
+    return _lp(signed_data) + sdk_range + _lp_seq([signature]) + _lp(key.public_key_der)
+
+def build_signing_block(key: SignerKey, digest: bytes, v3: bool = True) -> bytes:
+    """Encode an APK Signing Block holding v2 (and optionally v3) signatures"""
+    pairs = [(V2_BLOCK_ID, _lp_seq([_v2_signer(key, digest, with_v3=v3)]))]
+    if v3:
+        pairs.append((V3_BLOCK_ID, _lp_seq([_v3_signer(key, digest)])))
+
+    body = b''.join(
+        struct.pack('<QI', len(value) + 4, block_id) + value for block_id, value in pairs
+    )
+    size = len(body) + 8 + len(APK_SIG_BLOCK_MAGIC)
+    return struct.pack('<Q', size) + body + struct.pack('<Q', size) + APK_SIG_BLOCK_MAGIC
+
+def sign_file(path: str, entries_end: int, central_directory: bytes, eocd: bytes,
+              key: SignerKey, v3: bool = True) -> List[bytes]:
+    """Append signing block, central directory and EOCD to a file holding ZIP entries.
+
+    The file at path must contain exactly the ZIP entries section
+    (entries_end bytes). The entries are digested straight from an mmap,
+    so nothing is copied into Python memory. Returns the chunk digests so
+    callers can verify the result without hashing again.
+    """
+    with open(path, 'r+b') as f:
+        if os.fstat(f.fileno()).st_size != entries_end:
+            raise APKSignatureError("Output does not end at the ZIP entries section")
+
+        # Digested EOCD points the central directory at the signing block position
+        sections = [central_directory, patch_eocd(eocd, entries_end)]
+        if entries_end:
+            with mmap.mmap(f.fileno(), entries_end, access=mmap.ACCESS_READ) as entries:
+                chunk_digests = compute_chunk_digests([entries] + sections)
+        else:
+            chunk_digests = compute_chunk_digests(sections)
+
+        block = build_signing_block(key, content_digest(chunk_digests), v3=v3)
+        f.seek(entries_end)
+        f.write(block)
+        f.write(central_directory)
+        f.write(patch_eocd(eocd, entries_end + len(block)))
+
+    return chunk_digests
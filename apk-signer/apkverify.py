@@ -0,0 +1,562 @@
+import binascii
+import hashlib
+import logging
+import mmap
+import re
+import struct
+import time
+import zlib
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs7
+
+import apkzip
+import jarsign
+from apksig import (
+    V2_BLOCK_ID, V3_BLOCK_ID, STRIPPING_PROTECTION_ATTR_ID, SignerKey,
+    compute_chunk_digests, content_digest,
+)
+from config import VERIFY_BUDGET_MS_PER_MB
+
+logger = logging.getLogger(__name__)
+
+# In-process verifier for v1 (JAR) signatures and APK Signature Scheme v2/v3.
+# It follows the checks Android's apksig library makes, except that v3 key
+# rotation (proof-of-rotation) and verity-only signers are not verified.
+
+MAX_SIGNATURE_FILE_SIZE = 16 * 1024 * 1024  # MANIFEST.MF of a very large APK is a few MB
+
+# v2/v3 signature algorithm: (hash, key kind, chunked content digest or None for verity)
+SIGNATURE_ALGORITHMS = {
+    0x0101: (hashes.SHA256, 'rsa-pss', 'sha256'),
+    0x0102: (hashes.SHA512, 'rsa-pss', 'sha512'),
+    0x0103: (hashes.SHA256, 'rsa', 'sha256'),
+    0x0104: (hashes.SHA512, 'rsa', 'sha512'),
+    0x0201: (hashes.SHA256, 'ecdsa', 'sha256'),
+    0x0202: (hashes.SHA512, 'ecdsa', 'sha512'),
+    0x0301: (hashes.SHA256, 'dsa', 'sha256'),
+    0x0421: (hashes.SHA256, 'rsa', None),
+    0x0423: (hashes.SHA256, 'ecdsa', None),
+    0x0425: (hashes.SHA256, 'dsa', None),
+}
+
+# DER-encoded OID contents used in PKCS#7 signature blocks
+OID_SIGNED_DATA = bytes.fromhex('2a864886f70d010702')
+OID_MESSAGE_DIGEST = bytes.fromhex('2a864886f70d010904')
+DIGEST_OIDS = {
+    bytes.fromhex('2b0e03021a'): hashes.SHA1,
+    bytes.fromhex('608648016503040201'): hashes.SHA256,
+    bytes.fromhex('608648016503040202'): hashes.SHA384,
+    bytes.fromhex('608648016503040203'): hashes.SHA512,
+}
+
+# Strongest first, as jarsigner and apksig pick them
+V1_DIGEST_PREFERENCE = ('SHA-512', 'SHA-384', 'SHA-256', 'SHA1')
+_V1_DIGEST_KEYS = {
+    suffix: tuple((algorithm, f"{algorithm.lower()}{suffix}") for algorithm in V1_DIGEST_PREFERENCE)
+    for suffix in ('-digest', '-digest-manifest', '-digest-manifest-main-attributes')
+}
+
+_SIGNATURE_BLOCK_RE = re.compile(r'^META-INF/([^/]+)\.(RSA|DSA|EC)$')
+# One manifest section: non-empty lines, then the blank line that ends it
+_SECTION_RE = re.compile(rb'(?:[^\r\n]+(?:\r\n|\n|\r|$))+(?:\r\n|\n|\r)?')
+_CONTINUATION_RE = re.compile(rb'(?:\r\n|\n|\r) ')
+
+class VerificationError(Exception):
+    """Raised when a signature is missing, malformed or does not match the APK"""
+    pass
+
+class SignerCertificate(NamedTuple):
+    """Certificate of a signer whose signature verified"""
+    scheme: str  # 'v1', 'v2' or 'v3'
+    certificate_der: bytes
+
+    @property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.certificate_der).hexdigest()
+
+    @property
+    def subject(self) -> str:
+        return x509.load_der_x509_certificate(self.certificate_der).subject.rfc4514_string()
+
+class VerificationResult(NamedTuple):
+    """Outcome of verifying every signature scheme present in an APK"""
+    verified: Tuple[str, ...]  # Schemes whose signatures checked out, e.g. ('v1', 'v2', 'v3')
+    signers: List[SignerCertificate]
+    errors: List[str]
+    elapsed: float  # Seconds
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.verified) and not self.errors
+
+# Signature checks shared by both schemes
+def _verify_signature(public_key, kind: str, hash_algorithm, signature: bytes, data: bytes):
+    try:
+        if kind in ('rsa', 'rsa-pss') and isinstance(public_key, rsa.RSAPublicKey):
+            if kind == 'rsa-pss':
+                pad = padding.PSS(mgf=padding.MGF1(hash_algorithm()), salt_length=hash_algorithm.digest_size)
+            else:
+                pad = padding.PKCS1v15()
+            public_key.verify(signature, data, pad, hash_algorithm())
+        elif kind == 'ecdsa' and isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(signature, data, ec.ECDSA(hash_algorithm()))
+        elif kind == 'dsa' and isinstance(public_key, dsa.DSAPublicKey):
+            public_key.verify(signature, data, hash_algorithm())
+        else:
+            raise VerificationError(f"Key type {type(public_key).__name__} does not match {kind} signature")
+    except InvalidSignature:
+        raise VerificationError("Signature does not verify")
+
+def _key_kind(public_key) -> str:
+    """Signature kind of a v1 signer key; PKCS#7 uses PKCS#1 v1.5 padding for RSA"""
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return 'rsa'
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return 'ecdsa'
+    if isinstance(public_key, dsa.DSAPublicKey):
+        return 'dsa'
+    raise VerificationError(f"Unsupported signer key type: {type(public_key).__name__}")
+
+def _public_key_der(public_key) -> bytes:
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+# APK Signature Scheme v2/v3
+class _Reader:
+    """Cursor over the little-endian, length-prefixed fields of a signing block"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    @property
+    def remaining(self) -> int:
+        return len(self.data) - self.pos
+
+    def u32(self) -> int:
+        if self.remaining < 4:
+            raise VerificationError("Truncated signing block field")
+        value = struct.unpack_from('<I', self.data, self.pos)[0]
+        self.pos += 4
+        return value
+
+    def lp(self) -> bytes:
+        length = self.u32()
+        if length > self.remaining:
+            raise VerificationError("Length prefix runs past the end of its block")
+        value = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return value
+
+    def lp_seq(self) -> List[bytes]:
+        reader = _Reader(self.lp())
+        items = []
+        while reader.remaining:
+            items.append(reader.lp())
+        return items
+
+def signing_block_pairs(data, sections: apkzip.ZipSections) -> Dict[int, bytes]:
+    """ID-value pairs of the APK Signing Block (empty if the APK has none)"""
+    if sections.entries_end == sections.cd_offset:
+        return {}
+
+    pairs = {}
+    offset = sections.entries_end + 8
+    end = sections.cd_offset - 24  # Size copy and magic
+    while offset < end:
+        length, block_id = struct.unpack_from('<QI', data, offset)
+        if length < 4 or offset + 8 + length > end:
+            raise VerificationError("Corrupted APK Signing Block pair")
+        pairs[block_id] = bytes(data[offset + 12:offset + 8 + length])
+        offset += 8 + length
+    return pairs
+
+def _verify_scheme_signer(signer: bytes, scheme: str,
+                          digest_for: Callable[[str], bytes]) -> Tuple[bytes, Dict[int, bytes]]:
+    """Verify one v2/v3 signer; returns its certificate and additional attributes"""
+    reader = _Reader(signer)
+    signed_data = reader.lp()
+    if scheme == 'v3':
+        sdk_range = (reader.u32(), reader.u32())
+    signatures = reader.lp_seq()
+    public_key_der = reader.lp()
+    public_key = serialization.load_der_public_key(public_key_der)
+
+    signature_algorithms = []
+    for item in signatures:
+        item_reader = _Reader(item)
+        algorithm = item_reader.u32()
+        signature = item_reader.lp()
+        signature_algorithms.append(algorithm)
+        if algorithm in SIGNATURE_ALGORITHMS:
+            hash_algorithm, kind, _ = SIGNATURE_ALGORITHMS[algorithm]
+            _verify_signature(public_key, kind, hash_algorithm, signature, signed_data)
+    if not any(algorithm in SIGNATURE_ALGORITHMS for algorithm in signature_algorithms):
+        raise VerificationError("No supported signature algorithm")
+
+    # Signed data is only trusted once a signature over it verified
+    data_reader = _Reader(signed_data)
+    digests = data_reader.lp_seq()
+    certificates = data_reader.lp_seq()
+    if scheme == 'v3' and (data_reader.u32(), data_reader.u32()) != sdk_range:
+        raise VerificationError("SDK range differs between signed and unsigned data")
+    attributes = {}
+    for attribute in data_reader.lp_seq():
+        attribute_reader = _Reader(attribute)
+        attribute_id = attribute_reader.u32()
+        attributes[attribute_id] = attribute[4:]
+
+    if not certificates:
+        raise VerificationError("No certificate in signer")
+    certificate = x509.load_der_x509_certificate(certificates[0])
+    if _public_key_der(certificate.public_key()) != _public_key_der(public_key):
+        raise VerificationError("Public key does not match its certificate")
+
+    digest_algorithms = []
+    checked = False
+    for item in digests:
+        item_reader = _Reader(item)
+        algorithm = item_reader.u32()
+        digest = item_reader.lp()
+        digest_algorithms.append(algorithm)
+        content_algorithm = SIGNATURE_ALGORITHMS.get(algorithm, (None, None, None))[2]
+        if content_algorithm:
+            if digest != digest_for(content_algorithm):
+                raise VerificationError("Content digest does not match the APK")
+            checked = True
+    if digest_algorithms != signature_algorithms:
+        raise VerificationError("Signature and digest algorithm lists differ")
+    if not checked:
+        raise VerificationError("No supported content digest")
+
+    return certificates[0], attributes
+
+def _content_digests(data, sections: apkzip.ZipSections,
+                     chunk_digests: Optional[Sequence[bytes]]) -> Callable[[str], bytes]:
+    """Content digest per algorithm, computed on first use; SHA-256 chunk digests may be passed in"""
+    cache = {}
+
+    def digest_for(algorithm: str) -> bytes:
+        if algorithm not in cache:
+            if algorithm == 'sha256' and chunk_digests is not None:
+                chunks = chunk_digests
+            else:
+                # The digested EOCD points at where the signing block starts
+                central_directory = bytes(data[sections.cd_offset:sections.cd_offset + sections.cd_size])
+                eocd = apkzip.patch_eocd(bytes(data[sections.eocd_offset:]), sections.entries_end)
+                view = memoryview(data)
+                try:
+                    chunks = compute_chunk_digests(
+                        [view[:sections.entries_end], central_directory, eocd], algorithm
+                    )
+                finally:
+                    view.release()
+            cache[algorithm] = content_digest(chunks, algorithm)
+        return cache[algorithm]
+
+    return digest_for
+
+# v1 (JAR) signatures
+def _der(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Return (tag, content start, content end) of the DER element at offset"""
+    tag = data[offset]
+    length = data[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7f
+        if not 0 < count <= 4:
+            raise VerificationError("Unsupported DER length")
+        length = int.from_bytes(data[start:start + count], 'big')
+        start += count
+    if start + length > len(data):
+        raise VerificationError("Truncated DER element")
+    return tag, start, start + length
+
+def _der_children(data: bytes, start: int, end: int) -> List[Tuple[int, int, int, int]]:
+    """Elements inside a constructed DER element, as (tag, offset, content start, content end)"""
+    children = []
+    offset = start
+    while offset < end:
+        tag, content_start, content_end = _der(data, offset)
+        children.append((tag, offset, content_start, content_end))
+        offset = content_end
+    return children
+
+def _verify_signature_block(block: bytes, signature_file: bytes) -> bytes:
+    """Verify a PKCS#7 signature block over a .SF file; returns the signer certificate"""
+    try:
+        _, start, end = _der(block, 0)
+        content_info = _der_children(block, start, end)
+        if block[content_info[0][2]:content_info[0][3]] != OID_SIGNED_DATA:
+            raise VerificationError("Signature block is not PKCS#7 SignedData")
+        _, start, end = _der(block, content_info[1][2])
+        signer_infos = _der_children(block, start, end)[-1]
+        certificates = pkcs7.load_der_pkcs7_certificates(block)
+
+        for _, _, start, end in _der_children(block, signer_infos[2], signer_infos[3]):
+            fields = _der_children(block, start, end)
+            _, _, issuer_start, issuer_end = fields[1]
+            issuer, serial = _der_children(block, issuer_start, issuer_end)
+            issuer_der = block[issuer[1]:issuer[3]]
+            serial_number = int.from_bytes(block[serial[2]:serial[3]], 'big', signed=True)
+            digest_oid = _der_children(block, fields[2][2], fields[2][3])[0]
+            hash_algorithm = DIGEST_OIDS.get(block[digest_oid[2]:digest_oid[3]])
+            if hash_algorithm is None:
+                raise VerificationError("Unsupported v1 digest algorithm")
+
+            signed = signature_file
+            index = 3
+            if fields[index][0] == 0xa0:
+                # Signed attributes: the signature covers them, and they carry the .SF digest
+                _, attributes_offset, attributes_start, attributes_end = fields[index]
+                message_digest = None
+                for _, _, start, end in _der_children(block, attributes_start, attributes_end):
+                    oid, values = _der_children(block, start, end)
+                    if block[oid[2]:oid[3]] == OID_MESSAGE_DIGEST:
+                        value = _der_children(block, values[2], values[3])[0]
+                        message_digest = block[value[2]:value[3]]
+                digest = hashes.Hash(hash_algorithm())
+                digest.update(signature_file)
+                if message_digest != digest.finalize():
+                    raise VerificationError("v1 signed attributes do not match the signature file")
+                signed = b'\x31' + block[attributes_offset + 1:attributes_end]
+                index += 1
+            signature = block[fields[index + 1][2]:fields[index + 1][3]]
+
+            for certificate in certificates:
+                if (certificate.serial_number == serial_number and
+                        certificate.issuer.public_bytes() == issuer_der):
+                    public_key = certificate.public_key()
+                    _verify_signature(public_key, _key_kind(public_key), hash_algorithm, signature, signed)
+                    return certificate.public_bytes(serialization.Encoding.DER)
+        raise VerificationError("v1 signer certificate not found in signature block")
+    except (IndexError, ValueError) as e:
+        raise VerificationError(f"Malformed v1 signature block: {e}")
+
+def _parse_sections(data: bytes, main_only: bool = False) -> List[Tuple[bytes, Dict[str, bytes]]]:
+    """Split a manifest or .SF file into (raw section bytes, attributes), main section first.
+
+    Attribute names are lower-cased; raw bytes keep the section's
+    terminating blank line, which is what .SF per-entry digests cover.
+    """
+    parsed = []
+    for match in _SECTION_RE.finditer(data):
+        raw = match.group()
+        attributes = {}
+        # Unfold continuation lines, then split into headers
+        for line in _CONTINUATION_RE.sub(b'', raw).splitlines():
+            if not line:
+                continue
+            key, separator, value = line.partition(b': ')
+            if not separator:
+                raise VerificationError(f"Malformed manifest line: {line[:40]!r}")
+            attributes[key.decode('ascii', errors='replace').lower()] = value
+        parsed.append((raw, attributes))
+        if main_only:
+            break
+    return parsed
+
+def _v1_digest(attributes: Dict[str, bytes], suffix: str) -> Optional[Tuple[str, bytes]]:
+    """Strongest '<algorithm><suffix>' attribute, as (jarsign algorithm name, digest)"""
+    for algorithm, key in _V1_DIGEST_KEYS[suffix]:
+        value = attributes.get(key)
+        if value is not None:
+            return algorithm, binascii.a2b_base64(value)
+    return None
+
+def _hash(algorithm: str, data: bytes) -> bytes:
+    return hashlib.new(algorithm.replace('-', '').lower(), data).digest()
+
+def _read_entry(data, entry: apkzip.ZipEntry) -> bytes:
+    if entry.uncompressed_size > MAX_SIGNATURE_FILE_SIZE:
+        raise VerificationError(f"{entry.name} is too large")
+    return b''.join(apkzip.iter_uncompressed(data, entry))
+
+def verify_v1(data, entries: Sequence[apkzip.ZipEntry],
+              entry_digests: Optional[Dict[bytes, bytes]] = None,
+              entry_digest_algorithm: str = 'SHA-256') -> Tuple[List[bytes], List[int]]:
+    """Verify the JAR signature; returns the signer certificates and the schemes listed in X-Android-APK-Signed.
+
+    entry_digests maps entry names to entry_digest_algorithm digests already
+    computed while signing, so only entries missing from it are read and hashed.
+    """
+    by_name = {entry.name: entry for entry in entries}
+    manifest_entry = by_name.get(jarsign.MANIFEST_NAME)
+    if manifest_entry is None:
+        raise VerificationError("No v1 signature (META-INF/MANIFEST.MF missing)")
+    manifest = _read_entry(data, manifest_entry)
+    manifest_sections = _parse_sections(manifest)
+    if not manifest_sections:
+        raise VerificationError("Empty MANIFEST.MF")
+    main_section = manifest_sections[0][0]
+    named_sections = {attributes.get('name'): (raw, attributes) for raw, attributes in manifest_sections[1:]}
+
+    certificates = []
+    signed_schemes = set()
+    for entry in entries:
+        match = _SIGNATURE_BLOCK_RE.match(entry.name)
+        if not match:
+            continue
+        signature_file_entry = by_name.get(f"META-INF/{match.group(1)}.SF")
+        if signature_file_entry is None:
+            raise VerificationError(f"{entry.name} has no matching .SF file")
+        signature_file = _read_entry(data, signature_file_entry)
+        certificates.append(_verify_signature_block(_read_entry(data, entry), signature_file))
+
+        sf_main_section = _parse_sections(signature_file, main_only=True)
+        sf_main = sf_main_section[0][1] if sf_main_section else {}
+        for scheme in sf_main.get('x-android-apk-signed', b'').split(b','):
+            if scheme.strip().isdigit():
+                signed_schemes.add(int(scheme.strip()))
+
+        # The whole-manifest digest covers every section; otherwise check them one by one
+        whole = _v1_digest(sf_main, '-digest-manifest')
+        if whole is None or _hash(whole[0], manifest) != whole[1]:
+            main_digest = _v1_digest(sf_main, '-digest-manifest-main-attributes')
+            if main_digest is not None and _hash(main_digest[0], main_section) != main_digest[1]:
+                raise VerificationError("MANIFEST.MF main attributes do not match CERT.SF")
+            for _, attributes in _parse_sections(signature_file)[1:]:
+                section = named_sections.get(attributes.get('name'))
+                expected = _v1_digest(attributes, '-digest')
+                if section is None or expected is None or _hash(expected[0], section[0]) != expected[1]:
+                    raise VerificationError(f"MANIFEST.MF section does not match .SF: {attributes.get('name')!r}")
+    if not certificates:
+        raise VerificationError("No v1 signature block")
+
+    # Every entry must be listed in the manifest with a matching digest
+    try:
+        signable = jarsign.signable_entries(entries)
+    except jarsign.JarSignatureError as e:
+        raise VerificationError(str(e))
+    pending: Dict[str, List[Tuple[apkzip.ZipEntry, bytes]]] = {}
+    for entry in signable:
+        section = named_sections.get(entry.raw_name)
+        expected = _v1_digest(section[1], '-digest') if section else None
+        if expected is None:
+            raise VerificationError(f"Entry not signed by v1: {entry.name}")
+        algorithm, digest = expected
+        if entry_digests is not None and algorithm == entry_digest_algorithm and entry.raw_name in entry_digests:
+            if entry_digests[entry.raw_name] != digest:
+                raise VerificationError(f"v1 digest mismatch: {entry.name}")
+        else:
+            pending.setdefault(algorithm, []).append((entry, digest))
+
+    for algorithm, items in pending.items():
+        computed = jarsign.digest_entries(data, [entry for entry, _ in items], algorithm)
+        for (entry, expected), actual in zip(items, computed):
+            if expected != actual:
+                raise VerificationError(f"v1 digest mismatch: {entry.name}")
+
+    return certificates, sorted(signed_schemes)
+
+# Whole-APK verification
+def verify(data, sections: Optional[apkzip.ZipSections] = None,
+           entries: Optional[Sequence[apkzip.ZipEntry]] = None,
+           chunk_digests: Optional[Sequence[bytes]] = None,
+           entry_digests: Optional[Dict[bytes, bytes]] = None,
+           check_v1: Optional[bool] = None,
+           entry_digest_algorithm: str = 'SHA-256') -> VerificationResult:
+    """Verify every signature scheme in an APK buffer.
+
+    check_v1=None checks the v1 signature only when there is no v2/v3
+    signature, as Android 7.0+ does; digesting every entry is the
+    expensive part of verifying v1. An unsigned APK gets no errors and
+    nothing verified.
+    """
+    started = time.perf_counter()
+    verified = []
+    signers = []
+    errors = []
+
+    try:
+        if sections is None:
+            sections = apkzip.find_zip_sections(data)
+        if entries is None:
+            entries = apkzip.read_entries(data, sections)
+        pairs = signing_block_pairs(data, sections)
+    except (apkzip.ZipFormatError, VerificationError, struct.error) as e:
+        return VerificationResult((), [], [f"Not a valid APK: {e}"], time.perf_counter() - started)
+
+    digest_for = _content_digests(data, sections, chunk_digests)
+    stripping_protected = False
+    for scheme, block_id in (('v2', V2_BLOCK_ID), ('v3', V3_BLOCK_ID)):
+        if block_id not in pairs:
+            continue
+        try:
+            scheme_signers = _Reader(pairs[block_id]).lp_seq()
+            if not scheme_signers:
+                raise VerificationError("No signers in block")
+            certificates = []
+            for signer in scheme_signers:
+                certificate, attributes = _verify_scheme_signer(signer, scheme, digest_for)
+                certificates.append(certificate)
+                if STRIPPING_PROTECTION_ATTR_ID in attributes:
+                    stripping_protected = True
+            verified.append(scheme)
+            signers.extend(SignerCertificate(scheme, certificate) for certificate in certificates)
+        except (VerificationError, ValueError, apkzip.ZipFormatError) as e:
+            errors.append(f"{scheme}: {e}")
+
+    if stripping_protected and V3_BLOCK_ID not in pairs:
+        errors.append("v2: signed with v3, but the v3 block was removed")
+
+    if check_v1 is None:
+        # An APK with no signature at all is unsigned, not invalid
+        check_v1 = (not (V2_BLOCK_ID in pairs or V3_BLOCK_ID in pairs) and
+                    any(_SIGNATURE_BLOCK_RE.match(entry.name) for entry in entries))
+    if check_v1:
+        try:
+            certificates, signed_schemes = verify_v1(data, entries, entry_digests, entry_digest_algorithm)
+            verified.insert(0, 'v1')
+            signers[:0] = [SignerCertificate('v1', certificate) for certificate in certificates]
+            missing = [f"v{n}" for n in signed_schemes if n in (2, 3) and f"v{n}" not in verified]
+            if missing:
+                errors.append(f"v1: APK was also signed with {', '.join(missing)}, but that signature is missing or invalid")
+        except (VerificationError, ValueError, zlib.error, apkzip.ZipFormatError, jarsign.JarSignatureError) as e:
+            errors.append(f"v1: {e}")
+
+    return VerificationResult(tuple(verified), signers, errors, time.perf_counter() - started)
+
+def _check_budget(result: VerificationResult, size: int, path: str):
+    # One extra MB's worth covers the fixed cost (parsing, public key operations)
+    budget = (size / (1024 * 1024) + 1) * VERIFY_BUDGET_MS_PER_MB / 1000
+    if result.elapsed > budget:
+        logger.warning(
+            f"Verifying {path} took {result.elapsed * 1000:.0f}ms, over the "
+            f"{budget * 1000:.0f}ms budget ({VERIFY_BUDGET_MS_PER_MB}ms/MB)"
+        )
+
+def verify_apk(file_path: str, check_v1: Optional[bool] = None) -> VerificationResult:
+    """Verify the signatures of an APK on disk and report its signer certificates"""
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            result = verify(data, check_v1=check_v1)
+            size = len(data)
+
+    _check_budget(result, size, file_path)
+    return result
+
+def verify_signed_output(file_path: str, key: SignerKey, chunk_digests: Sequence[bytes],
+                         entry_digests: Dict[bytes, bytes],
+                         entry_digest_algorithm: str = 'SHA-256') -> VerificationResult:
+    """Self-check of a freshly signed APK, reusing the digests computed while signing.
+
+    Raises VerificationError unless v1, v2 and v3 all verify and every
+    signer is key.
+    """
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            result = verify(data, chunk_digests=chunk_digests, entry_digests=entry_digests, check_v1=True,
+                            entry_digest_algorithm=entry_digest_algorithm)
+            size = len(data)
+
+    _check_budget(result, size, file_path)
+    if result.errors or result.verified != ('v1', 'v2', 'v3'):
+        raise VerificationError(f"Signed APK failed verification: {'; '.join(result.errors) or result.verified}")
+    if any(signer.certificate_der != key.certificate_der for signer in result.signers):
+        raise VerificationError("Signed APK carries a certificate other than the signing key's")
+    return result
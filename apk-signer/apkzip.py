@@ -0,0 +1,231 @@
+import struct
+import zlib
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# Low-level ZIP structures shared by the signing, alignment and inspection code.
+# Only what APKs need is supported: no ZIP64, no encryption, no multi-disk.
+
+APK_SIG_BLOCK_MAGIC = b'APK Sig Block 42'
+
+EOCD_SIGNATURE = b'PK\x05\x06'
+EOCD_MIN_SIZE = 22
+EOCD_CD_SIZE_OFFSET = 12
+EOCD_CD_OFFSET_OFFSET = 16
+
+CD_SIGNATURE = b'PK\x01\x02'
+CD_HEADER_SIZE = 46
+CD_LOCAL_OFFSET_OFFSET = 42
+
+LOCAL_SIGNATURE = b'PK\x03\x04'
+LOCAL_HEADER_SIZE = 30
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+FLAG_UTF8 = 0x800
+
+DOS_DATE_1981 = (1 << 9) | (1 << 5) | 1  # 1981-01-01, a fixed date for generated entries
+
+class ZipFormatError(Exception):
+    """Raised when an archive is not a ZIP layout we can handle"""
+    pass
+
+class ZipSections(NamedTuple):
+    """Offsets of the top-level parts of an APK"""
+    entries_end: int  # End of ZIP entries (start of signing block, if any)
+    cd_offset: int
+    cd_size: int
+    eocd_offset: int
+
+class ZipEntry(NamedTuple):
+    """One central directory record"""
+    name: str
+    raw_name: bytes
+    flags: int
+    method: int
+    crc: int
+    compressed_size: int
+    uncompressed_size: int
+    local_offset: int
+    cd_record: bytes  # The record as stored, for copying into a new central directory
+
+    @property
+    def is_dir(self) -> bool:
+        return self.name.endswith('/')
+
+# Archive layout
+EOCD_SEARCH_SIZE = EOCD_MIN_SIZE + 0xffff  # The EOCD is followed only by its comment (at most 64 KiB)
+
+def _find_eocd(data) -> int:
+    """Offset of the EOCD record in data, which must hold at least the file's last EOCD_SEARCH_SIZE bytes"""
+    size = len(data)
+    if size < EOCD_MIN_SIZE:
+        raise ZipFormatError("File too small to be a ZIP archive")
+
+    search_start = max(0, size - EOCD_SEARCH_SIZE)
+    eocd_offset = data.rfind(EOCD_SIGNATURE, search_start, size - EOCD_MIN_SIZE + 4)
+    while eocd_offset != -1:
+        comment_length = struct.unpack_from('<H', data, eocd_offset + 20)[0]
+        if eocd_offset + EOCD_MIN_SIZE + comment_length == size:
+            break
+        eocd_offset = data.rfind(EOCD_SIGNATURE, search_start, eocd_offset)
+    if eocd_offset == -1:
+        raise ZipFormatError("ZIP End of Central Directory not found")
+    return eocd_offset
+
+def _central_directory_location(data, eocd_offset: int, base: int = 0) -> Tuple[int, int]:
+    cd_size, cd_offset = struct.unpack_from('<II', data, eocd_offset + EOCD_CD_SIZE_OFFSET)
+    if cd_offset == 0xffffffff or cd_size == 0xffffffff:
+        raise ZipFormatError("ZIP64 archives are not supported")
+    if cd_offset + cd_size != base + eocd_offset:
+        raise ZipFormatError("Central directory is not directly followed by EOCD")
+    return cd_offset, cd_size
+
+def find_zip_sections(data) -> ZipSections:
+    """Locate the central directory and EOCD, skipping an existing signing block"""
+    eocd_offset = _find_eocd(data)
+    cd_offset, cd_size = _central_directory_location(data, eocd_offset)
+    return ZipSections(find_signing_block(data, cd_offset), cd_offset, cd_size, eocd_offset)
+
+def sections_from_tail(tail: bytes, file_size: int) -> Optional[Tuple[ZipSections, bytes]]:
+    """Locate the sections from only the last bytes of a file.
+
+    Returns the sections and the central directory bytes, or None when
+    the central directory (and the signing block footer before it) does
+    not fit in the tail.
+    """
+    base = file_size - len(tail)
+    if base == 0:
+        sections = find_zip_sections(tail)
+        return sections, tail[sections.cd_offset:sections.eocd_offset]
+
+    eocd_offset = _find_eocd(tail)
+    cd_offset, cd_size = _central_directory_location(tail, eocd_offset, base)
+    relative_cd = cd_offset - base
+    if relative_cd < 24:
+        return None
+
+    entries_end = cd_offset
+    if tail[relative_cd - 16:relative_cd] == APK_SIG_BLOCK_MAGIC:
+        block_size = struct.unpack_from('<Q', tail, relative_cd - 24)[0]
+        entries_end = cd_offset - block_size - 8
+        if entries_end < 0:
+            raise ZipFormatError("Corrupted APK Signing Block")
+
+    sections = ZipSections(entries_end, cd_offset, cd_size, base + eocd_offset)
+    return sections, tail[relative_cd:relative_cd + cd_size]
+
+def find_signing_block(data, cd_offset: int) -> int:
+    """Return the offset of the APK Signing Block, or cd_offset if there is none"""
+    if cd_offset < 32 or data[cd_offset - 16:cd_offset] != APK_SIG_BLOCK_MAGIC:
+        return cd_offset
+
+    block_size = struct.unpack_from('<Q', data, cd_offset - 24)[0]
+    block_offset = cd_offset - block_size - 8
+    if block_offset < 0 or struct.unpack_from('<Q', data, block_offset)[0] != block_size:
+        raise ZipFormatError("Corrupted APK Signing Block")
+    return block_offset
+
+def patch_eocd(eocd: bytes, cd_offset: int) -> bytes:
+    """Return a copy of the EOCD pointing at a new central directory offset"""
+    patched = bytearray(eocd)
+    struct.pack_into('<I', patched, EOCD_CD_OFFSET_OFFSET, cd_offset)
+    return bytes(patched)
+
+def build_eocd(entry_count: int, cd_size: int, cd_offset: int) -> bytes:
+    return EOCD_SIGNATURE + struct.pack(
+        '<HHHHIIH', 0, 0, entry_count, entry_count, cd_size, cd_offset, 0
+    )
+
+# Central directory
+_CD_RECORD = struct.Struct('<4sHHHHHHIIIHHHHHII')
+
+def read_entries(data, sections: ZipSections) -> List[ZipEntry]:
+    """Parse every central directory record, in directory order"""
+    # One copy of the directory is cheaper than slicing the mmap per field
+    cd = bytes(data[sections.cd_offset:sections.cd_offset + sections.cd_size])
+    return parse_central_directory(cd, sections.cd_offset)
+
+def parse_central_directory(cd: bytes, cd_offset: int = 0) -> List[ZipEntry]:
+    """Parse central directory records already read into memory"""
+    unpack = _CD_RECORD.unpack_from
+    entries = []
+    offset = 0
+    while offset < len(cd):
+        try:
+            (signature, _, _, flags, method, _, _, crc, compressed_size, uncompressed_size,
+             name_length, extra_length, comment_length, _, _, _, local_offset) = unpack(cd, offset)
+        except struct.error:
+            raise ZipFormatError("Truncated central directory")
+        if signature != CD_SIGNATURE:
+            raise ZipFormatError(f"Bad central directory record at {cd_offset + offset}")
+
+        name_end = offset + CD_HEADER_SIZE + name_length
+        record_end = name_end + extra_length + comment_length
+        raw_name = cd[offset + CD_HEADER_SIZE:name_end]
+        # Android always decodes entry names as UTF-8
+        name = raw_name.decode('utf-8', errors='replace')
+        entries.append(ZipEntry(
+            name, raw_name, flags, method, crc, compressed_size, uncompressed_size,
+            local_offset, cd[offset:record_end]
+        ))
+        offset = record_end
+
+    return entries
+
+def relocated_cd_record(entry: ZipEntry, local_offset: int) -> bytes:
+    """Central directory record of entry, pointing at its new local header offset"""
+    record = bytearray(entry.cd_record)
+    struct.pack_into('<I', record, CD_LOCAL_OFFSET_OFFSET, local_offset)
+    return bytes(record)
+
+# Local headers and entry data
+def local_header_size(data, entry: ZipEntry) -> Tuple[int, int]:
+    """Return (header length including name and extra, extra field length)"""
+    offset = entry.local_offset
+    if data[offset:offset + 4] != LOCAL_SIGNATURE:
+        raise ZipFormatError(f"Bad local header for {entry.name}")
+    name_length, extra_length = struct.unpack_from('<HH', data, offset + 26)
+    return LOCAL_HEADER_SIZE + name_length + extra_length, extra_length
+
+def data_offset(data, entry: ZipEntry) -> int:
+    return entry.local_offset + local_header_size(data, entry)[0]
+
+def iter_uncompressed(data, entry: ZipEntry, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Yield entry contents in bounded chunks, inflating from the archive buffer"""
+    start = data_offset(data, entry)
+    view = memoryview(data)[start:start + entry.compressed_size]
+    if entry.method == METHOD_STORED:
+        for i in range(0, len(view), chunk_size):
+            yield view[i:i + chunk_size]
+        return
+    if entry.method != METHOD_DEFLATED:
+        raise ZipFormatError(f"Unsupported compression method {entry.method} for {entry.name}")
+
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    for i in range(0, len(view), chunk_size):
+        pending = view[i:i + chunk_size]
+        # Bound each output step so a zip bomb cannot exhaust memory
+        while pending:
+            yield inflater.decompress(pending, chunk_size)
+            pending = inflater.unconsumed_tail
+    tail = inflater.flush()
+    if tail:
+        yield tail
+
+def build_entry(name: str, payload: bytes, local_offset: int) -> Tuple[bytes, bytes]:
+    """Build a deflated entry; returns (local header + data, central directory record)"""
+    raw_name = name.encode('utf-8')
+    deflater = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = deflater.compress(payload) + deflater.flush()
+    crc = zlib.crc32(payload)
+    flags = FLAG_UTF8 if not raw_name.isascii() else 0
+
+    local = LOCAL_SIGNATURE + struct.pack(
+        '<HHHHHIIIHH', 20, flags, METHOD_DEFLATED, 0, DOS_DATE_1981,
+        crc, len(compressed), len(payload), len(raw_name), 0
+    ) + raw_name + compressed
+    record = CD_SIGNATURE + struct.pack(
+        '<HHHHHHIIIHHHHHII', 20, 20, flags, METHOD_DEFLATED, 0, DOS_DATE_1981,
+        crc, len(compressed), len(payload), len(raw_name), 0, 0, 0, 0, 0, local_offset
+    ) + raw_name
+    return local, record
@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Awaitable, Any
+
+import db
+from config import DB_READER_THREADS, ACTIVITY_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Awaitable versions of the db.* functions for use inside handlers.
+# Writes are serialized on a single thread so they never fight over the
+# SQLite write lock; reads run on a small pool and, thanks to WAL, are not
+# blocked by an in-flight write. The event loop itself never touches SQLite.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="db-reader")
+
+def _run_in(executor: ThreadPoolExecutor, func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Wrap a blocking db function as a coroutine running on executor"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+def _reader(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    return _run_in(_readers, func)
+
+def _writer_op(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    return _run_in(_writer, func)
+
+# User Operations
+add_user = _writer_op(db.add_user)
+get_user = _reader(db.get_user)
+_get_user_context = _reader(db.get_user_context)
+flush_user_activity = _writer_op(db.flush_user_activity)
+get_user_balance = _reader(db.get_user_balance)
+update_balance = _writer_op(db.update_balance)
+block_user = _writer_op(db.block_user)
+is_user_blocked = _reader(db.is_user_blocked)
+
+# Transaction Operations
+add_transaction = _writer_op(db.add_transaction)
+get_user_transactions = _reader(db.get_user_transactions)
+
+# Debit Operations
+debit_if_sufficient = _writer_op(db.debit_if_sufficient)
+reserve_funds = _writer_op(db.reserve_funds)
+commit_reservation = _writer_op(db.commit_reservation)
+release_reservation = _writer_op(db.release_reservation)
+
+# Deposit Operations
+claim_txid = _writer_op(db.claim_txid)
+complete_deposit = _writer_op(db.complete_deposit)
+release_txid = _writer_op(db.release_txid)
+
+# Deposit Intent Operations
+create_deposit_intent = _writer_op(db.create_deposit_intent)
+get_deposit_cursor = _reader(db.get_deposit_cursor)
+settle_incoming_transfers = _writer_op(db.settle_incoming_transfers)
+
+# APK Operations
+add_signed_apk = _writer_op(db.add_signed_apk)
+find_signed_apk = _reader(db.find_signed_apk)
+
+# Keystore Operations
+save_user_keystore = _writer_op(db.save_user_keystore)
+get_user_keystore_version = _reader(db.get_user_keystore_version)
+delete_user_keystore = _writer_op(db.delete_user_keystore)
+
+# TRON Lookup Cache Operations
+save_tron_transaction = _writer_op(db.save_tron_transaction)
+get_tron_transaction = _reader(db.get_tron_transaction)
+
+# Support Operations
+add_support_message = _writer_op(db.add_support_message)
+get_support_messages = _reader(db.get_support_messages)
+
+# Statistics Operations
+get_stats = _reader(db.get_stats)
+get_daily_signings = _reader(db.get_daily_signings)
+rebuild_stats = _writer_op(db.rebuild_stats)
+
+# Admin Operations
+get_total_users = _reader(db.get_total_users)
+get_total_balance = _reader(db.get_total_balance)
+get_all_user_ids = _reader(db.get_all_user_ids)
+find_user_by_username = _reader(db.find_user_by_username)
+
+# Settings Operations
+get_setting = _reader(db.get_setting)
+set_setting = _writer_op(db.set_setting)
+
+async def get_user_context(user_id: int):
+    """Get a user's context, answering cache hits without a thread hop"""
+    context = db.user_context_cache.get(user_id)
+    if context is not None:
+        return context
+    return await _get_user_context(user_id)
+
+async def update_user_activity(user_id: int):
+    """Buffer activity on the event loop; only a full buffer costs a write"""
+    if db.record_user_activity(user_id):
+        await flush_user_activity()
+
+async def run_activity_flusher(interval: float = ACTIVITY_FLUSH_INTERVAL):
+    """Periodically write buffered activity until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        await flush_user_activity()
+
+def shutdown():
+    """Drain pending writes, stop the worker threads and close connections"""
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    db.flush_user_activity()
+    db.close_connections()
+    logger.info("Async database layer stopped")
@@ -0,0 +1,147 @@
+import struct
+from typing import NamedTuple, Optional
+
+# Minimal reader for Android binary XML (the compiled AndroidManifest.xml).
+# It walks the chunk stream once and decodes only the strings it needs.
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+
+STRING_POOL_UTF8 = 0x100
+
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+
+NO_INDEX = 0xffffffff
+
+# android: attribute resource IDs, which stay valid when attribute names are obfuscated
+ATTR_VERSION_CODE = 0x0101021b
+ATTR_VERSION_NAME = 0x0101021c
+ATTR_MIN_SDK_VERSION = 0x0101020c
+
+class AXMLError(Exception):
+    """Raised when a binary XML document is malformed"""
+    pass
+
+class ManifestInfo(NamedTuple):
+    """What the bot needs from AndroidManifest.xml"""
+    package: Optional[str]
+    version_code: Optional[int]
+    version_name: Optional[str]
+    min_sdk: Optional[int]
+
+class _StringPool:
+    """String pool that decodes entries on first use"""
+
+    def __init__(self, data: bytes, offset: int):
+        header_size = struct.unpack_from('<H', data, offset + 2)[0]
+        (self.count, _, flags, strings_start, _) = struct.unpack_from('<IIIII', data, offset + 8)
+        self.data = data
+        self.utf8 = bool(flags & STRING_POOL_UTF8)
+        self.offsets_at = offset + header_size
+        self.strings_at = offset + strings_start
+        self.cache = {}
+
+    def get(self, index: int) -> Optional[str]:
+        if index == NO_INDEX:
+            return None
+        if index >= self.count:
+            raise AXMLError(f"String index {index} out of range")
+        if index not in self.cache:
+            offset = self.strings_at + struct.unpack_from('<I', self.data, self.offsets_at + index * 4)[0]
+            self.cache[index] = self._decode(offset)
+        return self.cache[index]
+
+    def _decode(self, offset: int) -> str:
+        data = self.data
+        if self.utf8:
+            # UTF-16 length, then UTF-8 byte length, each 1 or 2 bytes
+            offset += 2 if data[offset] & 0x80 else 1
+            length = data[offset]
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | data[offset + 1]
+                offset += 1
+            offset += 1
+            return data[offset:offset + length].decode('utf-8', errors='replace')
+
+        length = struct.unpack_from('<H', data, offset)[0]
+        offset += 2
+        if length & 0x8000:
+            length = ((length & 0x7fff) << 16) | struct.unpack_from('<H', data, offset)[0]
+            offset += 2
+        return data[offset:offset + length * 2].decode('utf-16-le', errors='replace')
+
+def _attribute_value(pool: _StringPool, data: bytes, offset: int):
+    """Decode one attribute: strings as str, integers as int, anything else as None"""
+    raw_value = struct.unpack_from('<I', data, offset + 8)[0]
+    data_type, value = struct.unpack_from('<BI', data, offset + 15)
+    if data_type == TYPE_STRING:
+        return pool.get(value)
+    if data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+        return value
+    if raw_value != NO_INDEX:
+        return pool.get(raw_value)
+    return None
+
+def _as_int(value) -> Optional[int]:
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+def parse_manifest(data: bytes) -> ManifestInfo:
+    """Extract package, version and minSdk from a binary AndroidManifest.xml"""
+    try:
+        chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+        if chunk_type != RES_XML_TYPE:
+            raise AXMLError("Not a binary XML document")
+        if size > len(data):
+            raise AXMLError("Truncated binary XML")
+        end = size
+
+        pool = None
+        resource_ids = ()
+        found = {}
+        offset = header_size
+        while offset + 8 <= end:
+            chunk_type, header_size, size = struct.unpack_from('<HHI', data, offset)
+            if size < 8:
+                raise AXMLError(f"Bad chunk size at {offset}")
+
+            if chunk_type == RES_STRING_POOL_TYPE and pool is None:
+                pool = _StringPool(data, offset)
+            elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+                count = (size - header_size) // 4
+                resource_ids = struct.unpack_from(f'<{count}I', data, offset + header_size)
+            elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+                if pool is None:
+                    raise AXMLError("Element before string pool")
+                ext = offset + header_size
+                name_index, attr_start, attr_size, attr_count = struct.unpack_from('<4xIHHH', data, ext)
+                element = pool.get(name_index)
+                if element in ('manifest', 'uses-sdk'):
+                    for i in range(attr_count):
+                        attr = ext + attr_start + i * attr_size
+                        attr_name = struct.unpack_from('<I', data, attr + 4)[0]
+                        resource_id = resource_ids[attr_name] if attr_name < len(resource_ids) else None
+                        key = resource_id or pool.get(attr_name)
+                        found[(element, key)] = _attribute_value(pool, data, attr)
+                    if element == 'uses-sdk':
+                        # Everything we need comes before or in <uses-sdk>
+                        break
+
+            offset += size
+    except struct.error as e:
+        raise AXMLError(f"Truncated binary XML: {e}")
+
+    version_name = found.get(('manifest', ATTR_VERSION_NAME))
+    return ManifestInfo(
+        package=found.get(('manifest', 'package')),
+        version_code=_as_int(found.get(('manifest', ATTR_VERSION_CODE))),
+        version_name=str(version_name) if version_name is not None else None,
+        min_sdk=_as_int(found.get(('uses-sdk', ATTR_MIN_SDK_VERSION))),
+    )
@@ -0,0 +1,82 @@
+"""Database hot paths: warm tuned connections versus a connection per call.
+
+Runs get_user, update_balance and add_transaction N times each through
+db.py as it is, then again with get_connection() patched to open a new
+untuned connection for every call (rollback journal, synchronous=FULL),
+as db.py did before the connection manager.
+
+    python benchmarks/bench_db.py [--ops 10000] [--users 1000]
+"""
+import argparse
+import sqlite3
+import time
+import weakref
+
+from common import workdir
+
+import db
+
+class _Connection(sqlite3.Connection):
+    """A plain connection that can be weakly referenced"""
+
+_last_connection = None
+
+def connect_per_call() -> sqlite3.Connection:
+    """The old get_connection(): a fresh connection, closed once unreferenced.
+
+    Calls made inside a write transaction get its connection, as nested
+    helpers did when they were passed the caller's cursor.
+    """
+    global _last_connection
+    conn = _last_connection() if _last_connection is not None else None
+    if conn is not None and conn.in_transaction:
+        return conn
+    conn = sqlite3.connect(db.DB_PATH, isolation_level=None, factory=_Connection)
+    conn.row_factory = sqlite3.Row
+    _last_connection = weakref.ref(conn)  # Weak, so the connection still closes once unused
+    return conn
+
+def setup(path: str, users: int, journal_mode: str):
+    db.use_database(path)
+    db.init_db()
+    for user_id in range(users):
+        db.add_user(user_id, f'user{user_id}')
+    db.get_connection().execute(f'PRAGMA journal_mode = {journal_mode}')
+    db.close_connections()
+    db._local.conn = None
+
+def run(label: str, ops: int, users: int):
+    operations = [
+        ('get_user', lambda i: db.get_user(i % users)),
+        ('update_balance', lambda i: db.update_balance(i % users, 1.0, 'deposit', 'bench')),
+        ('add_transaction', lambda i: db.add_transaction(i % users, 'deposit', 1.0)),
+    ]
+    for name, operation in operations:
+        db.invalidate_user_context()
+        started = time.perf_counter()
+        for i in range(ops):
+            operation(i)
+        elapsed = time.perf_counter() - started
+        print(f"{label:18s} {name:16s} {ops / elapsed:9.0f} ops/s {elapsed / ops * 1e6:8.1f} us/op")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    workdir()
+
+    setup('per_call.db', args.users, 'DELETE')
+    tuned_get_connection = db.get_connection
+    db.get_connection = connect_per_call
+    try:
+        run('connect per call', args.ops, args.users)
+    finally:
+        db.get_connection = tuned_get_connection
+
+    setup('tuned.db', args.users, 'WAL')
+    run('warm connection', args.ops, args.users)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""DepositWatcher against mock_chain.MockChain: 500 and 1500 open deposit intents.
+
+Each size runs in its own process on a fresh database. Every user opens
+one intent; 90% of them pay it, half by memo with a round amount and
+half by the intent's exact amount without a memo. Unrelated transfers
+to the same address, transfers to another address and second payments
+of an intent already paid are mixed in. The watcher polls until a poll
+credits nothing. The script then checks that exactly the paid intents
+were credited, each user's balance is what they sent, unpaid intents
+are still pending, and the stats rollup has not drifted.
+
+    python benchmarks/bench_deposit_watcher.py [--intents 500 1500]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+from common import workdir
+
+import db
+import trx
+from deposit_watcher import DepositWatcher
+from mock_chain import MockChain
+
+PORT = 18092
+BASE = f'http://127.0.0.1:{PORT}'
+ADDRESS = trx.hex_to_base58('41' + '5a' * 20)  # The bot's deposit address
+OTHER_ADDRESS = trx.hex_to_base58('41' + 'a5' * 20)
+
+def fail(message: str):
+    raise SystemExit(f"FAILED: {message}")
+
+def open_intents(count: int, rnd: random.Random) -> list:
+    intents = []
+    for user_id in range(1, count + 1):
+        db.add_user(user_id, f'user{user_id}')
+        intent = db.create_deposit_intent(user_id, rnd.randint(1, 50))
+        if intent is None:
+            fail(f"no deposit intent for user {user_id}")
+        intents.append((user_id, intent))
+    return intents
+
+def make_transfers(chain: MockChain, intents: list, rnd: random.Random) -> dict:
+    """Add the transfers to the chain; returns the SUN each user should be credited"""
+    expected = {}
+    payments = []
+    for user_id, intent in intents:
+        roll = rnd.random()
+        if roll < 0.45:
+            # Memo and a round amount: matched by the memo
+            payments.append((intent['amount_sun'] // 1_000_000 * 1_000_000, intent['memo']))
+        elif roll < 0.9:
+            payments.append((intent['amount_sun'], ''))
+        else:
+            continue  # Never paid
+        expected[user_id] = payments[-1][0]
+        if rnd.random() < 0.02:
+            payments.append(payments[-1])  # Paid twice: only the first counts
+    for _ in range(len(intents) // 5):
+        payments.append((rnd.randint(1, 100) * 1_000_000 + 1, ''))  # Matches no intent
+    rnd.shuffle(payments)
+
+    timestamp = int(time.time() * 1000)
+    for i, (amount_sun, memo) in enumerate(payments):
+        # A few transfers per block, so pages split blocks
+        chain.add_transfer(ADDRESS, amount_sun, memo, timestamp=timestamp + i // 3)
+        if i % 10 == 0:
+            chain.add_transfer(OTHER_ADDRESS, amount_sun, memo, timestamp=timestamp + i // 3)
+    return expected
+
+async def run(count: int):
+    from aiohttp import web
+
+    rnd = random.Random(count)
+    chain = MockChain()
+    runner = web.AppRunner(chain.app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    api = trx.TronAPI(BASE, f'{BASE}/api')
+    try:
+        intents = open_intents(count, rnd)
+        expected = make_transfers(chain, intents, rnd)
+        watcher = DepositWatcher(ADDRESS, api)
+
+        polls = []
+        while True:
+            requests = chain.requests
+            started = time.perf_counter()
+            settled = await watcher.poll()
+            polls.append((len(settled), chain.requests - requests, time.perf_counter() - started))
+            if not settled:
+                break
+    finally:
+        await api.close()
+        await runner.cleanup()
+
+    for i, (credited, requests, elapsed) in enumerate(polls, 1):
+        print(f"{count:5d} intents, poll {i}: credited {credited:5d} in {elapsed * 1000:6.0f} ms, "
+              f"{requests} page requests")
+
+    if watcher.credited != len(expected):
+        fail(f"credited {watcher.credited} deposits, expected {len(expected)}")
+    for user_id, _ in intents:
+        balance = db.get_user_balance(user_id)
+        if abs(balance - expected.get(user_id, 0) / 1_000_000) > 1e-9:
+            fail(f"user {user_id} has {balance} TRX, expected {expected.get(user_id, 0) / 1_000_000}")
+    pending = db.get_connection().execute(
+        "SELECT COUNT(*) FROM deposit_intents WHERE status = 'pending'"
+    ).fetchone()[0]
+    if pending != len(intents) - len(expected):
+        fail(f"{pending} intents still pending, expected {len(intents) - len(expected)}")
+    drifted = db.rebuild_stats()
+    if drifted:
+        fail(f"stats rollup drifted: {drifted}")
+    print(f"{count:5d} intents: {len(expected)} credited, balances match, "
+          f"{pending} unpaid still pending, stats rollup exact")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--intents', type=int, nargs='+', default=[500, 1500])
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        workdir()
+        db.use_database('bench.db')
+        db.init_db()
+        asyncio.run(run(args.one))
+        return
+    for count in args.intents:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--one', str(count)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""End-to-end job latency with the cloud Bot API versus a local Bot API server.
+
+A stand-in Bot API server (getFile, file downloads and sendDocument)
+runs in its own process, under /cloud and /local. For each APK size the
+job runs as the bot runs it: getFile, then download (cloud) or hash in
+place in the server's directory (local), inspection, signing and
+sendDocument as a multipart upload (cloud) or a file:// path (local).
+
+The real cloud API refuses bot downloads over 20 MB and uploads over
+50 MB; the stand-in serves them anyway, to show what the transfers
+cost. Transfers run at loopback speed unless --mbps caps them.
+
+    python benchmarks/bench_local_bot_api.py [--sizes 20 100 500] [--mbps 0]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import workdir, make_apk
+
+import ingest
+import sign
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from handlers.sign_apk import _upload_source
+
+PORT = 18081
+TOKEN = '123456:' + 'A' * 35
+CLOUD_LIMIT = 50 * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+
+def serve(root: str, mbps: float):
+    """The stand-in server; files live in root, its working directory"""
+    from aiohttp import web
+
+    async def throttle(size: int):
+        if mbps:
+            await asyncio.sleep(size * 8 / (mbps * 1e6))
+
+    def ok(result) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_file(request):
+        file_id = (await request.post())['file_id']
+        path = os.path.join(root, file_id)
+        local = request.match_info['mode'] == 'local'
+        return ok({
+            'file_id': file_id, 'file_unique_id': file_id, 'file_size': os.path.getsize(path),
+            # A local server answers with the path in its working directory
+            'file_path': path if local else f'documents/{file_id}',
+        })
+
+    async def download(request):
+        path = os.path.join(root, os.path.basename(request.match_info['path']))
+        response = web.StreamResponse(headers={'Content-Length': str(os.path.getsize(path))})
+        await response.prepare(request)
+        with open(path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                await throttle(len(chunk))
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def send_document(request):
+        received = 0
+        if request.content_type == 'multipart/form-data':
+            # Uploaded file, referenced from the document field as attach://<part name>
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                while part.filename is not None and (chunk := await part.read_chunk(CHUNK_SIZE)):
+                    received += len(chunk)
+                    await throttle(len(chunk))
+        else:
+            # A file:// path: the local server reads the file itself
+            document = (await request.post())['document']
+            with open(document[len('file://'):], 'rb') as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    received += len(chunk)
+        return ok({
+            'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+            'document': {'file_id': f'signed{received}', 'file_unique_id': 'signed'},
+        })
+
+    app = web.Application(client_max_size=4 * 1024 ** 3)
+    app.router.add_post('/{mode}/bot{token}/getFile', get_file)
+    app.router.add_post('/{mode}/bot{token}/sendDocument', send_document)
+    app.router.add_get('/{mode}/file/bot{token}/{path:.+}', download)
+    app.router.add_get('/ping', lambda request: web.Response(text='ok'))
+    web.run_app(app, host='127.0.0.1', port=PORT, print=None)
+
+async def run_job(mode: str, file_id: str, max_size: int) -> dict:
+    """One signing job; returns the seconds spent in each stage"""
+    local = mode == 'local'
+    api = TelegramAPIServer.from_base(f'http://127.0.0.1:{PORT}/{mode}', is_local=local)
+    bot = Bot(TOKEN, session=AiohttpSession(api=api, timeout=600))
+    timings = {}
+    try:
+        started = time.perf_counter()
+        file_info = await bot.get_file(file_id)
+        timings['getFile'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if local:
+            path = file_info.file_path
+            ingested = await asyncio.to_thread(ingest.ingest_local_file, path, max_size)
+        else:
+            path = f'{mode}_{file_id}'
+            ingested = await ingest.download_document(bot, file_info.file_path, path, max_size)
+        timings['fetch'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        info = await asyncio.to_thread(sign.get_apk_info, path, ingested.central_directory)
+        assert info['valid']
+        timings['inspect'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        signed_path = f'{mode}_signed_{file_id}'
+        await asyncio.to_thread(sign.sign_apk, path, signed_path, ingested.sections)
+        timings['sign'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await bot.send_document(1, _upload_source(bot, signed_path, 'app_signed.apk'), request_timeout=600)
+        timings['send'] = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+    for leftover in (f'{mode}_{file_id}', f'{mode}_signed_{file_id}'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--mbps', type=float, default=0, help="cap transfers to the server, megabits/s")
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.mbps)
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir()
+    root = os.path.abspath('server')
+    os.makedirs(root)
+    max_size = (max(args.sizes) + 10) << 20
+    sign.MAX_FILE_SIZE = max_size
+    make_apk('warm.apk', 2)
+    sign.sign_apk('warm.apk', 'warm_signed.apk')  # Key and imports are not part of a job
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', root,
+                               '--mbps', str(args.mbps)])
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{PORT}/ping').read()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        for size_mb in args.sizes:
+            file_id = f'app{size_mb}.apk'
+            make_apk(os.path.join(root, file_id), size_mb)
+            for mode in ('cloud', 'local'):
+                timings = asyncio.run(run_job(mode, file_id, max_size))
+                note = ' (over the cloud API limit)' if mode == 'cloud' and size_mb << 20 > CLOUD_LIMIT else ''
+                print(f"{size_mb:4d} MB {mode:5s}: total {sum(timings.values()):6.2f}s  " +
+                      "  ".join(f"{stage} {seconds:5.2f}s" for stage, seconds in timings.items()) + note)
+            os.remove(os.path.join(root, file_id))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
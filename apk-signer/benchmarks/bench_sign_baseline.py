@@ -0,0 +1,91 @@
+"""In-process sign.sign_apk versus the jarsigner/zipalign subprocess pipeline it replaced.
+
+Both sign the same synthetic APKs with the same key (the bot key, exported
+to a PKCS#12 keystore for the JDK tools). The baseline runs as the old
+code would have: jarsigner, then zipalign, a JVM start per job; when
+apksigner is on PATH as well, zipalign then apksigner (v2/v3, like
+sign_apk) is timed too. Without the tools on PATH (no JDK or Android
+build-tools) the baseline is skipped.
+
+    python benchmarks/bench_sign_baseline.py [--sizes 10 45] [--runs 3]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import time
+
+from common import workdir, make_apk
+
+import keystore
+import sign
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+STORE_PASSWORD = 'benchmark'
+ALIAS = 'bench'
+
+def export_keystore(path: str):
+    """Write the bot key and certificate to a PKCS#12 keystore the JDK tools can read"""
+    key = keystore.registry.get(keystore.DEFAULT_KEY)
+    with open(path, 'wb') as f:
+        f.write(pkcs12.serialize_key_and_certificates(
+            ALIAS.encode(), key.private_key, key.certificate, None,
+            serialization.BestAvailableEncryption(STORE_PASSWORD.encode())
+        ))
+
+def jarsigner_zipalign(input_path: str, output_path: str):
+    subprocess.run(['jarsigner', '-keystore', 'bench.p12', '-storetype', 'PKCS12',
+                    '-storepass', STORE_PASSWORD, '-digestalg', 'SHA-256', '-sigalg', 'SHA256withRSA',
+                    '-signedjar', 'unaligned.apk', input_path, ALIAS],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(['zipalign', '-p', '-f', '4', 'unaligned.apk', output_path], check=True)
+
+def zipalign_apksigner(input_path: str, output_path: str):
+    subprocess.run(['zipalign', '-p', '-f', '4', input_path, 'aligned.apk'], check=True)
+    subprocess.run(['apksigner', 'sign', '--ks', 'bench.p12', '--ks-pass', f'pass:{STORE_PASSWORD}',
+                    '--out', output_path, 'aligned.apk'], check=True)
+
+def median_time(job, input_path: str, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        job(input_path, 'out.apk')
+        times.append(time.perf_counter() - started)
+    return sorted(times)[runs // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 45])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    workdir()
+
+    baselines = []
+    if shutil.which('jarsigner') and shutil.which('zipalign'):
+        baselines.append(('jarsigner + zipalign', jarsigner_zipalign))
+    if shutil.which('zipalign') and shutil.which('apksigner'):
+        baselines.append(('zipalign + apksigner', zipalign_apksigner))
+    missing = [tool for tool in ('jarsigner', 'zipalign', 'apksigner') if not shutil.which(tool)]
+    if not baselines:
+        print(f"{', '.join(missing)} not on PATH (no JDK or Android build-tools): "
+              "skipping the subprocess baseline")
+
+    make_apk('warm.apk', 2)
+    sign.sign_apk('warm.apk', 'out.apk')  # Key and imports are not part of a job
+    if baselines:
+        export_keystore('bench.p12')
+
+    for size_mb in args.sizes:
+        input_path = f'in{size_mb}.apk'
+        make_apk(input_path, size_mb)
+        sign.MAX_FILE_SIZE = max(sign.MAX_FILE_SIZE, os.path.getsize(input_path))
+        print(f"{size_mb:4d} MB  sign.sign_apk (v1+v2+v3, in-process): "
+              f"{median_time(sign.sign_apk, input_path, args.runs) * 1000:7.0f} ms")
+        for label, job in baselines:
+            print(f"{size_mb:4d} MB  {label + ' (subprocess):':37s} "
+                  f"{median_time(job, input_path, args.runs) * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Signing throughput: in-process pool versus the shared signing daemon.
+
+Signs N copies of a synthetic APK through a bot-local SigningService,
+then through a signing daemon with 1, 2 and 4 bot processes sharing it.
+
+    python benchmarks/bench_sign_daemon.py [--mb 8] [--jobs 24] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from common import ROOT, workdir, make_apk
+
+import sign
+from sign_service import SigningService, ping_daemon
+
+SOCKET = 'bench_daemon.sock'
+
+async def sign_batch(service: SigningService, jobs: int, tag: str):
+    results = await asyncio.gather(*(
+        service.sign_apk('in.apk', f'signed/{tag}{i}.apk') for i in range(jobs)
+    ))
+    assert all(results)
+
+async def median_job(service: SigningService, runs: int = 10) -> float:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await service.sign_apk('in.apk', 'signed/one.apk')
+        times.append(time.perf_counter() - started)
+    return sorted(times)[runs // 2]
+
+def run_client(jobs: int, tag: str, workers: int):
+    """One bot process submitting jobs to the daemon; prints its elapsed time"""
+    async def go():
+        service = SigningService(workers=workers, daemon_socket=SOCKET)
+        service.start()
+        started = time.perf_counter()
+        await sign_batch(service, jobs, tag)
+        return time.perf_counter() - started
+    print(f"{asyncio.run(go()):.3f}")
+
+async def bench_local(jobs: int, workers: int):
+    service = SigningService(workers=workers, daemon_socket=None)
+    started = time.perf_counter()
+    service.start()
+    await service.run(os.getpid)  # Wait for a worker to be up
+    startup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await sign_batch(service, jobs, 'local')
+    elapsed = time.perf_counter() - started
+    single = await median_job(service)
+    service.shutdown()
+    return startup, elapsed, single
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=8)
+    parser.add_argument('--jobs', type=int, default=24)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--client', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        run_client(int(args.client[0]), args.client[1], args.workers)
+        return
+
+    workdir()
+    os.makedirs('signed', exist_ok=True)
+    make_apk('in.apk', args.mb)
+    sign.sign_apk('in.apk', 'signed/warm.apk')  # Creates keys/ before any worker starts
+
+    startup, elapsed, single = asyncio.run(bench_local(args.jobs, args.workers))
+    print(f"in-process pool: startup {startup * 1000:.0f} ms, {args.jobs} jobs in {elapsed:.2f}s "
+          f"({args.jobs / elapsed:.1f} jobs/s), single job {single * 1000:.0f} ms")
+
+    daemon = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'sign_daemon.py')],
+        env={**os.environ, 'SIGN_WORKERS': str(args.workers), 'SIGN_DAEMON_SOCKET': SOCKET},
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while ping_daemon(SOCKET) is None:
+            time.sleep(0.05)
+
+        for bots in (1, 2, 4):
+            clients = [
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), '--workers', str(args.workers),
+                     '--client', str(args.jobs // bots), f'daemon{bots}_{k}_'],
+                    stdout=subprocess.PIPE, text=True
+                )
+                for k in range(bots)
+            ]
+            elapsed = max(float(client.communicate()[0]) for client in clients)
+            jobs = args.jobs // bots * bots
+            print(f"daemon, {bots} bot process(es): {jobs} jobs in {elapsed:.2f}s ({jobs / elapsed:.1f} jobs/s)")
+
+        async def daemon_single():
+            service = SigningService(workers=args.workers, daemon_socket=SOCKET)
+            service.start()
+            return await median_job(service)
+        print(f"daemon single job: {asyncio.run(daemon_single()) * 1000:.0f} ms (no pool startup per bot)")
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+if __name__ == "__main__":
+    main()
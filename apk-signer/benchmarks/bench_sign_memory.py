@@ -0,0 +1,74 @@
+"""Peak memory of sign.sign_apk on synthetic 10, 50 and 200 MB APKs.
+
+Each size is signed in its own process. Anonymous memory (heap and
+buffers) is sampled from /proc during the job; the APK itself is read
+through mmap, so its pages are file-backed and the kernel can drop them
+at any time. Peak RSS, which includes the mapped pages touched, is
+shown as well. Linux only.
+
+    python benchmarks/bench_sign_memory.py [--sizes 10 50 200]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from common import workdir, make_apk
+
+import sign
+
+def rss_kb(field: str) -> int:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+def measure(size_mb: int):
+    """Sign one APK of size_mb MB and print the job's memory use"""
+    make_apk('in.apk', size_mb)
+    sign.MAX_FILE_SIZE = max(sign.MAX_FILE_SIZE, os.path.getsize('in.apk'))
+    sign.sign_apk('in.apk', 'warm.apk')  # Key, imports and digest threads are not part of the job
+    os.remove('warm.apk')
+
+    base_anon = rss_kb('RssAnon')
+    peak_anon = base_anon
+    done = threading.Event()
+    def sample():
+        nonlocal peak_anon
+        while not done.is_set():
+            peak_anon = max(peak_anon, rss_kb('RssAnon'))
+            time.sleep(0.002)
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+
+    base_rss = rss_kb('VmRSS')
+    started = time.perf_counter()
+    sign.sign_apk('in.apk', 'out.apk')
+    elapsed = time.perf_counter() - started
+    peak_rss = rss_kb('VmHWM')
+    done.set()
+    sampler.join()
+
+    print(f"{size_mb:4d} MB APK: {elapsed * 1000:7.0f} ms, "
+          f"anonymous memory +{(peak_anon - base_anon) / 1024:5.1f} MB, "
+          f"peak RSS +{max(0, peak_rss - base_rss) / 1024:6.1f} MB (including mapped APK pages)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        workdir()
+        measure(args.one)
+        return
+    for size_mb in args.sizes:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--one', str(size_mb)], check=True)
+
+
+if __name__ == "__main__":
+    main()
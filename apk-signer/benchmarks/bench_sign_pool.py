@@ -0,0 +1,124 @@
+"""Signing pool throughput and bot responsiveness while it is busy.
+
+Submits N concurrent sign_apk jobs to a SigningService (local pool, no
+daemon) and compares the elapsed time with N / workers single jobs.
+Meanwhile a /start update arrives every 100 ms and is handled through the same steps as a
+real update: the user context is loaded and handlers.start.start_command
+runs against a stand-in message. The same is done with the jobs signed
+on the event loop, as handlers did before the signing service.
+Workers keep the cloud API size limit, so --mb stays below 50.
+
+    python benchmarks/bench_sign_pool.py [--mb 45] [--jobs 1 4 8] [--workers N]
+"""
+import argparse
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+from common import workdir, make_apk
+
+import async_db
+import db
+import sign
+from handlers.start import start_command
+from middlewares import UserContext
+from sign_service import SigningService
+
+START_INTERVAL = 0.1
+
+async def handle_start(user_id: int):
+    """One /start update"""
+    async def answer(*args, **kwargs):
+        pass
+
+    context = await async_db.get_user_context(user_id)
+    user_ctx = UserContext(user_id=user_id, user=context['user'], sign_price=context['sign_price'])
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=user_id, username='bench', first_name='Bench', last_name=None),
+        answer=answer
+    )
+    await start_command(message, user_ctx)
+
+async def while_starting(start_jobs) -> tuple:
+    """Start and await jobs while /start updates keep arriving; returns (elapsed, /start latencies).
+
+    An update's latency runs from when it arrived, on a fixed schedule,
+    to when its handler finished, so time spent waiting for a blocked
+    event loop counts.
+    """
+    latencies = []
+    finished = None
+
+    async def updates():
+        arrived = time.perf_counter()
+        # Updates that arrived while the jobs ran are all handled, however late
+        while finished is None or arrived <= finished:
+            await asyncio.sleep(max(0.0, arrived - time.perf_counter()))
+            await handle_start(len(latencies) % 100)
+            latencies.append(time.perf_counter() - arrived)
+            arrived += START_INTERVAL
+
+    ticker = asyncio.ensure_future(updates())
+    await asyncio.sleep(0)  # The first update is in before the jobs start
+    started = time.perf_counter()
+    await start_jobs()
+    finished = time.perf_counter()
+    await ticker
+    return finished - started, sorted(latencies)
+
+def summary(latencies: list) -> str:
+    return (f"/start x{len(latencies)} p50 {latencies[len(latencies) // 2] * 1000:5.1f} ms, "
+            f"max {latencies[-1] * 1000:6.1f} ms")
+
+async def bench(job_counts: list, workers: int):
+    service = SigningService(workers=workers, daemon_socket=None)
+    service.start()
+    await service.run(os.getpid)  # Wait for a worker to be up
+
+    started = time.perf_counter()
+    await service.sign_apk('in.apk', 'signed/one.apk')
+    single = time.perf_counter() - started
+    _, idle = await while_starting(lambda: asyncio.sleep(2))
+    print(f"{workers} workers, single job {single:.2f}s; idle bot: {summary(idle)}")
+
+    for jobs in job_counts:
+        results = []
+        async def batch():
+            results.extend(await asyncio.gather(*(
+                service.sign_apk('in.apk', f'signed/{jobs}_{i}.apk') for i in range(jobs)
+            )))
+        elapsed, latencies = await while_starting(batch)
+        assert len(results) == jobs and all(results)
+        ideal = single * -(-jobs // workers)
+        print(f"pool, {jobs:3d} jobs: {elapsed:6.2f}s (N/workers x single job {ideal:6.2f}s); {summary(latencies)}")
+    service.shutdown()
+
+    for jobs in job_counts[-1:]:
+        async def inline():
+            for i in range(jobs):
+                sign.sign_apk('in.apk', f'signed/inline_{i}.apk')
+        elapsed, latencies = await while_starting(inline)
+        print(f"event loop, {jobs:3d} jobs: {elapsed:6.2f}s; {summary(latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=45)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    workdir()
+    db.use_database('bench.db')
+    db.init_db()
+    for user_id in range(100):
+        db.add_user(user_id, f'user{user_id}')
+    os.makedirs('signed')
+    make_apk('in.apk', args.mb)
+    sign.sign_apk('in.apk', 'signed/warm.apk')  # Creates keys/ before any worker starts
+
+    asyncio.run(bench(args.jobs, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Upstream TRON requests for a replay of payment submissions, with and without the lookup cache.
+
+A mock_chain.MockChain server runs in its own process with 300 confirmed
+transfers and answers each request after a random delay. The replay
+submits every TXID once, then again the way users do while they wait:
+some resubmit a few seconds later, some double-tap. 40 of the TXIDs are
+unknown to the chain. The same replay runs three times:
+
+  no cache       every submission asks the providers (TronAPI._fetch_transaction)
+  cache, cold    TronAPI.get_transaction with an empty database
+  after restart  a new TronAPI on the same database, as after a bot restart
+
+Upstream requests are counted by the server.
+
+    python benchmarks/bench_tron_cache.py [--valid 300] [--unknown 40] [--speed 4]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import workdir
+
+import db
+import trx
+
+PORT = 18091
+BASE = f'http://127.0.0.1:{PORT}'
+TO_ADDRESS = 'TLa2f6VPqDgRE67v1736s7bJ8Ray5wYjU7'
+
+def serve():
+    """The stand-in server: MockChain behind a latency middleware"""
+    from aiohttp import web
+    from mock_chain import MockChain
+
+    chain = MockChain()
+    rnd = random.Random(1)
+
+    @web.middleware
+    async def latency(request, handler):
+        if not request.path.startswith('/mock/'):
+            await asyncio.sleep(rnd.uniform(0.1, 0.5))
+        return await handler(request)
+
+    async def stats(request):
+        return web.json_response({'requests': chain.requests})
+
+    app = chain.app()
+    app.middlewares.append(latency)
+    app.router.add_get('/mock/stats', stats)
+    web.run_app(app, host='127.0.0.1', port=PORT, print=None)
+
+def post_json(path: str, body) -> dict:
+    request = urllib.request.Request(f'{BASE}{path}', data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def upstream_requests() -> int:
+    with urllib.request.urlopen(f'{BASE}/mock/stats') as response:
+        return json.loads(response.read())['requests']
+
+def make_replay(tx_ids: list, speed: float) -> list:
+    """(seconds from start, TXID) for every submission, in time order"""
+    rnd = random.Random(2)
+    submissions = []
+    for tx_id in tx_ids:
+        at = rnd.uniform(0, 30)
+        submissions.append((at, tx_id))
+        if rnd.random() < 0.2:
+            submissions.append((at + rnd.uniform(0.02, 0.2), tx_id))  # Double tap
+        for _ in range(rnd.choice((0, 0, 1, 1, 2, 3))):
+            at += rnd.uniform(2, 8)  # Resubmitted while waiting for the credit
+            submissions.append((at, tx_id))
+    return sorted((at / speed, tx_id) for at, tx_id in submissions)
+
+async def replay(label: str, submissions: list, cached: bool):
+    api = trx.TronAPI(BASE, f'{BASE}/api')
+    lookup = api.get_transaction if cached else api._fetch_transaction
+    latencies = []
+    failed = 0
+
+    async def submit(at: float, tx_id: str):
+        nonlocal failed
+        await asyncio.sleep(at)
+        started = time.perf_counter()
+        try:
+            await lookup(tx_id)
+        except trx.TronAPIError:
+            failed += 1  # Timed out queueing for the connection pool
+        latencies.append(time.perf_counter() - started)
+
+    before = upstream_requests()
+    await asyncio.gather(*(submit(at, tx_id) for at, tx_id in submissions))
+    requests = upstream_requests() - before
+    metrics = api.metrics()
+    await api.close()
+
+    latencies.sort()
+    hits = (f" ({metrics['cache_hits']} memory hits, {metrics['db_hits']} database hits, "
+            f"{metrics['coalesced']} coalesced)" if cached else "")
+    print(f"{label:14s} {requests:5d} upstream requests, p50 {latencies[len(latencies) // 2] * 1000:5.0f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:5.0f} ms, failed {failed}{hits}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--valid', type=int, default=300)
+    parser.add_argument('--unknown', type=int, default=40)
+    parser.add_argument('--speed', type=float, default=4, help="replay this many times faster than real time")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+        return
+
+    logging.basicConfig(level=logging.ERROR)
+    workdir()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'])
+    try:
+        while True:
+            try:
+                upstream_requests()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        tx_ids = post_json('/mock/transfers', [
+            {'to': TO_ADDRESS, 'amount_sun': 5_000_000 + i} for i in range(args.valid)
+        ])['tx_ids']
+        rnd = random.Random(3)
+        tx_ids += [rnd.randbytes(32).hex() for _ in range(args.unknown)]
+        submissions = make_replay(tx_ids, args.speed)
+        print(f"{len(submissions)} submissions of {len(tx_ids)} TXIDs ({args.unknown} unknown), "
+              f"replayed at {args.speed:g}x")
+
+        db.use_database('bench.db')
+        db.init_db()
+        asyncio.run(replay('no cache', submissions, cached=False))  # Never reads or writes the database
+        asyncio.run(replay('cache, cold', submissions, cached=True))
+        asyncio.run(replay('after restart', submissions, cached=True))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
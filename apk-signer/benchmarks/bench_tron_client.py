@@ -0,0 +1,160 @@
+"""Load test of trx.TronAPI against a local stand-in for TronGrid and TronScan.
+
+The stand-in server runs in its own process and answers every TXID as a
+confirmed TRX transfer after a random delay. Its TronGrid endpoint also
+injects errors: a share of requests get HTTP 503 and a share hang past
+the client's timeout. The client looks up distinct TXIDs, so every
+lookup goes to the network, while a 10 ms ticker measures how long the
+event loop is blocked.
+
+    python benchmarks/bench_tron_client.py [--lookups 500] [--concurrency 50]
+                                            [--error-rate 0.1] [--hang-rate 0.03]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import workdir
+
+import db
+import trx
+
+PORT = 18090
+BASE = f'http://127.0.0.1:{PORT}'
+TO_ADDRESS = trx.base58_to_hex('TLa2f6VPqDgRE67v1736s7bJ8Ray5wYjU7')
+
+def serve(error_rate: float, hang_rate: float, hang_seconds: float):
+    """The stand-in server; counts the TCP connections clients open"""
+    from aiohttp import web
+
+    connections = set()
+    rnd = random.Random(1)
+
+    async def trongrid(request):
+        connections.add(id(request.transport))
+        roll = rnd.random()
+        if roll < hang_rate:
+            await asyncio.sleep(hang_seconds)
+        else:
+            await asyncio.sleep(rnd.uniform(0.05, 0.4))
+        if roll < hang_rate + error_rate:
+            return web.Response(status=503)
+        return web.json_response({'data': [{
+            'txID': request.match_info['tx_id'],
+            'ret': [{'contractRet': 'SUCCESS'}],
+            'blockNumber': 1,
+            'raw_data': {'contract': [{'type': 'TransferContract', 'parameter': {'value': {
+                'amount': 5_000_000, 'owner_address': TO_ADDRESS, 'to_address': TO_ADDRESS,
+            }}}], 'timestamp': 0},
+        }]})
+
+    async def tronscan(request):
+        connections.add(id(request.transport))
+        await asyncio.sleep(rnd.uniform(0.05, 0.2))
+        return web.json_response({
+            'hash': request.query['hash'], 'contractRet': 'SUCCESS', 'contractType': 1, 'confirmed': True,
+            'block': 1, 'timestamp': 0,
+            'contractData': {'amount': 5_000_000, 'owner_address': TO_ADDRESS, 'to_address': TO_ADDRESS},
+        })
+
+    async def stats(request):
+        return web.json_response({'connections': len(connections)})
+
+    app = web.Application()
+    app.router.add_get('/v1/transactions/{tx_id}', trongrid)
+    app.router.add_get('/api/transaction-info', tronscan)
+    app.router.add_get('/stats', stats)
+    web.run_app(app, host='127.0.0.1', port=PORT, print=None)
+
+async def load(lookups: int, concurrency: int, timeout: float):
+    lags = []
+    stopping = False
+
+    async def ticker():
+        while not stopping:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    api = trx.TronAPI(BASE, f'{BASE}/api', timeout=timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def lookup(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await api.get_transaction(f'{i:064x}')
+            except trx.TronAPIError as e:
+                result = e
+            latencies.append(time.perf_counter() - started)
+            return result
+
+    tick = asyncio.ensure_future(ticker())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(lookup(i) for i in range(lookups)))
+    elapsed = time.perf_counter() - started
+    stopping = True
+    await tick
+    await api.close()
+
+    found = sum(1 for r in results if isinstance(r, dict))
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    latencies.sort()
+    lags.sort()
+    with urllib.request.urlopen(f'{BASE}/stats') as response:
+        connections = json.loads(response.read())['connections']
+    metrics = api.metrics()
+
+    print(f"{lookups} lookups, concurrency {concurrency}: {elapsed:.1f}s ({lookups / elapsed:.0f}/s), "
+          f"found {found}, failed {failed}, hedged {metrics['hedged_lookups']}")
+    print(f"lookup latency p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms")
+    print(f"event loop lag p50 {lags[len(lags) // 2] * 1000:.1f} ms, max {lags[-1] * 1000:.1f} ms")
+    print(f"TCP connections opened: {connections} (pool size {api.pool_size})")
+    for name, health in metrics['providers'].items():
+        print(f"  {name}: {health}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.1)
+    parser.add_argument('--hang-rate', type=float, default=0.03)
+    parser.add_argument('--timeout', type=float, default=2.0, help="client timeout per request, seconds")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.error_rate, args.hang_rate, args.timeout * 4)
+        return
+
+    logging.basicConfig(level=logging.ERROR)  # Injected failures would log a warning each
+    workdir()
+    db.use_database('bench.db')
+    db.init_db()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                               '--error-rate', str(args.error_rate), '--hang-rate', str(args.hang_rate),
+                               '--timeout', str(args.timeout)])
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'{BASE}/stats').read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        asyncio.run(load(args.lookups, args.concurrency, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Throughput of the zipaligned signing write pass, in MB/s.
+
+Builds a synthetic APK whose stored entries are deliberately misaligned
+(odd-length names, several native libraries), checks that the input
+fails sign.verify_alignment, signs it and checks that the output passes.
+The copy stage is the single pass that aligns and writes every entry;
+its time comes from the stage timings sign_apk logs.
+
+    python benchmarks/bench_zipalign.py [--mb 50] [--runs 5]
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import time
+import zipfile
+
+from common import workdir, make_apk
+
+import sign
+
+class StageTimings(logging.Handler):
+    """Collects the per-stage timings from sign_apk's log line"""
+
+    def __init__(self):
+        super().__init__()
+        self.stages = {}
+
+    def emit(self, record):
+        for stage, ms in re.findall(r'(\w+): ([\d.]+)ms', record.getMessage()):
+            self.stages[stage] = float(ms) / 1000
+
+def make_misaligned_apk(path: str, size_mb: int):
+    make_apk(path, size_mb)
+    rnd = random.Random(size_mb)
+    with zipfile.ZipFile(path, 'a') as apk:
+        apk.writestr('resources.arsc', rnd.randbytes(300_001))  # Stored, as aapt leaves it
+        for abi in ('armeabi-v7a', 'x86', 'x86_64'):
+            apk.writestr(f'lib/{abi}/libbench_{abi}.so', rnd.randbytes(1 << 20))
+        for i in range(50):
+            apk.writestr(f'assets/a{"x" * (i % 7)}{i}.bin', rnd.randbytes(rnd.randrange(1, 5000)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    workdir()
+
+    make_misaligned_apk('in.apk', args.mb)
+    sign.MAX_FILE_SIZE = max(sign.MAX_FILE_SIZE, os.path.getsize('in.apk'))
+    misaligned = sign.verify_alignment('in.apk')
+    print(f"input: {os.path.getsize('in.apk') / (1 << 20):.1f} MB, {len(misaligned)} misaligned entries")
+
+    timings = StageTimings()
+    logging.getLogger('sign').addHandler(timings)
+    logging.getLogger('sign').setLevel(logging.INFO)
+    sign.sign_apk('in.apk', 'out.apk')  # Warm up: key, page cache, digest threads
+
+    copy_times, total_times = [], []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        sign.sign_apk('in.apk', 'out.apk')
+        total_times.append(time.perf_counter() - started)
+        copy_times.append(timings.stages['copy'])
+
+    still_misaligned = sign.verify_alignment('out.apk')
+    size_mb = os.path.getsize('out.apk') / (1 << 20)
+    copy, total = sorted(copy_times)[args.runs // 2], sorted(total_times)[args.runs // 2]
+    print(f"aligned copy pass: {copy * 1000:.0f} ms, {size_mb / copy:.0f} MB/s")
+    print(f"whole signing job: {total * 1000:.0f} ms, {size_mb / total:.0f} MB/s (digest, v1, v2/v3, verify)")
+    print(f"output: {size_mb:.1f} MB, misaligned entries: {len(still_misaligned)}")
+    if still_misaligned:
+        raise SystemExit(f"Output is not zipaligned: {still_misaligned[:5]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Helpers shared by the benchmark scripts.
+
+Run the scripts from anywhere, e.g. python benchmarks/bench_db.py; each
+one works in a fresh temporary directory, so its database, keys/ and
+output files never touch the bot's own.
+"""
+import os
+import random
+import sys
+import tempfile
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def workdir(prefix: str = "apk-signer-bench-") -> str:
+    """Create a temporary directory and make it the working directory"""
+    path = tempfile.mkdtemp(prefix=prefix)
+    os.chdir(path)
+    return path
+
+def make_apk(path: str, size_mb: int, resources: int = 300, seed: int = 0):
+    """Write a synthetic APK of about size_mb MB.
+
+    It has a small manifest, a 1 MB classes.dex, `resources` small deflated
+    resource files and a stored native library holding the rest of the size.
+    """
+    rnd = random.Random(seed or size_mb)
+    with zipfile.ZipFile(path, 'w') as apk:
+        apk.writestr('AndroidManifest.xml', b'\x03\x00\x08\x00' + bytes(100), zipfile.ZIP_DEFLATED)
+        apk.writestr('classes.dex', rnd.randbytes(1 << 20), zipfile.ZIP_DEFLATED)
+        for i in range(resources):
+            apk.writestr(f'res/raw/r{i}.bin', rnd.randbytes(2000), zipfile.ZIP_DEFLATED)
+        remaining = max(0, size_mb - 2) << 20
+        with apk.open(zipfile.ZipInfo('lib/arm64-v8a/libbench.so'), 'w') as f:
+            while remaining > 0:
+                chunk = min(remaining, 1 << 20)
+                f.write(rnd.randbytes(chunk))
+                remaining -= chunk
@@ -4,6 +4,9 @@ from typing import List
 
 # Bot Configuration
 API_TOKEN = os.getenv("API_TOKEN", "8163091559:AAEUU-W7lpahXzdNaoyIzLAstP8I76xqPlI")
+# Local Bot API server (e.g. http://localhost:8081), sharing this machine's filesystem.
+# Files are then read and sent by path and the size limit rises to 2000MB.
+LOCAL_BOT_API_URL = os.getenv("LOCAL_BOT_API_URL")
 
 # Admin Configuration
 ADMIN_ID = int(os.getenv("ADMIN_ID", "7589375459"))
@@ -12,14 +15,63 @@ ADMINS: List[int] = [ADMIN_ID]  # Can add more admin IDs
 # Payment Configuration
 SIGN_PRICE_TRX = float(os.getenv("SIGN_PRICE_TRX", "3.0"))
 TRX_ADDRESS = os.getenv("TRX_ADDRESS", "TKz2yJFyWMuNKJAJikm9EbEv9Hspyr3niH")
+TRON_API_BASE = os.getenv("TRON_API_BASE", "https://api.trongrid.io")
+TRONSCAN_API_BASE = os.getenv("TRONSCAN_API_BASE", "https://apilist.tronscanapi.com/api")
+TRON_REQUEST_TIMEOUT = float(os.getenv("TRON_REQUEST_TIMEOUT", "5"))  # Seconds per HTTP request
+TRON_POOL_SIZE = int(os.getenv("TRON_POOL_SIZE", "20"))  # Keep-alive connections shared by all lookups
+TRON_HEDGE_DELAY = float(os.getenv("TRON_HEDGE_DELAY", "1.0"))  # Seconds before asking a second provider, until the first one's p95 is known
+TRON_BREAKER_FAILURES = int(os.getenv("TRON_BREAKER_FAILURES", "5"))  # Failures in a row that open a provider's circuit
+TRON_BREAKER_COOLDOWN = float(os.getenv("TRON_BREAKER_COOLDOWN", "30"))  # Seconds an open circuit rejects requests
+TRON_CACHE_SIZE = int(os.getenv("TRON_CACHE_SIZE", "2000"))  # Transaction lookups kept in memory
+TRON_CACHE_TTL = float(os.getenv("TRON_CACHE_TTL", "3600"))  # Confirmed transactions; they also stay in the database for good
+TRON_NEGATIVE_TTL = float(os.getenv("TRON_NEGATIVE_TTL", "15"))  # Seconds a "not found" answer is reused
+TRON_UNCONFIRMED_TTL = float(os.getenv("TRON_UNCONFIRMED_TTL", "5"))  # Seconds an unconfirmed transaction is reused
+# Deposit watcher: credits transfers to TRX_ADDRESS that match a deposit intent, no TXID needed
+DEPOSIT_WATCH_INTERVAL = float(os.getenv("DEPOSIT_WATCH_INTERVAL", "20"))  # Seconds between polls; 0 disables the watcher
+DEPOSIT_WATCH_PAGE_SIZE = int(os.getenv("DEPOSIT_WATCH_PAGE_SIZE", "200"))  # Transfers per page (TronGrid allows up to 200)
+DEPOSIT_WATCH_MAX_PAGES = int(os.getenv("DEPOSIT_WATCH_MAX_PAGES", "10"))  # Pages read per poll; the rest waits for the next poll
+DEPOSIT_INTENT_TTL = int(os.getenv("DEPOSIT_INTENT_TTL", "3600"))  # Seconds a deposit intent waits for its transfer
 
 # File Configuration
 TEMP_DIR = "temp"
 SIGNED_DIR = "signed"
-MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_FILE_SIZE = (2000 if LOCAL_BOT_API_URL else 50) * 1024 * 1024  # Local server: 2000MB, cloud API: 50MB
+INPUT_STORE_DIR = "inputs"  # Recently downloaded APKs, reused when the same document is sent again
+INPUT_STORE_MAX_BYTES = int(os.getenv("INPUT_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1GB
+
+# Signing Configuration
+SIGN_WORKERS = int(os.getenv("SIGN_WORKERS", str(os.cpu_count() or 2)))
+SIGN_QUEUE_SIZE = int(os.getenv("SIGN_QUEUE_SIZE", "20"))  # Jobs allowed to wait for a worker
+SIGN_DIGEST_THREADS = int(os.getenv("SIGN_DIGEST_THREADS", "4"))  # Parallel 1MB chunk digests per job
+# Time budget for verifying an APK, per MB (plus one MB for fixed costs); slower verifications are logged.
+# Measured: ~1 ms/MB for v2/v3 on upload, <1 ms/MB for the post-sign self-check, 3-5 ms/MB with v1 entry digests.
+VERIFY_BUDGET_MS_PER_MB = float(os.getenv("VERIFY_BUDGET_MS_PER_MB", "5"))
+CACHED_SIGN_PRICE_FACTOR = float(os.getenv("CACHED_SIGN_PRICE_FACTOR", "1.0"))  # Share of the sign price charged when a signed output is reused
+# Unix socket of the shared signing daemon (python sign_daemon.py); bots sign in-process when nothing listens there
+SIGN_DAEMON_SOCKET = os.getenv("SIGN_DAEMON_SOCKET", "sign_daemon.sock")
+
+# Signing Key Configuration (a self-signed key is generated if these are missing)
+KEYS_DIR = "keys"
+SIGNING_KEY_PATH = os.getenv("SIGNING_KEY_PATH", os.path.join(KEYS_DIR, "signing_key.pem"))
+SIGNING_CERT_PATH = os.getenv("SIGNING_CERT_PATH", os.path.join(KEYS_DIR, "signing_cert.pem"))
+# Encrypts user-uploaded keys in the database (a Fernet key; generated into KEYS_DIR if unset)
+KEYSTORE_SECRET = os.getenv("KEYSTORE_SECRET")
+KEYSTORE_SECRET_PATH = os.path.join(KEYS_DIR, "keystore_secret.key")
 
 # Database Configuration
 DB_PATH = "bot_database.db"
+DB_CACHE_SIZE_KB = 16 * 1024  # Page cache per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024  # 64MB memory-mapped I/O
+DB_BUSY_TIMEOUT_MS = 5000
+DB_READER_THREADS = 4  # Concurrent readers for the async DB layer
+
+# Cache Configuration
+USER_CACHE_SIZE = 10000  # Users kept in the per-update context cache
+USER_CACHE_TTL = 60  # Seconds before a cached user context is reloaded
+
+# Activity Tracking Configuration
+ACTIVITY_FLUSH_INTERVAL = 30  # Seconds between last_activity batch writes
+ACTIVITY_FLUSH_MAX_ENTRIES = 500  # Flush early once this many users are buffered
 
 # Logging Configuration
 LOG_LEVEL = "INFO"
@@ -1,9 +1,18 @@
-
+import json
+import secrets
 import sqlite3
 import logging
-from datetime import datetime
-from typing import Optional, List, Tuple, Dict, Any
-from config import DB_PATH
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Dict, Any, Iterator, Callable
+from cache import TTLCache
+from config import (
+    DB_PATH, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS,
+    SIGN_PRICE_TRX, USER_CACHE_SIZE, USER_CACHE_TTL, ACTIVITY_FLUSH_MAX_ENTRIES,
+    DEPOSIT_INTENT_TTL
+)
 
 logger = logging.getLogger(__name__)
 
@@ -11,140 +20,514 @@ class DatabaseError(Exception):
     """Custom exception for database operations"""
     pass
 
-def get_connection() -> sqlite3.Connection:
-    """Get database connection with row factory"""
-    conn = sqlite3.connect(DB_PATH)
+# One warm connection per thread, opened lazily and kept for the process lifetime
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+def _open_connection() -> sqlite3.Connection:
+    """Open a new tuned connection"""
+    # Autocommit mode: transactions are opened explicitly by transaction().
+    # Each connection is only used by the thread that opened it; the
+    # same-thread check is relaxed so close_connections() can release them.
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}')
+    conn.execute(f'PRAGMA mmap_size = {int(DB_MMAP_SIZE)}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
+def use_database(path: str):
+    """Open connections on another database file from now on (for maintenance scripts)"""
+    global DB_PATH
+    DB_PATH = path
+
+def get_connection() -> sqlite3.Connection:
+    """Get the calling thread's database connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Close every connection opened by this process (call on shutdown)"""
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+    _local.conn = None
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Cursor]:
+    """Run a block in a write transaction, committing on success.
+
+    Nested use joins the outer transaction, so helpers such as
+    add_transaction() can be called from inside another write.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn.cursor()
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+# Schema Migrations
+# Each migration upgrades the schema by exactly one version. Shipped
+# migrations must never be edited; append a new one instead.
+def _migration_base_tables(cursor: sqlite3.Cursor):
+    # Users table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        balance REAL DEFAULT 0.0,
+        is_blocked INTEGER DEFAULT 0,
+        join_date TEXT,
+        last_activity TEXT
+    )
+    ''')
+    
+    # Transactions table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        tx_type TEXT,
+        amount REAL,
+        trx_id TEXT,
+        status TEXT DEFAULT 'completed',
+        description TEXT,
+        timestamp TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Signed APKs table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS signed_apks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        file_name TEXT,
+        file_id TEXT,
+        original_size INTEGER,
+        signed_size INTEGER,
+        sign_time TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Support messages table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS support_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        message_id INTEGER,
+        message_text TEXT,
+        admin_reply TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TEXT,
+        replied_at TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    
+    # Settings table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TEXT
+    )
+    ''')
+    
+    # Initialize default settings
+    cursor.execute('''
+    INSERT OR IGNORE INTO settings (key, value, updated_at) 
+    VALUES ('sign_price_trx', '3.0', ?)
+    ''', (datetime.now().isoformat(),))
+
+def _migration_legacy_user_columns(cursor: sqlite3.Cursor):
+    # Databases created by early versions lack some users columns
+    existing = {row['name'] for row in cursor.execute('PRAGMA table_info(users)')}
+    columns = {
+        'first_name': 'TEXT',
+        'last_name': 'TEXT',
+        'last_activity': 'TEXT',
+        'is_blocked': 'INTEGER DEFAULT 0',
+    }
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {name} {definition}')
+
+def _migration_secondary_indexes(cursor: sqlite3.Cursor):
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_transactions_user_time
+    ON transactions (user_id, timestamp)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_signed_apks_user_time
+    ON signed_apks (user_id, sign_time)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_support_messages_status_time
+    ON support_messages (status, created_at)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_users_username
+    ON users (username)
+    ''')
+
+def _migration_unique_trx_id(cursor: sqlite3.Cursor):
+    # TXIDs are hex; store them lowercase so uniqueness is case-insensitive
+    cursor.execute('''
+    UPDATE transactions SET trx_id = lower(trx_id)
+    WHERE trx_id IS NOT NULL AND trx_id != lower(trx_id)
+    ''')
+    # Older versions could record the same TXID twice; keep the first row
+    cursor.execute('''
+    UPDATE transactions SET trx_id = NULL
+    WHERE trx_id IS NOT NULL AND id NOT IN (
+        SELECT MIN(id) FROM transactions WHERE trx_id IS NOT NULL GROUP BY trx_id
+    )
+    ''')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_trx_id
+    ON transactions (trx_id) WHERE trx_id IS NOT NULL
+    ''')
+
+def _migration_stats_rollup(cursor: sqlite3.Cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_signings (
+        day TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    # Users: count and total balance
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE stats SET value = value + 1 WHERE key = 'user_count';
+        UPDATE stats SET value = value + COALESCE(NEW.balance, 0) WHERE key = 'total_balance';
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE stats SET value = value - 1 WHERE key = 'user_count';
+        UPDATE stats SET value = value - COALESCE(OLD.balance, 0) WHERE key = 'total_balance';
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_balance AFTER UPDATE OF balance ON users
+    BEGIN
+        UPDATE stats SET value = value + COALESCE(NEW.balance, 0) - COALESCE(OLD.balance, 0)
+        WHERE key = 'total_balance';
+    END
+    ''')
+    
+    # Ledger: completed deposits and sign fees (fees are stored as negative amounts)
+    deposit_new = "CASE WHEN NEW.tx_type = 'deposit' AND NEW.status = 'completed' THEN NEW.amount ELSE 0 END"
+    deposit_old = "CASE WHEN OLD.tx_type = 'deposit' AND OLD.status = 'completed' THEN OLD.amount ELSE 0 END"
+    fee_new = "CASE WHEN NEW.tx_type = 'sign_fee' AND NEW.status = 'completed' THEN -NEW.amount ELSE 0 END"
+    fee_old = "CASE WHEN OLD.tx_type = 'sign_fee' AND OLD.status = 'completed' THEN -OLD.amount ELSE 0 END"
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_transactions_insert AFTER INSERT ON transactions
+    BEGIN
+        UPDATE stats SET value = value + {deposit_new} WHERE key = 'total_deposits';
+        UPDATE stats SET value = value + {fee_new} WHERE key = 'total_sign_fees';
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_transactions_update AFTER UPDATE ON transactions
+    BEGIN
+        UPDATE stats SET value = value + {deposit_new} - {deposit_old} WHERE key = 'total_deposits';
+        UPDATE stats SET value = value + {fee_new} - {fee_old} WHERE key = 'total_sign_fees';
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_transactions_delete AFTER DELETE ON transactions
+    BEGIN
+        UPDATE stats SET value = value - {deposit_old} WHERE key = 'total_deposits';
+        UPDATE stats SET value = value - {fee_old} WHERE key = 'total_sign_fees';
+    END
+    ''')
+    
+    # Signed APKs: per-day signing counts
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_signed_apks_insert AFTER INSERT ON signed_apks
+    BEGIN
+        INSERT INTO daily_signings (day, count) VALUES (substr(NEW.sign_time, 1, 10), 1)
+        ON CONFLICT (day) DO UPDATE SET count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_signed_apks_delete AFTER DELETE ON signed_apks
+    BEGIN
+        UPDATE daily_signings SET count = count - 1 WHERE day = substr(OLD.sign_time, 1, 10);
+    END
+    ''')
+
+def _migration_signed_output_cache(cursor: sqlite3.Cursor):
+    # Signed outputs are reusable for the same input bytes and signing key
+    existing = {row['name'] for row in cursor.execute('PRAGMA table_info(signed_apks)')}
+    columns = {
+        'input_sha256': 'TEXT',
+        'key_id': 'TEXT',
+        'cached': 'INTEGER NOT NULL DEFAULT 0',
+    }
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE signed_apks ADD COLUMN {name} {definition}')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_signed_apks_input
+    ON signed_apks (input_sha256, key_id) WHERE input_sha256 IS NOT NULL
+    ''')
+    
+    # Cache hits and misses, for the hit ratio in the stats panel
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_signed_apks_cache_insert AFTER INSERT ON signed_apks
+    BEGIN
+        UPDATE stats SET value = value + NEW.cached WHERE key = 'sign_cache_hits';
+        UPDATE stats SET value = value + 1 - NEW.cached WHERE key = 'sign_cache_misses';
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_signed_apks_cache_delete AFTER DELETE ON signed_apks
+    BEGIN
+        UPDATE stats SET value = value - OLD.cached WHERE key = 'sign_cache_hits';
+        UPDATE stats SET value = value - 1 + OLD.cached WHERE key = 'sign_cache_misses';
+    END
+    ''')
+    
+    # Backfill the rollup here, once every column it reads exists
+    _write_stats(cursor, _compute_stats(cursor))
+
+def _migration_user_keystores(cursor: sqlite3.Cursor):
+    # Private keys are stored encrypted with the bot's keystore secret
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_keystores (
+        user_id INTEGER PRIMARY KEY,
+        key_id TEXT NOT NULL,
+        private_key BLOB NOT NULL,
+        certificate BLOB NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+
+def _migration_tron_transactions(cursor: sqlite3.Cursor):
+    # Confirmed TRON transactions never change, so lookups are kept for good
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tron_transactions (
+        tx_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        fetched_at TEXT NOT NULL
+    )
+    ''')
+
+def _migration_deposit_intents(cursor: sqlite3.Cursor):
+    # A user announces a deposit and gets an amount (in SUN) and memo that
+    # identify the transfer; the deposit watcher credits it without a TXID
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS deposit_intents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount_sun INTEGER NOT NULL,
+        memo TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        trx_id TEXT,
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    # While pending, the amount and the memo each point to exactly one intent
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_deposit_intents_amount
+    ON deposit_intents (amount_sun) WHERE status = 'pending'
+    ''')
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_deposit_intents_memo
+    ON deposit_intents (memo) WHERE status = 'pending'
+    ''')
+    
+    # How far the watcher has read each address's incoming transfers (block time, ms)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chain_cursors (
+        address TEXT PRIMARY KEY,
+        min_timestamp INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    ''')
+
+def _migration_legacy_deposit_stats(cursor: sqlite3.Cursor):
+    # The stats rollup backfill counted both rows of each legacy double-recorded
+    # deposit (see LEGACY_DUPLICATE_DEPOSIT); recompute it with the duplicates left out
+    _write_stats(cursor, _compute_stats(cursor))
+
+def _migration_raw_tron_transactions(cursor: sqlite3.Cursor):
+    # The cache now keeps each provider's raw answer, formatted on read, so a
+    # formatter fix also applies to transactions looked up before it. Rows
+    # stored already formatted are dropped and looked up again when needed.
+    existing = {row['name'] for row in cursor.execute('PRAGMA table_info(tron_transactions)')}
+    if 'provider' not in existing:
+        cursor.execute('ALTER TABLE tron_transactions ADD COLUMN provider TEXT')
+    cursor.execute('DELETE FROM tron_transactions WHERE provider IS NULL')
+
+MIGRATIONS: List[Tuple[str, Callable[[sqlite3.Cursor], None]]] = [
+    ('base tables', _migration_base_tables),
+    ('legacy users columns', _migration_legacy_user_columns),
+    ('secondary indexes', _migration_secondary_indexes),
+    ('unique transaction trx_id', _migration_unique_trx_id),
+    ('stats rollup', _migration_stats_rollup),
+    ('signed output cache', _migration_signed_output_cache),
+    ('user keystores', _migration_user_keystores),
+    ('tron transaction cache', _migration_tron_transactions),
+    ('deposit intents', _migration_deposit_intents),
+    ('legacy duplicate deposits in stats', _migration_legacy_deposit_stats),
+    ('raw tron transaction cache', _migration_raw_tron_transactions),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version() -> int:
+    """Get the schema version of the database (0 for a fresh or legacy file)"""
+    conn = get_connection()
+    has_table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not has_table:
+        return 0
+    
+    row = conn.execute('SELECT MAX(version) AS version FROM schema_version').fetchone()
+    return row['version'] or 0
+
 def init_db():
-    """Initialize database and create tables"""
+    """Initialize database and bring the schema up to date"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            balance REAL DEFAULT 0.0,
-            is_blocked INTEGER DEFAULT 0,
-            join_date TEXT,
-            last_activity TEXT
-        )
-        ''')
-        
-        # Add missing columns if they don't exist
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN first_name TEXT')
-        except sqlite3.OperationalError:
-            pass
+        current = get_schema_version()
+        if current >= SCHEMA_VERSION:
+            logger.info(f"Database schema is current (v{current})")
+            return
         
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN last_name TEXT')
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN last_activity TEXT')
-        except sqlite3.OperationalError:
-            pass
+        with transaction() as cursor:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT
+            )
+            ''')
+            
+            # Re-read under the write lock in case another process migrated first
+            current = cursor.execute(
+                'SELECT COALESCE(MAX(version), 0) AS version FROM schema_version'
+            ).fetchone()['version']
+            
+            for version, (description, migration) in enumerate(MIGRATIONS, start=1):
+                if version <= current:
+                    continue
+                migration(cursor)
+                cursor.execute('''
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, ?)
+                ''', (version, description, datetime.now().isoformat()))
+                logger.info(f"Applied migration {version}: {description}")
         
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN is_blocked INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
-        
-        # Transactions table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            tx_type TEXT,
-            amount REAL,
-            trx_id TEXT,
-            status TEXT DEFAULT 'completed',
-            description TEXT,
-            timestamp TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Signed APKs table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS signed_apks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            file_name TEXT,
-            file_id TEXT,
-            original_size INTEGER,
-            signed_size INTEGER,
-            sign_time TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Support messages table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS support_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message_id INTEGER,
-            message_text TEXT,
-            admin_reply TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TEXT,
-            replied_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-        
-        # Settings table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            updated_at TEXT
-        )
-        ''')
-        
-        # Initialize default settings
-        cursor.execute('''
-        INSERT OR IGNORE INTO settings (key, value, updated_at) 
-        VALUES ('sign_price_trx', '3.0', ?)
-        ''', (datetime.now().isoformat(),))
+        for problem in check_query_plans():
+            logger.warning(problem)
         
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        logger.info(f"Database initialized successfully (v{SCHEMA_VERSION})")
         
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise DatabaseError(f"Database initialization failed: {e}")
 
+# Hot queries and the index each one must be served by
+HOT_QUERY_PLANS: Dict[str, Tuple[str, tuple, str]] = {
+    'get_user_transactions': (
+        'SELECT * FROM transactions WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?',
+        (0, 5),
+        'idx_transactions_user_time'
+    ),
+    'find_user_by_username': (
+        'SELECT * FROM users WHERE username = ?',
+        ('',),
+        'idx_users_username'
+    ),
+    'find_signed_apk': (
+        'SELECT file_id, signed_size FROM signed_apks WHERE input_sha256 = ? AND key_id = ? ORDER BY id DESC LIMIT 1',
+        ('', ''),
+        'idx_signed_apks_input'
+    ),
+    'get_support_messages': (
+        'SELECT * FROM support_messages WHERE status = ? ORDER BY created_at LIMIT ?',
+        ('pending', 10),
+        'idx_support_messages_status_time'
+    ),
+}
+
+def check_query_plans() -> List[str]:
+    """Return a description of every hot query that no longer uses its index"""
+    conn = get_connection()
+    problems = []
+    
+    for name, (query, params, index) in HOT_QUERY_PLANS.items():
+        details = [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+        plan = ' | '.join(details)
+        # "SCAN t" without an index is a full table scan
+        full_scan = any(d.startswith('SCAN ') and 'INDEX' not in d for d in details)
+        if full_scan or index not in plan or 'TEMP B-TREE' in plan:
+            problems.append(f"Query {name} does not use {index}: {plan}")
+    
+    return problems
+
 # User Operations
 def add_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
     """Add new user or update existing user info"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
         current_time = datetime.now().isoformat()
         
-        cursor.execute('''
-        INSERT OR REPLACE INTO users 
-        (user_id, username, first_name, last_name, join_date, last_activity, is_blocked, balance)
-        VALUES (?, ?, ?, ?, 
-                COALESCE((SELECT join_date FROM users WHERE user_id = ?), ?),
-                ?,
-                COALESCE((SELECT is_blocked FROM users WHERE user_id = ?), 0),
-                COALESCE((SELECT balance FROM users WHERE user_id = ?), 0.0))
-        ''', (user_id, username, first_name, last_name, user_id, current_time, current_time, user_id, user_id))
+        with transaction() as cursor:
+            # Upsert rather than REPLACE: REPLACE deletes the row without
+            # firing delete triggers, which would skew the stats rollup
+            cursor.execute('''
+            INSERT INTO users 
+            (user_id, username, first_name, last_name, join_date, last_activity, is_blocked, balance)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0.0)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                last_activity = excluded.last_activity
+            ''', (user_id, username, first_name, last_name, current_time, current_time))
         
-        conn.commit()
-        conn.close()
+        invalidate_user_context(user_id)
         return True
         
     except Exception as e:
@@ -154,12 +537,9 @@ def add_user(user_id: int, username: str = None, first_name: str = None, last_na
 def get_user(user_id: int) -> Optional[Dict[str, Any]]:
     """Get user information"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        row = get_connection().execute(
+            'SELECT * FROM users WHERE user_id = ?', (user_id,)
+        ).fetchone()
         
         return dict(row) if row else None
         
@@ -167,21 +547,97 @@ def get_user(user_id: int) -> Optional[Dict[str, Any]]:
         logger.error(f"Failed to get user {user_id}: {e}")
         return None
 
-def update_user_activity(user_id: int):
-    """Update user's last activity timestamp"""
+# Per-update user context (user row, block flag, balance, sign price).
+# Writers below invalidate the entry after they commit; the TTL bounds
+# staleness from writes made by other processes.
+user_context_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# Bumped by every invalidation. A load that started before an invalidation may
+# have read the old row, so its result is returned but not cached.
+_context_generation = 0
+_context_lock = threading.Lock()
+
+def load_user_context(user_id: int) -> Dict[str, Any]:
+    """Load user row and current sign price in one query, bypassing the cache"""
+    row = get_connection().execute('''
+    SELECT users.*, 
+           (SELECT value FROM settings WHERE key = 'sign_price_trx') AS sign_price_trx
+    FROM (SELECT 1) LEFT JOIN users ON users.user_id = ?
+    ''', (user_id,)).fetchone()
+    
+    row = dict(row)
+    sign_price = float(row.pop('sign_price_trx') or SIGN_PRICE_TRX)
+    return {
+        'user': row if row['user_id'] is not None else None,
+        'sign_price': sign_price
+    }
+
+def get_user_context(user_id: int) -> Optional[Dict[str, Any]]:
+    """Get cached user context, loading it on a miss"""
+    context = user_context_cache.get(user_id)
+    if context is not None:
+        return context
+    
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        generation = _context_generation
+        context = load_user_context(user_id)
+        with _context_lock:
+            if generation == _context_generation:
+                user_context_cache.set(user_id, context)
+        return context
         
-        cursor.execute('''
-        UPDATE users SET last_activity = ? WHERE user_id = ?
-        ''', (datetime.now().isoformat(), user_id))
+    except Exception as e:
+        logger.error(f"Failed to load context for user {user_id}: {e}")
+        return None
+
+def invalidate_user_context(user_id: int = None):
+    """Drop one user's cached context, or every entry when user_id is None"""
+    global _context_generation
+    with _context_lock:
+        _context_generation += 1
+        if user_id is None:
+            user_context_cache.clear()
+        else:
+            user_context_cache.pop(user_id)
+
+# Write-behind buffer for last_activity: only the latest timestamp per user
+# is kept and written in one batch by flush_user_activity()
+_activity_buffer: Dict[int, str] = {}
+_activity_lock = threading.Lock()
+
+def record_user_activity(user_id: int) -> bool:
+    """Buffer user's last activity timestamp; returns True when a flush is due"""
+    with _activity_lock:
+        _activity_buffer[user_id] = datetime.now().isoformat()
+        return len(_activity_buffer) >= ACTIVITY_FLUSH_MAX_ENTRIES
+
+def flush_user_activity() -> int:
+    """Write buffered activity timestamps in one batch; returns rows written"""
+    with _activity_lock:
+        if not _activity_buffer:
+            return 0
+        pending = list(_activity_buffer.items())
+        _activity_buffer.clear()
+    
+    try:
+        with transaction() as cursor:
+            cursor.executemany('''
+            UPDATE users SET last_activity = ? WHERE user_id = ?
+            ''', [(timestamp, user_id) for user_id, timestamp in pending])
         
-        conn.commit()
-        conn.close()
+        return len(pending)
         
     except Exception as e:
-        logger.error(f"Failed to update activity for user {user_id}: {e}")
+        logger.error(f"Failed to flush activity for {len(pending)} users: {e}")
+        # Put entries back for the next flush unless a newer one arrived meanwhile
+        with _activity_lock:
+            for user_id, timestamp in pending:
+                _activity_buffer.setdefault(user_id, timestamp)
+        return 0
+
+def update_user_activity(user_id: int):
+    """Update user's last activity timestamp (buffered)"""
+    if record_user_activity(user_id):
+        flush_user_activity()
 
 def get_user_balance(user_id: int) -> float:
     """Get user's current balance"""
@@ -191,20 +647,18 @@ def get_user_balance(user_id: int) -> float:
 def update_balance(user_id: int, amount: float, tx_type: str = None, description: str = None) -> bool:
     """Update user balance and create transaction record"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Update balance
-        cursor.execute('''
-        UPDATE users SET balance = balance + ? WHERE user_id = ?
-        ''', (amount, user_id))
-        
-        # Add transaction record
-        if tx_type:
-            add_transaction(user_id, tx_type, amount, description=description, cursor=cursor)
+        with transaction() as cursor:
+            # Update balance
+            cursor.execute('''
+            UPDATE users SET balance = balance + ? WHERE user_id = ?
+            ''', (amount, user_id))
+            
+            # Add transaction record
+            if tx_type:
+                if not add_transaction(user_id, tx_type, amount, description=description, cursor=cursor):
+                    raise DatabaseError("Failed to record transaction")
         
-        conn.commit()
-        conn.close()
+        invalidate_user_context(user_id)
         return True
         
     except Exception as e:
@@ -214,15 +668,12 @@ def update_balance(user_id: int, amount: float, tx_type: str = None, description
 def block_user(user_id: int, blocked: bool = True) -> bool:
     """Block or unblock user"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        UPDATE users SET is_blocked = ? WHERE user_id = ?
-        ''', (int(blocked), user_id))
+        with transaction() as cursor:
+            cursor.execute('''
+            UPDATE users SET is_blocked = ? WHERE user_id = ?
+            ''', (int(blocked), user_id))
         
-        conn.commit()
-        conn.close()
+        invalidate_user_context(user_id)
         return cursor.rowcount > 0
         
     except Exception as e:
@@ -237,22 +688,14 @@ def is_user_blocked(user_id: int) -> bool:
 # Transaction Operations
 def add_transaction(user_id: int, tx_type: str, amount: float, trx_id: str = None, 
                    status: str = 'completed', description: str = None, cursor=None) -> bool:
-    """Add transaction record"""
+    """Add transaction record (joins the caller's transaction when a cursor is given)"""
     try:
-        should_close = cursor is None
-        if cursor is None:
-            conn = get_connection()
-            cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO transactions 
-        (user_id, tx_type, amount, trx_id, status, description, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, tx_type, amount, trx_id, status, description, datetime.now().isoformat()))
-        
-        if should_close:
-            conn.commit()
-            conn.close()
+        with transaction() as own_cursor:
+            (cursor or own_cursor).execute('''
+            INSERT INTO transactions 
+            (user_id, tx_type, amount, trx_id, status, description, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, tx_type, amount, trx_id, status, description, datetime.now().isoformat()))
             
         return True
         
@@ -263,18 +706,12 @@ def add_transaction(user_id: int, tx_type: str, amount: float, trx_id: str = Non
 def get_user_transactions(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
     """Get user's recent transactions"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        rows = get_connection().execute('''
         SELECT * FROM transactions 
         WHERE user_id = ? 
         ORDER BY timestamp DESC 
         LIMIT ?
-        ''', (user_id, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        ''', (user_id, limit)).fetchall()
         
         return [dict(row) for row in rows]
         
@@ -282,91 +719,678 @@ def get_user_transactions(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
         logger.error(f"Failed to get transactions for user {user_id}: {e}")
         return []
 
+# Debit Operations
+def _debit(cursor: sqlite3.Cursor, user_id: int, amount: float, tx_type: str,
+           description: str, status: str) -> Optional[Tuple[int, float]]:
+    """Debit amount if the balance covers it; returns (ledger row id, new balance)"""
+    row = cursor.execute('''
+    UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?
+    RETURNING balance
+    ''', (amount, user_id, amount)).fetchone()
+    if not row:
+        return None
+    
+    cursor.execute('''
+    INSERT INTO transactions 
+    (user_id, tx_type, amount, status, description, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, tx_type, -amount, status, description, datetime.now().isoformat()))
+    
+    return cursor.lastrowid, float(row['balance'])
+
+def debit_if_sufficient(user_id: int, amount: float, tx_type: str = 'sign_fee',
+                        description: str = None) -> Optional[float]:
+    """Atomically check balance, debit it and record the ledger row.
+
+    Returns the new balance, or None if the balance is insufficient.
+    """
+    try:
+        with transaction() as cursor:
+            result = _debit(cursor, user_id, amount, tx_type, description, 'completed')
+        
+        invalidate_user_context(user_id)
+        return result[1] if result else None
+        
+    except Exception as e:
+        logger.error(f"Failed to debit {amount} from user {user_id}: {e}")
+        return None
+
+def reserve_funds(user_id: int, amount: float, tx_type: str = 'sign_fee',
+                  description: str = None) -> Optional[Tuple[int, float]]:
+    """Hold funds for a pending job.
+
+    The amount leaves the balance right away and is recorded as a
+    'reserved' ledger row. Returns (reservation_id, new_balance), or None
+    if the balance is insufficient. Finish with commit_reservation() or
+    release_reservation().
+    """
+    try:
+        with transaction() as cursor:
+            result = _debit(cursor, user_id, amount, tx_type, description, 'reserved')
+        
+        invalidate_user_context(user_id)
+        return result
+        
+    except Exception as e:
+        logger.error(f"Failed to reserve {amount} for user {user_id}: {e}")
+        return None
+
+def commit_reservation(reservation_id: int, amount: Optional[float] = None) -> bool:
+    """Turn held funds into a completed charge.
+
+    With amount, only that much of the held funds is charged (never more
+    than was held) and the rest goes back to the balance.
+    """
+    try:
+        with transaction() as cursor:
+            row = cursor.execute('''
+            SELECT user_id, amount FROM transactions WHERE id = ? AND status = 'reserved'
+            ''', (reservation_id,)).fetchone()
+            if not row:
+                return False
+            
+            # Reserved rows store the debit as a negative amount
+            held = -row['amount']
+            charged = held if amount is None else min(amount, held)
+            cursor.execute('''
+            UPDATE transactions SET status = 'completed', amount = ?, timestamp = ?
+            WHERE id = ?
+            ''', (-charged, datetime.now().isoformat(), reservation_id))
+            if charged < held:
+                cursor.execute('''
+                UPDATE users SET balance = balance + ? WHERE user_id = ?
+                ''', (held - charged, row['user_id']))
+        
+        if charged < held:
+            invalidate_user_context(row['user_id'])
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to commit reservation {reservation_id}: {e}")
+        return False
+
+def release_reservation(reservation_id: int) -> bool:
+    """Return held funds to the user"""
+    try:
+        with transaction() as cursor:
+            row = cursor.execute('''
+            UPDATE transactions SET status = 'released', timestamp = ?
+            WHERE id = ? AND status = 'reserved'
+            RETURNING user_id, amount
+            ''', (datetime.now().isoformat(), reservation_id)).fetchone()
+            if not row:
+                return False
+            
+            # Reserved rows store the debit as a negative amount
+            cursor.execute('''
+            UPDATE users SET balance = balance - ? WHERE user_id = ?
+            ''', (row['amount'], row['user_id']))
+        
+        invalidate_user_context(row['user_id'])
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to release reservation {reservation_id}: {e}")
+        return False
+
+def release_stale_reservations(max_age_seconds: int = 3600) -> int:
+    """Refund reservations whose job never finished (e.g. after a crash)"""
+    try:
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        rows = get_connection().execute('''
+        SELECT id FROM transactions WHERE status = 'reserved' AND timestamp < ?
+        ''', (cutoff,)).fetchall()
+        
+        return sum(release_reservation(row['id']) for row in rows)
+        
+    except Exception as e:
+        logger.error(f"Failed to release stale reservations: {e}")
+        return 0
+
+# Deposit Operations
+def claim_txid(user_id: int, trx_id: str) -> Optional[bool]:
+    """Reserve a TRON TXID as a pending deposit.
+
+    Returns True if claimed, False if the TXID was already claimed by
+    anyone, or None on a database error. The unique index makes
+    concurrent claims of the same TXID resolve to one winner.
+    """
+    try:
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT OR IGNORE INTO transactions 
+            (user_id, tx_type, amount, trx_id, status, description, timestamp)
+            VALUES (?, 'deposit', 0, ?, 'pending', 'TRX Deposit', ?)
+            ''', (user_id, trx_id.lower(), datetime.now().isoformat()))
+        
+        return cursor.rowcount == 1
+        
+    except Exception as e:
+        logger.error(f"Failed to claim TXID {trx_id} for user {user_id}: {e}")
+        return None
+
+def complete_deposit(trx_id: str, amount: float, description: str = None) -> Optional[float]:
+    """Settle a claimed TXID and credit its user; returns the new balance"""
+    try:
+        with transaction() as cursor:
+            row = cursor.execute('''
+            UPDATE transactions 
+            SET amount = ?, status = 'completed', description = COALESCE(?, description), timestamp = ?
+            WHERE trx_id = ? AND status = 'pending'
+            RETURNING user_id
+            ''', (amount, description, datetime.now().isoformat(), trx_id.lower())).fetchone()
+            if not row:
+                return None
+            
+            balance = cursor.execute('''
+            UPDATE users SET balance = balance + ? WHERE user_id = ?
+            RETURNING balance
+            ''', (amount, row['user_id'])).fetchone()
+            if not balance:
+                raise DatabaseError(f"User {row['user_id']} not found")
+        
+        invalidate_user_context(row['user_id'])
+        return float(balance['balance'])
+        
+    except Exception as e:
+        logger.error(f"Failed to complete deposit {trx_id}: {e}")
+        return None
+
+def release_txid(trx_id: str) -> bool:
+    """Drop a pending TXID claim so it can be submitted again"""
+    try:
+        with transaction() as cursor:
+            cursor.execute('''
+            DELETE FROM transactions WHERE trx_id = ? AND status = 'pending'
+            ''', (trx_id.lower(),))
+        
+        return cursor.rowcount > 0
+        
+    except Exception as e:
+        logger.error(f"Failed to release TXID {trx_id}: {e}")
+        return False
+
+def release_stale_txid_claims(max_age_seconds: int = 600) -> int:
+    """Release pending claims left behind by a crash mid-verification"""
+    try:
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        with transaction() as cursor:
+            cursor.execute('''
+            DELETE FROM transactions 
+            WHERE tx_type = 'deposit' AND status = 'pending' AND trx_id IS NOT NULL AND timestamp < ?
+            ''', (cutoff,))
+        
+        return cursor.rowcount
+        
+    except Exception as e:
+        logger.error(f"Failed to release stale TXID claims: {e}")
+        return 0
+
+# Deposit Intent Operations
+INTENT_AMOUNT_STEP_SUN = 1000  # Unique amounts differ in the third decimal (0.001 TRX)
+INTENT_ATTEMPTS = 20
+
+def create_deposit_intent(user_id: int, amount_trx: int, ttl: int = DEPOSIT_INTENT_TTL) -> Optional[Dict[str, Any]]:
+    """Open a deposit intent for about amount_trx TRX.
+
+    The exact amount gets a 0.001-0.999 TRX offset and a memo that no
+    other pending intent has, so the incoming transfer can be matched to
+    this user by either one. Returns None if no free amount was found.
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl)
+    for _ in range(INTENT_ATTEMPTS):
+        amount_sun = amount_trx * 1_000_000 + (secrets.randbelow(999) + 1) * INTENT_AMOUNT_STEP_SUN
+        memo = secrets.token_hex(4)
+        try:
+            with transaction() as cursor:
+                cursor.execute('''
+                INSERT INTO deposit_intents (user_id, amount_sun, memo, status, created_at, expires_at)
+                VALUES (?, ?, ?, 'pending', ?, ?)
+                ''', (user_id, amount_sun, memo, now.isoformat(), expires_at.isoformat()))
+            
+            return {
+                'id': cursor.lastrowid,
+                'amount_sun': amount_sun,
+                'amount': amount_sun / 1_000_000,
+                'memo': memo,
+                'expires_at': expires_at,
+            }
+            
+        except sqlite3.IntegrityError:
+            continue  # Amount or memo taken by another pending intent
+        except Exception as e:
+            logger.error(f"Failed to create deposit intent for user {user_id}: {e}")
+            return None
+    
+    logger.warning(f"No free deposit amount near {amount_trx} TRX for user {user_id}")
+    return None
+
+def get_deposit_cursor(address: str) -> Optional[int]:
+    """Block time (ms) the deposit watcher has read the address up to"""
+    try:
+        row = get_connection().execute(
+            'SELECT min_timestamp FROM chain_cursors WHERE address = ?', (address,)
+        ).fetchone()
+        
+        return row['min_timestamp'] if row else None
+        
+    except Exception as e:
+        logger.error(f"Failed to get deposit cursor for {address}: {e}")
+        return None
+
+def settle_incoming_transfers(address: str, transfers: List[Dict[str, Any]], next_cursor: int,
+                              seen_until: int) -> Optional[List[Dict[str, Any]]]:
+    """Credit transfers that match pending deposit intents and advance the cursor, in one transaction.
+
+    transfers: confirmed incoming transfers, each with tx_id, amount_sun,
+    memo and block_timestamp (ms). Pending intents whose deadline is
+    before seen_until (ms) can no longer be paid and are expired.
+    Returns one entry per credited deposit, or None if nothing was saved.
+    """
+    try:
+        now = datetime.now().isoformat()
+        settled = []
+        credits: Dict[int, float] = defaultdict(float)
+        
+        with transaction() as cursor:
+            intents = cursor.execute('''
+            SELECT id, user_id, amount_sun, memo, created_at, expires_at
+            FROM deposit_intents WHERE status = 'pending'
+            ''').fetchall()
+            by_memo = {row['memo']: row for row in intents}
+            by_amount = {row['amount_sun']: row for row in intents}
+            
+            # TXIDs already credited, by an earlier poll or submitted by hand
+            known = set()
+            tx_ids = [t['tx_id'] for t in transfers]
+            for i in range(0, len(tx_ids), 500):
+                chunk = tx_ids[i:i + 500]
+                known.update(row['trx_id'] for row in cursor.execute(
+                    f"SELECT trx_id FROM transactions WHERE trx_id IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            
+            deposits = []
+            completed_intents = []
+            for transfer in transfers:
+                tx_id = transfer['tx_id']
+                if tx_id in known:
+                    continue
+                intent = by_memo.get(transfer['memo']) if transfer['memo'] else None
+                if intent is None:
+                    intent = by_amount.get(transfer['amount_sun'])
+                if intent is None:
+                    continue
+                # A transfer only pays an intent that was open when it was made
+                paid_at = datetime.fromtimestamp(transfer['block_timestamp'] / 1000).isoformat()
+                if not intent['created_at'] <= paid_at <= intent['expires_at']:
+                    continue
+                
+                by_memo.pop(intent['memo'], None)
+                by_amount.pop(intent['amount_sun'], None)
+                known.add(tx_id)
+                amount = transfer['amount_sun'] / 1_000_000
+                deposits.append((intent['user_id'], amount, tx_id, f'واریز خودکار TRX - TX: {tx_id[:8]}...', now))
+                completed_intents.append((tx_id, intent['id']))
+                credits[intent['user_id']] += amount
+                settled.append({'user_id': intent['user_id'], 'tx_id': tx_id, 'amount': amount})
+            
+            cursor.executemany('''
+            INSERT INTO transactions (user_id, tx_type, amount, trx_id, status, description, timestamp)
+            VALUES (?, 'deposit', ?, ?, 'completed', ?, ?)
+            ''', deposits)
+            cursor.executemany('''
+            UPDATE deposit_intents SET status = 'completed', trx_id = ? WHERE id = ?
+            ''', completed_intents)
+            
+            balances = {}
+            for user_id, total in credits.items():
+                row = cursor.execute('''
+                UPDATE users SET balance = balance + ? WHERE user_id = ?
+                RETURNING balance
+                ''', (total, user_id)).fetchone()
+                if not row:
+                    raise DatabaseError(f"User {user_id} not found")
+                balances[user_id] = float(row['balance'])
+            
+            cursor.execute('''
+            UPDATE deposit_intents SET status = 'expired'
+            WHERE status = 'pending' AND expires_at < ?
+            ''', (datetime.fromtimestamp(seen_until / 1000).isoformat(),))
+            
+            cursor.execute('''
+            INSERT INTO chain_cursors (address, min_timestamp, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (address) DO UPDATE SET
+                min_timestamp = excluded.min_timestamp,
+                updated_at = excluded.updated_at
+            ''', (address, next_cursor, now))
+        
+        for user_id in credits:
+            invalidate_user_context(user_id)
+        for deposit in settled:
+            deposit['balance'] = balances[deposit['user_id']]
+        return settled
+        
+    except Exception as e:
+        logger.error(f"Failed to settle {len(transfers)} incoming transfers: {e}")
+        return None
+
 # APK Operations
 def add_signed_apk(user_id: int, file_name: str, file_id: str, 
-                  original_size: int = 0, signed_size: int = 0) -> bool:
+                  original_size: int = 0, signed_size: int = 0,
+                  input_sha256: str = None, key_id: str = None, cached: bool = False) -> bool:
     """Record signed APK information"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT INTO signed_apks 
+            (user_id, file_name, file_id, original_size, signed_size, sign_time, input_sha256, key_id, cached)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, file_name, file_id, original_size, signed_size, datetime.now().isoformat(),
+                  input_sha256, key_id, int(cached)))
         
-        cursor.execute('''
-        INSERT INTO signed_apks 
-        (user_id, file_name, file_id, original_size, signed_size, sign_time)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, file_name, file_id, original_size, signed_size, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
         return True
         
     except Exception as e:
         logger.error(f"Failed to record signed APK for user {user_id}: {e}")
         return False
 
+def find_signed_apk(input_sha256: str, key_id: str) -> Optional[Dict[str, Any]]:
+    """Get the most recent signed output for the same input bytes and signing key"""
+    try:
+        row = get_connection().execute('''
+        SELECT file_id, signed_size FROM signed_apks
+        WHERE input_sha256 = ? AND key_id = ?
+        ORDER BY id DESC LIMIT 1
+        ''', (input_sha256, key_id)).fetchone()
+        
+        return dict(row) if row else None
+        
+    except Exception as e:
+        logger.error(f"Failed to look up signed APK {input_sha256}: {e}")
+        return None
+
+# Keystore Operations
+def save_user_keystore(user_id: int, key_id: str, private_key: bytes, certificate: bytes) -> bool:
+    """Store or replace a user's encrypted signing key"""
+    try:
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT INTO user_keystores (user_id, key_id, private_key, certificate, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                key_id = excluded.key_id,
+                private_key = excluded.private_key,
+                certificate = excluded.certificate,
+                updated_at = excluded.updated_at
+            ''', (user_id, key_id, private_key, certificate, datetime.now().isoformat()))
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to save keystore for user {user_id}: {e}")
+        return False
+
+def get_user_keystore(user_id: int) -> Optional[Dict[str, Any]]:
+    """Get a user's encrypted signing key"""
+    try:
+        row = get_connection().execute(
+            'SELECT * FROM user_keystores WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        
+        return dict(row) if row else None
+        
+    except Exception as e:
+        logger.error(f"Failed to get keystore for user {user_id}: {e}")
+        return None
+
+def get_user_keystore_version(user_id: int) -> Optional[str]:
+    """Get when a user's key was last replaced, or None if they have none"""
+    try:
+        row = get_connection().execute(
+            'SELECT updated_at FROM user_keystores WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        
+        return row['updated_at'] if row else None
+        
+    except Exception as e:
+        logger.error(f"Failed to get keystore version for user {user_id}: {e}")
+        return None
+
+def touch_user_keystore(user_id: Optional[int] = None) -> bool:
+    """Mark a user's key (or every user key) as changed, so all processes reload it"""
+    try:
+        with transaction() as cursor:
+            if user_id is None:
+                cursor.execute('UPDATE user_keystores SET updated_at = ?', (datetime.now().isoformat(),))
+            else:
+                cursor.execute('UPDATE user_keystores SET updated_at = ? WHERE user_id = ?',
+                               (datetime.now().isoformat(), user_id))
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to touch keystore of user {user_id}: {e}")
+        return False
+
+def delete_user_keystore(user_id: int) -> bool:
+    """Remove a user's signing key; they go back to the bot key"""
+    try:
+        with transaction() as cursor:
+            cursor.execute('DELETE FROM user_keystores WHERE user_id = ?', (user_id,))
+            return cursor.rowcount > 0
+        
+    except Exception as e:
+        logger.error(f"Failed to delete keystore for user {user_id}: {e}")
+        return False
+
+# TRON Lookup Cache Operations
+def save_tron_transaction(tx_id: str, provider: str, payload: Dict[str, Any]) -> bool:
+    """Store a provider's raw answer for a confirmed transaction"""
+    try:
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT OR REPLACE INTO tron_transactions (tx_id, provider, data, fetched_at)
+            VALUES (?, ?, ?, ?)
+            ''', (tx_id, provider, json.dumps(payload), datetime.now().isoformat()))
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to save TRON transaction {tx_id}: {e}")
+        return False
+
+def get_tron_transaction(tx_id: str) -> Optional[Dict[str, Any]]:
+    """Get a stored raw transaction as {'provider', 'payload'}, or None if it was never confirmed"""
+    try:
+        row = get_connection().execute(
+            'SELECT provider, data FROM tron_transactions WHERE tx_id = ? AND provider IS NOT NULL', (tx_id,)
+        ).fetchone()
+        
+        return {'provider': row['provider'], 'payload': json.loads(row['data'])} if row else None
+        
+    except Exception as e:
+        logger.error(f"Failed to get TRON transaction {tx_id}: {e}")
+        return None
+
 # Support Operations
 def add_support_message(user_id: int, message_id: int, message_text: str) -> bool:
     """Add support message"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        INSERT INTO support_messages 
-        (user_id, message_id, message_text, created_at)
-        VALUES (?, ?, ?, ?)
-        ''', (user_id, message_id, message_text, datetime.now().isoformat()))
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT INTO support_messages 
+            (user_id, message_id, message_text, created_at)
+            VALUES (?, ?, ?, ?)
+            ''', (user_id, message_id, message_text, datetime.now().isoformat()))
         
-        conn.commit()
-        conn.close()
         return True
         
     except Exception as e:
         logger.error(f"Failed to add support message: {e}")
         return False
 
-# Admin Operations
-def get_total_users() -> int:
-    """Get total number of users"""
+def get_support_messages(status: str = 'pending', limit: int = 10) -> List[Dict[str, Any]]:
+    """Get oldest support messages with the given status"""
+    try:
+        rows = get_connection().execute('''
+        SELECT * FROM support_messages 
+        WHERE status = ? 
+        ORDER BY created_at 
+        LIMIT ?
+        ''', (status, limit)).fetchall()
+        
+        return [dict(row) for row in rows]
+        
+    except Exception as e:
+        logger.error(f"Failed to get support messages: {e}")
+        return []
+
+# Statistics Operations
+# The stats and daily_signings tables are kept current by triggers
+# (see _migration_stats_rollup), so reading them is O(1).
+STATS_KEYS = (
+    'user_count', 'total_balance', 'total_deposits', 'total_sign_fees',
+    'sign_cache_hits', 'sign_cache_misses'
+)
+
+# Before TXIDs were claimed atomically, each verified deposit was written twice:
+# an update_balance() row without TXID ('واریز TRX - TX: <first 8 chars>...')
+# and an add_transaction() row with the TXID. Only the TXID row is counted.
+LEGACY_DUPLICATE_DEPOSIT = '''(
+    t.tx_type = 'deposit' AND t.trx_id IS NULL AND t.description LIKE 'واریز TRX - TX: %' AND EXISTS (
+        SELECT 1 FROM transactions d
+        WHERE d.tx_type = 'deposit' AND d.status = 'completed' AND d.trx_id IS NOT NULL
+        AND d.user_id = t.user_id AND d.amount = t.amount
+        AND t.description = 'واریز TRX - TX: ' || substr(d.trx_id, 1, 8) || '...'
+    )
+)'''
+
+def _compute_stats(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+    """Recompute every rollup value from the live tables"""
+    users = cursor.execute('''
+    SELECT COUNT(*) AS user_count, COALESCE(SUM(balance), 0) AS total_balance FROM users
+    ''').fetchone()
+    ledger = cursor.execute(f'''
+    SELECT
+        COALESCE(SUM(CASE WHEN tx_type = 'deposit' THEN amount END), 0) AS total_deposits,
+        COALESCE(SUM(CASE WHEN tx_type = 'sign_fee' THEN -amount END), 0) AS total_sign_fees
+    FROM transactions t WHERE status = 'completed' AND NOT {LEGACY_DUPLICATE_DEPOSIT}
+    ''').fetchone()
+    cache = cursor.execute('''
+    SELECT COALESCE(SUM(cached), 0) AS hits, COUNT(*) - COALESCE(SUM(cached), 0) AS misses
+    FROM signed_apks
+    ''').fetchone()
+    daily = cursor.execute('''
+    SELECT substr(sign_time, 1, 10) AS day, COUNT(*) AS count
+    FROM signed_apks GROUP BY day
+    ''').fetchall()
+    
+    return {
+        'user_count': users['user_count'],
+        'total_balance': users['total_balance'],
+        'total_deposits': ledger['total_deposits'],
+        'total_sign_fees': ledger['total_sign_fees'],
+        'sign_cache_hits': cache['hits'],
+        'sign_cache_misses': cache['misses'],
+        'daily_signings': {row['day']: row['count'] for row in daily}
+    }
+
+def _write_stats(cursor: sqlite3.Cursor, stats: Dict[str, Any]):
+    cursor.executemany(
+        'INSERT OR REPLACE INTO stats (key, value) VALUES (?, ?)',
+        [(key, stats[key]) for key in STATS_KEYS]
+    )
+    cursor.execute('DELETE FROM daily_signings')
+    cursor.executemany(
+        'INSERT INTO daily_signings (day, count) VALUES (?, ?)',
+        list(stats['daily_signings'].items())
+    )
+
+def get_stats() -> Dict[str, Any]:
+    """Get rollup statistics plus today's signing count"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        stats = {row['key']: row['value'] for row in conn.execute('SELECT key, value FROM stats')}
+        today = conn.execute(
+            'SELECT count FROM daily_signings WHERE day = ?', (datetime.now().date().isoformat(),)
+        ).fetchone()
+        hits = stats.get('sign_cache_hits', 0)
+        misses = stats.get('sign_cache_misses', 0)
         
-        cursor.execute('SELECT COUNT(*) as count FROM users')
-        result = cursor.fetchone()
-        conn.close()
+        return {
+            'user_count': int(stats.get('user_count', 0)),
+            'total_balance': stats.get('total_balance', 0.0),
+            'total_deposits': stats.get('total_deposits', 0.0),
+            'total_sign_fees': stats.get('total_sign_fees', 0.0),
+            'signings_today': today['count'] if today else 0,
+            'sign_cache_hits': int(hits),
+            'sign_cache_misses': int(misses),
+            'sign_cache_hit_ratio': hits / (hits + misses) if hits + misses else 0.0
+        }
         
-        return result['count']
+    except Exception as e:
+        logger.error(f"Failed to get stats: {e}")
+        return {key: 0 for key in STATS_KEYS + ('signings_today', 'sign_cache_hit_ratio')}
+
+def get_daily_signings(days: int = 7) -> List[Dict[str, Any]]:
+    """Get signing counts for the most recent days"""
+    try:
+        rows = get_connection().execute(
+            'SELECT day, count FROM daily_signings ORDER BY day DESC LIMIT ?', (days,)
+        ).fetchall()
+        
+        return [dict(row) for row in rows]
         
     except Exception as e:
-        logger.error(f"Failed to get total users: {e}")
-        return 0
+        logger.error(f"Failed to get daily signings: {e}")
+        return []
 
-def get_total_balance() -> float:
-    """Get sum of all user balances"""
+def rebuild_stats() -> Dict[str, Tuple[Any, Any]]:
+    """Recompute the rollup from scratch.
+
+    Returns {name: (stored, actual)} for every value that had drifted.
+    """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with transaction() as cursor:
+            stored = {row['key']: row['value'] for row in cursor.execute('SELECT key, value FROM stats')}
+            stored_daily = {
+                row['day']: row['count'] for row in cursor.execute('SELECT day, count FROM daily_signings')
+            }
+            actual = _compute_stats(cursor)
+            _write_stats(cursor, actual)
         
-        cursor.execute('SELECT COALESCE(SUM(balance), 0) as total FROM users')
-        result = cursor.fetchone()
-        conn.close()
+        mismatches = {}
+        for key in STATS_KEYS:
+            if abs(stored.get(key, 0) - actual[key]) > 1e-6:
+                mismatches[key] = (stored.get(key, 0), actual[key])
+        for day in sorted(set(stored_daily) | set(actual['daily_signings'])):
+            if stored_daily.get(day, 0) != actual['daily_signings'].get(day, 0):
+                mismatches[f'signings {day}'] = (stored_daily.get(day, 0), actual['daily_signings'].get(day, 0))
         
-        return result['total']
+        if mismatches:
+            logger.warning(f"Stats rollup had drifted: {mismatches}")
+        return mismatches
         
     except Exception as e:
-        logger.error(f"Failed to get total balance: {e}")
-        return 0.0
+        logger.error(f"Failed to rebuild stats: {e}")
+        raise DatabaseError(f"Stats rebuild failed: {e}")
+
+# Admin Operations
+def get_total_users() -> int:
+    """Get total number of users"""
+    return get_stats()['user_count']
+
+def get_total_balance() -> float:
+    """Get sum of all user balances"""
+    return get_stats()['total_balance']
 
 def get_all_user_ids() -> List[int]:
     """Get all user IDs for broadcasting"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT user_id FROM users WHERE is_blocked = 0')
-        rows = cursor.fetchall()
-        conn.close()
+        rows = get_connection().execute(
+            'SELECT user_id FROM users WHERE is_blocked = 0'
+        ).fetchall()
         
         return [row['user_id'] for row in rows]
         
@@ -377,12 +1401,9 @@ def get_all_user_ids() -> List[int]:
 def find_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Find user by username"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        row = cursor.fetchone()
-        conn.close()
+        row = get_connection().execute(
+            'SELECT * FROM users WHERE username = ?', (username,)
+        ).fetchone()
         
         return dict(row) if row else None
         
@@ -394,12 +1415,9 @@ def find_user_by_username(username: str) -> Optional[Dict[str, Any]]:
 def get_setting(key: str, default: str = None) -> str:
     """Get setting value"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        row = cursor.fetchone()
-        conn.close()
+        row = get_connection().execute(
+            'SELECT value FROM settings WHERE key = ?', (key,)
+        ).fetchone()
         
         return row['value'] if row else default
         
@@ -410,18 +1428,37 @@ def get_setting(key: str, default: str = None) -> str:
 def set_setting(key: str, value: str) -> bool:
     """Set setting value"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with transaction() as cursor:
+            cursor.execute('''
+            INSERT OR REPLACE INTO settings (key, value, updated_at)
+            VALUES (?, ?, ?)
+            ''', (key, value, datetime.now().isoformat()))
         
-        cursor.execute('''
-        INSERT OR REPLACE INTO settings (key, value, updated_at)
-        VALUES (?, ?, ?)
-        ''', (key, value, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
+        # Settings are part of every cached context
+        invalidate_user_context()
         return True
         
     except Exception as e:
         logger.error(f"Failed to set setting {key}: {e}")
         return False
+
+
+if __name__ == "__main__":
+    # python db.py --check-plans [--db PATH]: migrate the database (a fresh
+    # in-memory one by default) and exit non-zero if a hot query lost its index
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument('--check-plans', action='store_true', required=True,
+                        help="check that every hot query is served by its index")
+    parser.add_argument('--db', default=':memory:', help="database file to check")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    
+    use_database(args.db)
+    init_db()
+    problems = check_query_plans()
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    print(f"{len(HOT_QUERY_PLANS) - len(problems)}/{len(HOT_QUERY_PLANS)} hot queries use their index")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import async_db as db
+import trx
+from config import (
+    TRX_ADDRESS, DEPOSIT_WATCH_INTERVAL, DEPOSIT_WATCH_PAGE_SIZE, DEPOSIT_WATCH_MAX_PAGES,
+    DEPOSIT_INTENT_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Confirmed transfers trail the chain head by about a minute; intents are
+# only expired once the chain has been read this far past their deadline
+CONFIRMATION_MARGIN_MS = 5 * 60 * 1000
+
+class DepositWatcher:
+    """Credits incoming TRX transfers that match deposit intents, without users sending a TXID.
+
+    Each poll reads the address's confirmed incoming transfers page by
+    page from a cursor kept in the database, matches them to pending
+    intents by memo or unique amount, and credits them all in the one
+    transaction that also moves the cursor, so a restart never credits a
+    transfer twice or skips one.
+    """
+
+    def __init__(self, address: str = TRX_ADDRESS, api: Optional[trx.TronAPI] = None,
+                 interval: float = DEPOSIT_WATCH_INTERVAL, page_size: int = DEPOSIT_WATCH_PAGE_SIZE,
+                 max_pages: int = DEPOSIT_WATCH_MAX_PAGES,
+                 on_settled: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None):
+        self.address = address
+        self.api = api or trx.tron_api
+        self.interval = interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.on_settled = on_settled
+        self.polls = 0
+        self.credited = 0
+
+    async def poll(self) -> List[Dict[str, Any]]:
+        """Read the transfers that arrived since the last poll and credit the matching ones"""
+        cursor = await db.get_deposit_cursor(self.address)
+        if cursor is None:
+            # First run: nothing older than an intent that may still be open
+            cursor = int((time.time() - DEPOSIT_INTENT_TTL) * 1000)
+
+        transfers = []
+        next_cursor = cursor
+        fingerprint = None
+        for _ in range(self.max_pages):
+            page, fingerprint, last_timestamp, server_time = await self.api.get_incoming_transfers(
+                self.address, cursor, fingerprint, self.page_size
+            )
+            transfers.extend(page)
+            next_cursor = max(next_cursor, last_timestamp)
+            if not fingerprint:
+                seen_until = server_time - CONFIRMATION_MARGIN_MS
+                break
+        else:
+            # More pages wait for the next poll; the chain is read up to here
+            seen_until = next_cursor - 1
+
+        # The cursor is inclusive, so the last block's transfers are read again
+        # next time; they are recognised by their TXID and skipped
+        settled = await db.settle_incoming_transfers(self.address, transfers, next_cursor, seen_until)
+        if settled is None:
+            return []
+
+        self.polls += 1
+        self.credited += len(settled)
+        if settled:
+            logger.info(f"Deposit watcher credited {len(settled)} of {len(transfers)} incoming transfers")
+            if self.on_settled is not None:
+                await self.on_settled(settled)
+        return settled
+
+    async def run(self):
+        """Poll every `interval` seconds until cancelled"""
+        logger.info(f"Deposit watcher polling {self.address} every {self.interval:.0f}s")
+        while True:
+            try:
+                await self.poll()
+            except trx.TronAPIError as e:
+                logger.warning(f"Deposit watcher poll failed: {e}")
+            except Exception as e:
+                logger.error(f"Deposit watcher error: {e}")
+            await asyncio.sleep(self.interval)
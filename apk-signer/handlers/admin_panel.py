@@ -4,8 +4,11 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import asyncio
 from config import ADMINS
-import db
+import async_db as db
+import keystore
+import trx
 from keyboards import back_to_main_menu, admin_panel_keyboard
 
 router = Router()
@@ -68,13 +71,17 @@ async def admin_stats(callback: types.CallbackQuery):
         return
 
     try:
-        total_users = db.get_total_users()
-        total_balance = db.get_total_balance()
+        stats = await db.get_stats()
 
         stats_text = (
             f"📊 **آمار کلی ربات:**\n\n"
-            f"👥 تعداد کاربران: **{total_users}**\n"
-            f"💰 مجموع موجودی کل: **{total_balance:.2f} TRX**"
+            f"👥 تعداد کاربران: **{stats['user_count']}**\n"
+            f"💰 مجموع موجودی کل: **{stats['total_balance']:.2f} TRX**\n"
+            f"💳 مجموع واریزی‌ها: **{stats['total_deposits']:.2f} TRX**\n"
+            f"📱 مجموع کارمزد امضا: **{stats['total_sign_fees']:.2f} TRX**\n"
+            f"📅 امضاهای امروز: **{stats['signings_today']}**\n"
+            f"♻️ نرخ استفاده از کش امضا: **{stats['sign_cache_hit_ratio']:.0%}** "
+            f"({stats['sign_cache_hits']} از {stats['sign_cache_hits'] + stats['sign_cache_misses']})"
         )
 
         await callback.message.edit_text(
@@ -89,6 +96,90 @@ async def admin_stats(callback: types.CallbackQuery):
 
     await callback.answer()
 
+@router.message(Command("rebuild_stats"))
+async def admin_rebuild_stats(message: types.Message):
+    """Recompute statistics from the live tables and report any drift"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ دسترسی محدود!")
+        return
+
+    try:
+        mismatches = await db.rebuild_stats()
+
+        if not mismatches:
+            await message.answer("✅ آمار بازسازی شد. مغایرتی یافت نشد.")
+            return
+
+        report = "\n".join(
+            f"• {name}: {stored} → {actual}" for name, (stored, actual) in mismatches.items()
+        )
+        await message.answer(f"⚠️ آمار بازسازی شد. مغایرت‌ها:\n\n{report}")
+        logger.warning(f"Admin {message.from_user.id} rebuilt stats, fixed: {mismatches}")
+
+    except Exception as e:
+        logger.error(f"Error rebuilding stats: {e}")
+        await message.answer("❌ خطا در بازسازی آمار.")
+
+@router.message(Command("rotate_key"))
+async def admin_rotate_key(message: types.Message):
+    """Replace the bot signing key; workers pick up the new key on their next job"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ دسترسی محدود!")
+        return
+
+    try:
+        key = await asyncio.to_thread(keystore.registry.rotate_default_key)
+        await message.answer(f"✅ کلید امضای ربات تعویض شد.\n🔑 شناسه کلید جدید: `{key.key_id[:16]}`", parse_mode="Markdown")
+        logger.warning(f"Admin {message.from_user.id} rotated the bot signing key to {key.key_id}")
+
+    except Exception as e:
+        logger.error(f"Error rotating signing key: {e}")
+        await message.answer("❌ خطا در تعویض کلید امضا.")
+
+@router.message(Command("evict_key"))
+async def admin_evict_key(message: types.Message):
+    """Drop a cached signing key so every process reloads it from its source"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ دسترسی محدود!")
+        return
+
+    args = message.text.split()
+    if len(args) != 2 or not (args[1] == keystore.DEFAULT_KEY or args[1].isdigit()):
+        await message.answer(
+            "❌ فرمت صحیح: /evict_key <default|user_id>\n"
+            "مثال: /evict_key 123456789"
+        )
+        return
+
+    key_ref = args[1] if args[1] == keystore.DEFAULT_KEY else keystore.user_key_ref(int(args[1]))
+    await asyncio.to_thread(keystore.registry.evict, key_ref)
+    await message.answer(f"✅ کلید {key_ref} از حافظه حذف شد و در امضای بعدی دوباره بارگذاری می‌شود.")
+
+@router.message(Command("tron_status"))
+async def admin_tron_status(message: types.Message):
+    """Show TRON API provider health: circuit state, latency, failure rate and selection counts"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ دسترسی محدود!")
+        return
+
+    metrics = trx.tron_api.metrics()
+    states = {'closed': '🟢 فعال', 'half_open': '🟡 در حال آزمایش', 'open': '🔴 قطع'}
+    lines = [
+        "🌐 وضعیت سرویس‌های TRON\n",
+        f"🔎 استعلام‌ها: {metrics['lookups']} (درخواست موازی: {metrics['hedged_lookups']})",
+        f"💾 از کش: {metrics['cache_hits']} حافظه / {metrics['db_hits']} دیتابیس / {metrics['coalesced']} ادغام‌شده",
+    ]
+    for name, p in metrics['providers'].items():
+        p95 = f"{p['p95'] * 1000:.0f}ms" if p['p95'] is not None else "-"
+        lines.append(
+            f"\n{name}: {states.get(p['state'], p['state'])}\n"
+            f"• امتیاز سلامت: {p['score']:.2f}\n"
+            f"• تأخیر میانگین: {p['latency_ewma'] * 1000:.0f}ms / p95: {p95}\n"
+            f"• خطا: {p['failures']} از {p['requests']} ({p['failure_rate']:.0%})\n"
+            f"• انتخاب اول: {p['primary']} / موازی: {p['hedges']} / پاسخ برنده: {p['wins']}"
+        )
+    await message.answer("\n".join(lines))
+
 @router.callback_query(F.data == "admin_search_user")
 async def admin_search_user(callback: types.CallbackQuery, state: FSMContext):
     """Prompt for user ID to search"""
@@ -128,7 +219,7 @@ async def handle_user_search(message: types.Message, state: FSMContext):
     """Handle user ID search"""
     try:
         user_id = int(message.text.strip())
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
 
         if not user:
             await message.answer(
@@ -139,7 +230,7 @@ async def handle_user_search(message: types.Message, state: FSMContext):
             return
 
         # Get user transactions
-        transactions = db.get_user_transactions(user_id, limit=5)
+        transactions = await db.get_user_transactions(user_id, limit=5)
 
         user_info = (
             f"👤 **اطلاعات کاربر:**\n\n"
@@ -204,7 +295,7 @@ async def handle_balance_adjustment(message: types.Message, state: FSMContext):
         amount = float(parts[1])
 
         # Check if user exists
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         if not user:
             await message.answer(
                 f"❌ کاربر با آیدی {user_id} یافت نشد!",
@@ -218,7 +309,7 @@ async def handle_balance_adjustment(message: types.Message, state: FSMContext):
         tx_type = "admin_credit" if amount > 0 else "admin_debit"
         description = f"Admin adjustment: {amount:+.2f} TRX"
 
-        success = db.update_balance(user_id, amount, tx_type, description)
+        success = await db.update_balance(user_id, amount, tx_type, description)
 
         if success:
             new_balance = old_balance + amount
@@ -329,7 +420,7 @@ async def handle_amount_adjustment(message: types.Message, state: FSMContext):
             amount = -amount
 
         # Check if user exists
-        user = db.get_user(target_user_id)
+        user = await db.get_user(target_user_id)
         if not user:
             await message.answer(
                 f"❌ کاربر با آیدی {target_user_id} یافت نشد!",
@@ -342,7 +433,7 @@ async def handle_amount_adjustment(message: types.Message, state: FSMContext):
         tx_type = f"admin_{operation}"
         description = f"Admin {operation}: {abs(amount):.2f} TRX"
 
-        success = db.update_balance(target_user_id, amount, tx_type, description)
+        success = await db.update_balance(target_user_id, amount, tx_type, description)
 
         if success:
             new_balance = old_balance + amount
@@ -2,23 +2,21 @@
 from aiogram import Router, types
 from keyboards import back_to_main_menu
 from datetime import datetime
-import db
+import async_db as db
 import logging
+from middlewares import UserContext
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 @router.message(lambda message: message.text == "حساب کاربری 🧾")
-async def show_balance(message: types.Message):
+async def show_balance(message: types.Message, user_ctx: UserContext):
     """Display user account information and transaction history"""
     try:
         user_id = message.from_user.id
         
-        # Update user activity
-        db.update_user_activity(user_id)
-        
         # Check if user is blocked
-        if db.is_user_blocked(user_id):
+        if user_ctx.is_blocked:
             await message.answer(
                 "🚫 حساب شما مسدود شده است.",
                 reply_markup=back_to_main_menu()
@@ -26,7 +24,7 @@ async def show_balance(message: types.Message):
             return
         
         # Get user information
-        user = db.get_user(user_id)
+        user = user_ctx.user
         if not user:
             await message.answer(
                 "❌ اطلاعات کاربری یافت نشد. لطفا دوباره /start کنید.",
@@ -35,7 +33,7 @@ async def show_balance(message: types.Message):
             return
         
         # Get recent transactions
-        transactions = db.get_user_transactions(user_id, limit=5)
+        transactions = await db.get_user_transactions(user_id, limit=5)
         
         # Format user info
         join_date = datetime.fromisoformat(user['join_date']).strftime("%Y/%m/%d") if user['join_date'] else "نامشخص"
@@ -66,7 +64,7 @@ async def show_balance(message: types.Message):
                 }
                 
                 icon = type_icons.get(tx['tx_type'], '💰')
-                status_emoji = '✅' if tx['status'] == 'completed' else '⏳'
+                status_emoji = {'completed': '✅', 'released': '↩️'}.get(tx['status'], '⏳')
                 
                 user_info += (
                     f"{i}. {icon} {amount_str} TRX {status_emoji}\n"
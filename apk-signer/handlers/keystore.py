@@ -0,0 +1,143 @@
+from aiogram import Router, types, F, Bot
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramAPIError
+import asyncio
+import io
+import logging
+
+import async_db as db
+import keystore
+from keyboards import back_to_main_menu
+from middlewares import UserContext
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+KEYSTORE_EXTENSIONS = ('.p12', '.pfx')
+
+class KeystoreStates(StatesGroup):
+    waiting_for_keystore = State()
+    waiting_for_password = State()
+
+@router.message(Command("keystore"))
+async def keystore_command(message: types.Message, state: FSMContext, user_ctx: UserContext):
+    """Ask for a PKCS#12 keystore to sign this user's APKs with"""
+    if user_ctx.is_blocked:
+        await message.answer(
+            "🚫 حساب شما مسدود شده است.",
+            reply_markup=back_to_main_menu()
+        )
+        return
+
+    await message.answer(
+        "🔑 **کلید امضای اختصاصی**\n\n"
+        "فایل کی‌استور خود را با فرمت PKCS#12 (`.p12` یا `.pfx`) ارسال کنید.\n"
+        "از این پس APKهای شما با همین کلید امضا می‌شوند.\n\n"
+        "💡 کی‌استور JKS را می‌توانید با keytool به PKCS#12 تبدیل کنید:\n"
+        "`keytool -importkeystore -srckeystore my.jks -destkeystore my.p12 -deststoretype PKCS12`\n\n"
+        "🗑 برای بازگشت به کلید ربات: /keystore_remove",
+        parse_mode="Markdown",
+        reply_markup=back_to_main_menu()
+    )
+    await state.set_state(KeystoreStates.waiting_for_keystore)
+
+@router.message(KeystoreStates.waiting_for_keystore, F.document)
+async def handle_keystore_file(message: types.Message, state: FSMContext, bot: Bot):
+    """Receive the keystore file and ask for its password"""
+    try:
+        document = message.document
+        if not document.file_name or not document.file_name.lower().endswith(KEYSTORE_EXTENSIONS):
+            await message.answer(
+                "❌ لطفا فقط فایل `.p12` یا `.pfx` ارسال کنید.",
+                parse_mode="Markdown",
+                reply_markup=back_to_main_menu()
+            )
+            return
+
+        if document.file_size > keystore.MAX_KEYSTORE_SIZE:
+            await message.answer(
+                "❌ حجم فایل کی‌استور بیش از حد مجاز است.",
+                reply_markup=back_to_main_menu()
+            )
+            return
+
+        # A few KB: kept in memory only, never written to disk unencrypted
+        buffer = io.BytesIO()
+        await bot.download(document, destination=buffer)
+        await state.update_data(keystore_data=buffer.getvalue())
+
+        await message.answer("🔒 رمز کی‌استور را ارسال کنید (پیام رمز پس از خواندن حذف می‌شود):")
+        await state.set_state(KeystoreStates.waiting_for_password)
+
+    except Exception as e:
+        logger.error(f"Error receiving keystore from user {message.from_user.id}: {e}")
+        await message.answer(
+            "❌ خطا در دریافت فایل کی‌استور.",
+            reply_markup=back_to_main_menu()
+        )
+        await state.clear()
+
+@router.message(KeystoreStates.waiting_for_password, F.text)
+async def handle_keystore_password(message: types.Message, state: FSMContext):
+    """Decrypt the keystore with the given password and save the key"""
+    user_id = message.from_user.id
+    data = await state.get_data()
+    await state.clear()
+
+    # Remove the password from the chat before anything else
+    try:
+        await message.delete()
+    except TelegramAPIError as e:
+        logger.warning(f"Could not delete keystore password message of user {user_id}: {e}")
+
+    try:
+        key_id, private_key, certificate = await asyncio.to_thread(
+            keystore.import_pkcs12, data.get('keystore_data', b''), message.text
+        )
+    except keystore.KeystoreError as e:
+        logger.info(f"Keystore import failed for user {user_id}: {e}")
+        await message.answer(
+            "❌ کی‌استور باز نشد. رمز را بررسی کنید و دوباره /keystore را بزنید.",
+            reply_markup=back_to_main_menu()
+        )
+        return
+
+    try:
+        if not await db.save_user_keystore(user_id, key_id, private_key, certificate):
+            raise RuntimeError("save_user_keystore failed")
+        # Drop any older key of this user from memory; workers reload on the next job
+        await asyncio.to_thread(keystore.registry.evict, keystore.user_key_ref(user_id))
+
+        await message.answer(
+            f"✅ کلید امضای شما ذخیره شد.\n🔑 شناسه کلید: `{key_id[:16]}`",
+            parse_mode="Markdown",
+            reply_markup=back_to_main_menu()
+        )
+        logger.info(f"User {user_id} uploaded signing key {key_id}")
+
+    except Exception as e:
+        logger.error(f"Error saving keystore for user {user_id}: {e}")
+        await message.answer(
+            "❌ خطا در ذخیره کلید امضا.",
+            reply_markup=back_to_main_menu()
+        )
+
+@router.message(Command("keystore_remove"))
+async def keystore_remove(message: types.Message, state: FSMContext):
+    """Delete the user's keystore and go back to signing with the bot key"""
+    user_id = message.from_user.id
+    await state.clear()
+
+    if await db.delete_user_keystore(user_id):
+        await asyncio.to_thread(keystore.registry.evict, keystore.user_key_ref(user_id))
+        await message.answer(
+            "✅ کلید اختصاصی شما حذف شد. APKها از این پس با کلید ربات امضا می‌شوند.",
+            reply_markup=back_to_main_menu()
+        )
+    else:
+        await message.answer(
+            "ℹ️ کلید اختصاصی ثبت نشده است.",
+            reply_markup=back_to_main_menu()
+        )
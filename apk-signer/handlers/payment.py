@@ -1,39 +1,39 @@
 
-from aiogram import Router, types, F
+from aiogram import Router, types, F, Bot
+from aiogram.exceptions import TelegramAPIError
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ForceReply
 import logging
+from typing import Any, Dict, List
 
 import trx
-import db
-from config import TRX_ADDRESS
+import async_db as db
+from config import TRX_ADDRESS, DEPOSIT_WATCH_INTERVAL
 from keyboards import back_to_main_menu, payment_method_keyboard, cancel_keyboard
+from middlewares import UserContext
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+MIN_DEPOSIT_TRX = 1
+
 class PaymentStates(StatesGroup):
     waiting_for_txid = State()
 
 @router.message(lambda message: message.text == "افزایش موجودی 💰")
-async def request_payment(message: types.Message, state: FSMContext):
+async def request_payment(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Display payment instructions and request TX ID"""
     try:
-        user_id = message.from_user.id
-        
-        # Update user activity
-        db.update_user_activity(user_id)
-        
         # Check if user is blocked
-        if db.is_user_blocked(user_id):
+        if user_ctx.is_blocked:
             await message.answer(
                 "🚫 حساب شما مسدود شده است.",
                 reply_markup=back_to_main_menu()
             )
             return
         
-        current_balance = db.get_user_balance(user_id)
+        current_balance = user_ctx.balance
         
         instructions = (
             "💳 **افزایش موجودی TRX**\n\n"
@@ -50,8 +50,15 @@ async def request_payment(message: types.Message, state: FSMContext):
             "• فقط از شبکه TRON استفاده کنید\n"
             "• آدرس را دقیق کپی کنید\n"
             "• TX ID باید معتبر و تأیید شده باشد\n\n"
-            "پس از انجام تراکنش، TX ID را ارسال کنید:"
         )
+        if DEPOSIT_WATCH_INTERVAL > 0:
+            instructions += (
+                "⚡️ **واریز خودکار:** پیش از پرداخت، مبلغ را به عدد (TRX) ارسال کنید تا "
+                "مبلغ دقیق اختصاصی شما اعلام شود؛ پس از پرداخت، موجودی بدون نیاز به TX ID شارژ می‌شود.\n\n"
+                "مبلغ مورد نظر یا TX ID تراکنش را ارسال کنید:"
+            )
+        else:
+            instructions += "پس از انجام تراکنش، TX ID را ارسال کنید:"
         
         await message.answer(
             instructions,
@@ -71,6 +78,63 @@ async def request_payment(message: types.Message, state: FSMContext):
             reply_markup=back_to_main_menu()
         )
 
+@router.message(PaymentStates.waiting_for_txid, F.text.regexp(r'^\d{1,6}$'))
+async def create_deposit_intent(message: types.Message, state: FSMContext):
+    """Give the user a unique amount and memo; the deposit watcher credits the transfer"""
+    if DEPOSIT_WATCH_INTERVAL <= 0:
+        await message.answer(
+            "ℹ️ واریز خودکار فعال نیست. لطفا پس از پرداخت، TX ID تراکنش را ارسال کنید:",
+            reply_markup=cancel_keyboard()
+        )
+        return
+    
+    amount = int(message.text)
+    if amount < MIN_DEPOSIT_TRX:
+        await message.answer(
+            f"❌ حداقل مبلغ واریز {MIN_DEPOSIT_TRX} TRX است.",
+            reply_markup=cancel_keyboard()
+        )
+        return
+    
+    intent = await db.create_deposit_intent(message.from_user.id, amount)
+    if intent is None:
+        await message.answer(
+            "❌ خطا در ایجاد درخواست واریز. لطفا دوباره تلاش کنید.",
+            reply_markup=back_to_main_menu()
+        )
+        await state.clear()
+        return
+    
+    await message.answer(
+        "🧾 **درخواست واریز ثبت شد**\n\n"
+        f"💰 مبلغ دقیق: `{intent['amount']:.3f}` TRX\n"
+        f"📬 آدرس: `{TRX_ADDRESS}`\n"
+        f"📝 یادداشت (Memo): `{intent['memo']}`\n"
+        f"⏰ مهلت پرداخت: تا ساعت {intent['expires_at']:%H:%M}\n\n"
+        "⚠️ دقیقاً همین مبلغ را ارسال کنید، یا اگر کیف پول شما یادداشت را پشتیبانی می‌کند آن را وارد کنید.\n"
+        "پس از تأیید شبکه، موجودی شما خودکار افزایش می‌یابد و پیام تأیید دریافت می‌کنید.",
+        parse_mode="Markdown",
+        reply_markup=back_to_main_menu()
+    )
+    await state.clear()
+    logger.info(f"User {message.from_user.id} opened deposit intent {intent['id']} for {intent['amount']:.3f} TRX")
+
+async def notify_deposits(bot: Bot, deposits: List[Dict[str, Any]]):
+    """Tell users about deposits the deposit watcher credited"""
+    for deposit in deposits:
+        try:
+            await bot.send_message(
+                deposit['user_id'],
+                "✅ **واریز شما دریافت شد!**\n\n"
+                f"💰 مبلغ واریزی: **{deposit['amount']:.3f} TRX**\n"
+                f"💎 موجودی جدید: **{deposit['balance']:.2f} TRX**\n\n"
+                f"🔗 TX ID: `{deposit['tx_id'][:16]}...`",
+                parse_mode="Markdown",
+                reply_markup=back_to_main_menu()
+            )
+        except TelegramAPIError as e:
+            logger.warning(f"Could not notify user {deposit['user_id']} of deposit {deposit['tx_id']}: {e}")
+
 @router.message(PaymentStates.waiting_for_txid, F.text)
 async def process_payment(message: types.Message, state: FSMContext):
     """Process payment verification"""
@@ -90,18 +154,24 @@ async def process_payment(message: types.Message, state: FSMContext):
             )
             return
         
-        # Check if TX ID already used
-        existing_tx = db.get_user_transactions(user_id, limit=50)
-        for tx in existing_tx:
-            if tx['trx_id'] == tx_id:
-                await message.answer(
-                    "❌ **این TX ID قبلاً استفاده شده است**\n\n"
-                    "هر TX ID فقط یک بار قابل استفاده است.\n"
-                    "لطفا TX ID جدید ارسال کنید:",
-                    parse_mode="Markdown",
-                    reply_markup=cancel_keyboard()
-                )
-                return
+        # Reserve the TX ID before verifying it; fails if anyone already used it
+        tx_id = tx_id.lower()
+        claimed = await db.claim_txid(user_id, tx_id)
+        if claimed is None:
+            await message.answer(
+                "❌ خطا در ثبت TX ID. لطفا مجددا تلاش کنید.",
+                reply_markup=cancel_keyboard()
+            )
+            return
+        if not claimed:
+            await message.answer(
+                "❌ **این TX ID قبلاً استفاده شده است**\n\n"
+                "هر TX ID فقط یک بار قابل استفاده است.\n"
+                "لطفا TX ID جدید ارسال کنید:",
+                parse_mode="Markdown",
+                reply_markup=cancel_keyboard()
+            )
+            return
         
         # Show verification message
         verification_msg = await message.answer(
@@ -113,9 +183,10 @@ async def process_payment(message: types.Message, state: FSMContext):
         
         try:
             # Verify transaction on blockchain
-            verification_result = trx.verify_payment(tx_id, TRX_ADDRESS, min_amount=1.0)
+            verification_result = await trx.verify_payment(tx_id, TRX_ADDRESS, min_amount=1.0)
             
             if not verification_result['valid']:
+                await db.release_txid(tx_id)
                 error_message = (
                     "❌ **تراکنش معتبر نیست**\n\n"
                     f"خطا: {verification_result['error']}\n"
@@ -138,26 +209,22 @@ async def process_payment(message: types.Message, state: FSMContext):
             # Get transaction amount
             amount = verification_result['amount']
             
-            # Credit user balance
-            success = db.update_balance(
-                user_id, 
-                amount, 
-                'deposit', 
+            # Settle the claimed TX ID and credit user balance in one transaction
+            new_balance = await db.complete_deposit(
+                tx_id,
+                amount,
                 f'واریز TRX - TX: {tx_id[:8]}...'
             )
             
-            if not success:
+            if new_balance is None:
+                # Nothing was credited: free the TX ID so it can be submitted again
+                await db.release_txid(tx_id)
                 await verification_msg.edit_text(
-                    "❌ خطا در اعمال موجودی. لطفا با پشتیبانی تماس بگیرید.",
+                    "❌ خطا در اعمال موجودی. لطفا مجددا تلاش کنید یا با پشتیبانی تماس بگیرید.",
                     reply_markup=back_to_main_menu()
                 )
                 return
             
-            # Add transaction record with full TX ID
-            db.add_transaction(user_id, 'deposit', amount, tx_id, 'completed', 'TRX Deposit')
-            
-            new_balance = db.get_user_balance(user_id)
-            
             success_message = (
                 "✅ **پرداخت با موفقیت انجام شد!**\n\n"
                 f"💰 مبلغ واریزی: **{amount:.2f} TRX**\n"
@@ -176,6 +243,7 @@ async def process_payment(message: types.Message, state: FSMContext):
             logger.info(f"Payment processed successfully for user {user_id}: {amount} TRX")
             
         except trx.TronAPIError as e:
+            await db.release_txid(tx_id)
             await verification_msg.edit_text(
                 f"❌ **خطا در ارتباط با شبکه TRON**\n\n"
                 f"جزئیات: {str(e)}\n\n"
@@ -186,6 +254,8 @@ async def process_payment(message: types.Message, state: FSMContext):
             
         except Exception as e:
             logger.error(f"Payment verification error: {e}")
+            # Only a still-pending claim is released; a settled deposit stays
+            await db.release_txid(tx_id)
             await verification_msg.edit_text(
                 "❌ خطا در بررسی تراکنش. لطفا مجددا تلاش کنید یا با پشتیبانی تماس بگیرید.",
                 reply_markup=back_to_main_menu()
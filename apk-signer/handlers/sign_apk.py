@@ -3,15 +3,22 @@ from aiogram import Router, types, F, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramAPIError
+import asyncio
 import os
 import logging
 import tempfile
 from pathlib import Path
+from typing import Optional
 
-import db
+import async_db as db
+import ingest
+import keystore
 import sign
+from input_store import input_store
+from sign_service import signing_service, SigningQueueFull
 from keyboards import confirm_sign_keyboard, back_to_main_menu
-from config import TEMP_DIR, SIGNED_DIR
+from config import TEMP_DIR, SIGNED_DIR, CACHED_SIGN_PRICE_FACTOR
+from middlewares import UserContext
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -20,26 +27,35 @@ class SignAPKStates(StatesGroup):
     waiting_for_apk = State()
     confirming_sign = State()
 
+def _upload_source(bot: Bot, path: str, filename: str):
+    """A local Bot API server reads the file by path; the cloud API needs it uploaded"""
+    if bot.session.api.is_local:
+        return f"file://{os.path.abspath(path)}"
+    return types.FSInputFile(path, filename=filename)
+
+def _signature_summary(signature: Optional[dict]) -> str:
+    """One line about the signature an uploaded APK already carries"""
+    if not signature or not signature['signed']:
+        return "بدون امضا"
+    if not signature['valid'] or not signature['signers']:
+        return "نامعتبر"
+    subject, fingerprint = signature['signers'][0]
+    return f"{', '.join(signature['schemes'])} — `{subject.replace('`', '')}` (`{fingerprint[:16]}`)"
+
 @router.message(lambda message: message.text == "امضای APK 📱")
-async def request_apk_file(message: types.Message, state: FSMContext):
+async def request_apk_file(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Request APK file from user"""
     try:
-        user_id = message.from_user.id
-        
-        # Update user activity
-        db.update_user_activity(user_id)
-        
         # Check if user is blocked
-        if db.is_user_blocked(user_id):
+        if user_ctx.is_blocked:
             await message.answer(
                 "🚫 حساب شما مسدود شده است.",
                 reply_markup=back_to_main_menu()
             )
             return
         
-        # Get current sign price from database
-        sign_price = float(db.get_setting('sign_price_trx', '3.0'))
-        user_balance = db.get_user_balance(user_id)
+        sign_price = user_ctx.sign_price
+        user_balance = user_ctx.balance
         
         # Check user balance
         if user_balance < sign_price:
@@ -63,7 +79,7 @@ async def request_apk_file(message: types.Message, state: FSMContext):
             "2️⃣ منتظر تأیید نهایی بمانید\n"
             "3️⃣ فایل امضا شده را دریافت کنید\n\n"
             "⚠️ **نکات مهم:**\n"
-            "• حداکثر حجم فایل: 50MB\n"
+            f"• حداکثر حجم فایل: {sign.MAX_FILE_SIZE // (1024*1024)}MB\n"
             "• فقط فایل‌های APK پذیرفته می‌شوند\n"
             "• فرایند امضا چند ثانیه طول می‌کشد\n\n"
             "لطفا فایل APK خود را ارسال کنید:"
@@ -85,7 +101,7 @@ async def request_apk_file(message: types.Message, state: FSMContext):
         )
 
 @router.message(SignAPKStates.waiting_for_apk, F.document)
-async def handle_apk_file(message: types.Message, state: FSMContext, bot: Bot):
+async def handle_apk_file(message: types.Message, state: FSMContext, bot: Bot, user_ctx: UserContext):
     """Handle uploaded APK file"""
     try:
         user_id = message.from_user.id
@@ -111,41 +127,75 @@ async def handle_apk_file(message: types.Message, state: FSMContext, bot: Bot):
         # Show processing message
         processing_msg = await message.answer("⏳ در حال پردازش فایل...")
         
-        # Download file
-        file_info = await bot.get_file(document.file_id)
-        temp_path = os.path.join(TEMP_DIR, f"{user_id}_{document.file_name}")
-        
-        await bot.download_file(file_info.file_path, temp_path)
+        # Same document seen recently: reuse the stored file and its inspection
+        unique_id = document.file_unique_id
+        stored = input_store.get(unique_id)
+        if stored is not None:
+            logger.info(f"Reusing stored input {unique_id} for user {user_id}")
+        else:
+            file_info = await bot.get_file(document.file_id)
+            download_path = os.path.join(TEMP_DIR, f"{user_id}_{unique_id}.part")
+            try:
+                if bot.session.api.is_local:
+                    # A local Bot API server returns a path on this machine: the file is
+                    # hashed, inspected and signed where it is, without a copy
+                    ingested = await asyncio.to_thread(ingest.ingest_local_file, file_info.file_path)
+                    stored = input_store.put(unique_id, file_info.file_path, ingested, owned=False)
+                else:
+                    stored_path = input_store.path_for(unique_id)
+                    ingested = await ingest.download_document(bot, file_info.file_path, download_path)
+                    os.replace(download_path, stored_path)
+                    stored = input_store.put(unique_id, stored_path, ingested)
+            except ingest.IngestError as e:
+                logger.warning(f"Rejected upload from user {user_id}: {e}")
+                await processing_msg.edit_text(
+                    "❌ حجم فایل بیش از حد مجاز است.",
+                    reply_markup=back_to_main_menu()
+                )
+                return
+            finally:
+                sign.cleanup_temp_files(download_path)
         
         try:
-            # Validate APK
-            apk_info = sign.get_apk_info(temp_path)
+            # Validate APK (off the event loop). Inspection only reads the central
+            # directory already in memory plus the manifest, ~15 ms for a 50 MB APK,
+            # so a thread suffices: the pool would pickle the directory across, and
+            # with the signing daemon in use would start a local pool just for this
+            if stored.apk_info is None:
+                stored.apk_info = await asyncio.to_thread(
+                    sign.get_apk_info, stored.path, stored.ingest.central_directory
+                )
+            apk_info = stored.apk_info
             if not apk_info['valid']:
                 await processing_msg.edit_text(
                     "❌ فایل APK معتبر نیست. لطفا فایل صحیح ارسال کنید.",
                     reply_markup=back_to_main_menu()
                 )
-                sign.cleanup_temp_files(temp_path)
+                input_store.discard(unique_id)
                 return
             
             # Store file info in state
             await state.update_data({
-                'file_path': temp_path,
+                'file_path': stored.path,
+                'file_unique_id': unique_id,
                 'file_name': document.file_name,
                 'file_id': document.file_id,
                 'file_size': document.file_size,
+                'content_hash': stored.ingest.content_hash,
                 'apk_info': apk_info
             })
             
-            # Get sign price
-            sign_price = float(db.get_setting('sign_price_trx', '3.0'))
+            sign_price = user_ctx.sign_price
             
             confirmation_text = (
                 "✅ **فایل APK دریافت شد**\n\n"
                 f"📄 نام فایل: `{document.file_name}`\n"
                 f"📊 حجم: {document.file_size / (1024*1024):.1f} MB\n"
                 f"📦 پکیج: {apk_info['package_name']}\n"
-                f"🔢 نسخه: {apk_info['version']}\n\n"
+                f"🔢 نسخه: {apk_info['version']}\n"
+                f"📱 حداقل SDK: {apk_info['min_sdk'] or 'نامشخص'}\n"
+                f"🧩 معماری‌ها: {', '.join(f'`{abi}`' for abi in apk_info['abis']) or 'بدون کتابخانه native'}\n"
+                f"🔏 امضای فعلی: {_signature_summary(apk_info.get('signature'))}\n\n"
                 f"💰 **هزینه امضا: {sign_price:.2f} TRX**\n\n"
                 "آیا مایل به ادامه فرایند امضا هستید؟"
             )
@@ -163,7 +213,7 @@ async def handle_apk_file(message: types.Message, state: FSMContext, bot: Bot):
                 f"❌ خطا در پردازش APK: {str(e)}",
                 reply_markup=back_to_main_menu()
             )
-            sign.cleanup_temp_files(temp_path)
+            input_store.discard(unique_id)
             await state.clear()
             
     except Exception as e:
@@ -184,14 +234,18 @@ async def invalid_file_type(message: types.Message):
     )
 
 @router.callback_query(lambda c: c.data == "confirm_sign", SignAPKStates.confirming_sign)
-async def confirm_sign(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def confirm_sign(callback: types.CallbackQuery, state: FSMContext, bot: Bot, user_ctx: UserContext):
     """Confirm and process APK signing"""
     try:
         user_id = callback.from_user.id
         data = await state.get_data()
+        # Leave the confirming state right away so a second tap is ignored
+        await state.set_state(None)
         
-        if not data or 'file_path' not in data:
-            await callback.answer("❌ اطلاعات فایل یافت نشد", show_alert=True)
+        # The stored input may have been evicted while the user was deciding
+        stored = input_store.get(data.get('file_unique_id')) if data else None
+        if not data or 'file_path' not in data or stored is None:
+            await callback.answer("❌ اطلاعات فایل یافت نشد. لطفا فایل را دوباره ارسال کنید", show_alert=True)
             await state.clear()
             return
         
@@ -199,64 +253,134 @@ async def confirm_sign(callback: types.CallbackQuery, state: FSMContext, bot: Bo
         file_name = data['file_name']
         file_id = data['file_id']
         file_size = data['file_size']
+        content_hash = data.get('content_hash')
+        unique_id = data.get('file_unique_id')
         
-        # Get sign price and check balance again
-        sign_price = float(db.get_setting('sign_price_trx', '3.0'))
-        user_balance = db.get_user_balance(user_id)
+        # The user's own keystore if they uploaded one, otherwise the bot key
+        try:
+            key_ref, key_version, key = await asyncio.to_thread(keystore.registry.resolve_for_user, user_id)
+        except keystore.KeystoreError as e:
+            logger.error(f"Signing key unavailable for user {user_id}: {e}")
+            await callback.answer("❌ کلید امضای شما قابل استفاده نیست. لطفا کی‌استور را دوباره بارگذاری کنید", show_alert=True)
+            await state.clear()
+            return
+        key_id = key.key_id
         
-        if user_balance < sign_price:
+        # Same bytes signed with the same key before: resend that output instead
+        cached = await db.find_signed_apk(content_hash, key_id) if content_hash else None
+        
+        # Generate signed file path
+        signed_filename = sign.generate_signed_filename(file_name)
+        # Per-user directory so the file keeps its name when sent by path
+        signed_dir = os.path.join(SIGNED_DIR, str(user_id))
+        signed_path = os.path.join(signed_dir, signed_filename)
+        if os.path.dirname(os.path.realpath(signed_path)) != os.path.realpath(signed_dir):
+            logger.warning(f"Rejected signed file name for user {user_id}: {file_name!r}")
+            await callback.answer("❌ نام فایل نامعتبر است. لطفا نام فایل را تغییر دهید و دوباره ارسال کنید", show_alert=True)
+            await state.clear()
+            return
+        
+        # Hold the full fee while the job runs; released below if signing fails. A resent
+        # cached output is charged the discounted price and the rest returns on commit
+        sign_price = user_ctx.sign_price
+        reservation = await db.reserve_funds(user_id, sign_price, 'sign_fee', f'امضای {file_name}')
+        
+        if reservation is None:
             await callback.message.edit_text(
                 "❌ موجودی ناکافی! لطفا ابتدا حساب خود را شارژ کنید.",
                 reply_markup=back_to_main_menu()
             )
-            sign.cleanup_temp_files(file_path)
             await state.clear()
             return
         
-        # Show signing progress
-        await callback.message.edit_text("⏳ در حال امضای APK...")
+        reservation_id, new_balance = reservation
         
-        # Generate signed file path
-        signed_filename = sign.generate_signed_filename(file_name)
-        signed_path = os.path.join(SIGNED_DIR, f"{user_id}_{signed_filename}")
+        os.makedirs(signed_dir, exist_ok=True)
+        
+        def caption(price: float) -> str:
+            return (
+                f"✅ **امضا با موفقیت انجام شد**\n\n"
+                f"📄 فایل اصلی: `{file_name}`\n"
+                f"📄 فایل امضا شده: `{signed_filename}`\n"
+                f"💰 هزینه: {price:.2f} TRX\n\n"
+                f"🎉 فایل APK شما آماده استفاده است!"
+            )
         
+        # The stored input stays on disk until the job is done
+        input_store.pin(unique_id)
         try:
-            # Sign the APK
-            success = sign.sign_apk(file_path, signed_path)
-            
-            if not success:
-                raise sign.APKSigningError("Signing process failed")
+            signed_doc = None
+            charged = sign_price
+            if cached:
+                try:
+                    signed_doc = await bot.send_document(
+                        chat_id=callback.message.chat.id,
+                        document=cached['file_id'],
+                        caption=caption(sign_price * CACHED_SIGN_PRICE_FACTOR),
+                        parse_mode="Markdown",
+                        reply_markup=back_to_main_menu()
+                    )
+                    signed_size = cached['signed_size']
+                    charged = sign_price * CACHED_SIGN_PRICE_FACTOR
+                except TelegramAPIError as e:
+                    # The stored file_id is no longer usable; sign again
+                    logger.warning(f"Cached signed APK for {content_hash} could not be resent: {e}")
+                    cached = None
             
-            # Upload signed file
-            with open(signed_path, 'rb') as signed_file:
+            if signed_doc is None:
+                # Show signing progress, or the queue position when all workers are busy
+                async def show_queue_position(position: int):
+                    text = f"⏳ در صف امضا... جایگاه شما: {position}" if position else "⏳ در حال امضای APK..."
+                    try:
+                        await callback.message.edit_text(text)
+                    except TelegramAPIError as e:
+                        # Progress is cosmetic; e.g. an unchanged text after a daemon fallback
+                        logger.debug(f"Could not update signing progress: {e}")
+                
+                # Sign the APK on the signing daemon, or in the local worker pool
+                success = await signing_service.sign_apk(
+                    file_path, signed_path, stored.ingest.sections, key_ref, key_version,
+                    on_queued=show_queue_position
+                )
+                
+                if not success:
+                    raise sign.APKSigningError("Signing process failed")
+                
+                # Upload signed file
                 signed_doc = await bot.send_document(
                     chat_id=callback.message.chat.id,
-                    document=types.FSInputFile(signed_path, filename=signed_filename),
-                    caption=(
-                        f"✅ **امضا با موفقیت انجام شد**\n\n"
-                        f"📄 فایل اصلی: `{file_name}`\n"
-                        f"📄 فایل امضا شده: `{signed_filename}`\n"
-                        f"💰 هزینه: {sign_price:.2f} TRX\n\n"
-                        f"🎉 فایل APK شما آماده استفاده است!"
-                    ),
+                    document=_upload_source(bot, signed_path, signed_filename),
+                    caption=caption(sign_price),
                     parse_mode="Markdown",
                     reply_markup=back_to_main_menu()
                 )
+                signed_size = os.path.getsize(signed_path)
             
-            # Deduct balance and record transaction
-            db.update_balance(user_id, -sign_price, 'sign_fee', f'امضای {file_name}')
+            # Delivered: the held fee becomes a completed charge
+            await db.commit_reservation(reservation_id, charged)
+            reservation_id = None
+            new_balance += sign_price - charged
             
             # Record signed APK
-            signed_size = os.path.getsize(signed_path)
-            db.add_signed_apk(user_id, file_name, signed_doc.document.file_id, file_size, signed_size)
+            await db.add_signed_apk(
+                user_id, file_name, signed_doc.document.file_id, file_size, signed_size,
+                content_hash, key_id, cached=cached is not None
+            )
             
             # Success message
             await callback.message.edit_text(
                 f"✅ **امضا تکمیل شد!**\n\n"
-                f"💰 موجودی جدید: {user_balance - sign_price:.2f} TRX"
+                f"💰 موجودی جدید: {new_balance:.2f} TRX"
             )
             
-            logger.info(f"APK signed successfully for user {user_id}: {file_name}")
+            logger.info(f"APK signed successfully for user {user_id}: {file_name} (cached: {cached is not None})")
+            
+        except SigningQueueFull:
+            await callback.message.edit_text(
+                "⏳ صف امضا پر است. لطفا چند دقیقه دیگر دوباره تلاش کنید.",
+                reply_markup=back_to_main_menu()
+            )
+            logger.warning(f"Signing queue full, rejected job for user {user_id}")
             
         except sign.APKSigningError as e:
             await callback.message.edit_text(
@@ -266,8 +390,12 @@ async def confirm_sign(callback: types.CallbackQuery, state: FSMContext, bot: Bo
             logger.error(f"APK signing failed for user {user_id}: {e}")
             
         finally:
-            # Cleanup files
-            sign.cleanup_temp_files(file_path)
+            # Refund the held fee if the signed file was never delivered
+            if reservation_id is not None:
+                await db.release_reservation(reservation_id)
+            
+            # Cleanup files; the input stays in the store for repeat submissions
+            input_store.unpin(unique_id)
             if os.path.exists(signed_path):
                 sign.cleanup_temp_files(signed_path)
         
@@ -283,10 +411,6 @@ async def confirm_sign(callback: types.CallbackQuery, state: FSMContext, bot: Bo
 async def cancel_sign(callback: types.CallbackQuery, state: FSMContext):
     """Cancel APK signing process"""
     try:
-        data = await state.get_data()
-        if data and 'file_path' in data:
-            sign.cleanup_temp_files(data['file_path'])
-        
         await callback.message.edit_text(
             "❌ عملیات امضا لغو شد.",
             reply_markup=back_to_main_menu()
@@ -3,14 +3,15 @@ from aiogram import Router, types
 from aiogram.filters import Command
 from keyboards import main_menu, admin_menu
 from config import ADMINS
-import db
+import async_db as db
 import logging
+from middlewares import UserContext
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 @router.message(Command("start"))
-async def start_command(message: types.Message):
+async def start_command(message: types.Message, user_ctx: UserContext):
     """Handle /start command with user registration and menu display"""
     try:
         user_id = message.from_user.id
@@ -19,11 +20,10 @@ async def start_command(message: types.Message):
         last_name = message.from_user.last_name
         
         # Register/update user in database
-        db.add_user(user_id, username, first_name, last_name)
-        db.update_user_activity(user_id)
+        await db.add_user(user_id, username, first_name, last_name)
         
         # Check if user is blocked
-        if db.is_user_blocked(user_id):
+        if user_ctx.is_blocked:
             await message.answer(
                 "🚫 حساب شما مسدود شده است.\n"
                 "برای اطلاعات بیشتر با پشتیبانی تماس بگیرید."
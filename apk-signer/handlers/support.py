@@ -7,7 +7,8 @@ import logging
 
 from config import ADMINS
 from keyboards import back_to_main_menu
-import db
+import async_db as db
+from middlewares import UserContext
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -17,16 +18,11 @@ class SupportStates(StatesGroup):
     admin_replying = State()
 
 @router.message(lambda message: message.text == "پشتیبانی 🆘")
-async def support_menu(message: types.Message, state: FSMContext):
+async def support_menu(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Show support options"""
     try:
-        user_id = message.from_user.id
-        
-        # Update user activity
-        db.update_user_activity(user_id)
-        
         # Check if user is blocked
-        if db.is_user_blocked(user_id):
+        if user_ctx.is_blocked:
             await message.answer(
                 "🚫 حساب شما مسدود شده است.",
                 reply_markup=back_to_main_menu()
@@ -61,17 +57,17 @@ async def support_menu(message: types.Message, state: FSMContext):
         )
 
 @router.message(SupportStates.waiting_for_message, F.text)
-async def handle_support_message(message: types.Message, state: FSMContext, bot: Bot):
+async def handle_support_message(message: types.Message, state: FSMContext, bot: Bot, user_ctx: UserContext):
     """Handle support message from user"""
     try:
         user_id = message.from_user.id
         user_message = message.text
         
         # Save support message to database
-        db.add_support_message(user_id, message.message_id, user_message)
+        await db.add_support_message(user_id, message.message_id, user_message)
         
         # Get user info
-        user = db.get_user(user_id)
+        user = user_ctx.user
         username = f"@{user['username']}" if user and user['username'] else "بدون نام کاربری"
         full_name = f"{user['first_name'] or ''} {user['last_name'] or ''}".strip() if user else "نامشخص"
         
@@ -144,7 +140,7 @@ async def admin_reply_command(message: types.Message, state: FSMContext):
             return
         
         # Check if target user exists
-        target_user = db.get_user(target_user_id)
+        target_user = await db.get_user(target_user_id)
         if not target_user:
             await message.answer("❌ کاربر یافت نشد.")
             return
@@ -180,7 +176,7 @@ async def handle_admin_reply(message: types.Message, state: FSMContext):
             await state.clear()
             return
         
-        target_user = db.get_user(target_user_id)
+        target_user = await db.get_user(target_user_id)
         if not target_user:
             await message.answer("❌ کاربر یافت نشد.")
             await state.clear()
@@ -228,6 +224,6 @@ async def send_admin_reply(message: types.Message, target_user_id: int, reply_te
 
 # Handle support messages for non-admin users outside of support state
 @router.message(lambda message: message.text and message.from_user.id not in ADMINS and "پشتیبانی" in message.text.lower())
-async def general_support_trigger(message: types.Message, state: FSMContext):
+async def general_support_trigger(message: types.Message, state: FSMContext, user_ctx: UserContext):
     """Trigger support for general messages containing support keywords"""
-    await support_menu(message, state)
+    await support_menu(message, state, user_ctx)
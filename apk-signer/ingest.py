@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from aiogram import Bot
+
+import apkzip
+from config import MAX_FILE_SIZE
+
+LOCAL_READ_SIZE = 1024 * 1024  # Chunk size when the file is already on this machine
+
+logger = logging.getLogger(__name__)
+
+# Bytes kept from the end of the download: the EOCD search window plus room
+# for the central directory, which is a few hundred KB even for large APKs
+TAIL_SIZE = 1024 * 1024 + apkzip.EOCD_SEARCH_SIZE
+
+class IngestError(Exception):
+    """Raised when a download is rejected while it streams in"""
+    pass
+
+class IngestResult(NamedTuple):
+    """What the download pass learned about the file"""
+    content_hash: str
+    size: int
+    sections: Optional[apkzip.ZipSections]  # None if not a ZIP, or the central directory was not in the tail
+    central_directory: Optional[bytes]
+
+class IngestWriter:
+    """File wrapper that hashes, measures and keeps the tail of everything written through it.
+
+    With file=None nothing is written; the data is only hashed and measured.
+    """
+
+    def __init__(self, file=None, max_size: int = MAX_FILE_SIZE):
+        self.file = file
+        self.max_size = max_size
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self._tail = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            # Raising here aborts the download instead of fetching the rest
+            raise IngestError(f"File too large. Maximum size: {self.max_size // (1024*1024)}MB")
+
+        self.digest.update(data)
+        self._tail += data
+        # Trim in bulk so each chunk is not a full memmove of the tail
+        if len(self._tail) > 2 * TAIL_SIZE:
+            del self._tail[:-TAIL_SIZE]
+        if self.file is None:
+            return len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def seek(self, *args) -> int:
+        return self.file.seek(*args)
+
+    def result(self) -> IngestResult:
+        tail = bytes(self._tail[-TAIL_SIZE:])
+        try:
+            located = apkzip.sections_from_tail(tail, self.size)
+        except apkzip.ZipFormatError as e:
+            logger.info(f"Downloaded file has no usable ZIP layout: {e}")
+            located = None
+
+        sections, central_directory = located if located else (None, None)
+        return IngestResult(self.digest.hexdigest(), self.size, sections, central_directory)
+
+def ingest_local_file(path: str, max_size: int = MAX_FILE_SIZE) -> IngestResult:
+    """Hash and measure a file in the local Bot API server's directory, where it stays.
+
+    The file is not copied: it is inspected and signed from that path.
+    """
+    if os.path.getsize(path) > max_size:
+        raise IngestError(f"File too large. Maximum size: {max_size // (1024*1024)}MB")
+
+    with open(path, 'rb') as src:
+        writer = IngestWriter(None, max_size)
+        buffer = bytearray(LOCAL_READ_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                break
+            writer.write(view[:n])
+
+    return writer.result()
+
+async def download_document(bot: Bot, file_path: str, destination: str,
+                            max_size: int = MAX_FILE_SIZE) -> IngestResult:
+    """Download a Telegram file to destination, learning its hash, size and ZIP layout on the way.
+
+    Only for the cloud Bot API: a local server's file_path is already a
+    file on this machine, read with ingest_local_file instead.
+    """
+    with open(destination, 'wb') as f:
+        writer = IngestWriter(f, max_size)
+        # Each chunk is processed as it arrives, so nothing rereads the file afterwards
+        await bot.download_file(file_path, writer, seek=False)
+
+    return writer.result()
@@ -0,0 +1,123 @@
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from config import INPUT_STORE_DIR, INPUT_STORE_MAX_BYTES
+from ingest import IngestResult
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StoredInput:
+    """A downloaded APK and what we already know about it"""
+    path: str
+    size: int
+    ingest: IngestResult
+    apk_info: Optional[dict] = None
+    owned: bool = True  # False for a file in the local Bot API server's directory
+
+class InputStore:
+    """Recently downloaded APKs kept on disk, keyed by Telegram file_unique_id.
+
+    file_unique_id is stable when the same document is sent again, so a
+    repeat submission or a retry after a failed confirm skips both the
+    download and the inspection. Least recently used files are deleted
+    once the store grows past max_bytes; files pinned by a running job
+    are never deleted. Files that belong to the local Bot API server are
+    used in place and only forgotten, never deleted. Only touched from
+    the event loop, so no locking.
+    """
+
+    def __init__(self, directory: str = INPUT_STORE_DIR, max_bytes: int = INPUT_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, StoredInput]' = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Create the store directory, dropping files from a previous run (their index is gone)"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, unique_id: str) -> str:
+        return os.path.join(self.directory, f"{unique_id}.apk")
+
+    def get(self, unique_id: str) -> Optional[StoredInput]:
+        """Look up a stored input, marking it as recently used"""
+        stored = self._entries.get(unique_id)
+        if stored is not None and not os.path.exists(stored.path):
+            self._remove(unique_id)
+            stored = None
+
+        if stored is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(unique_id)
+        return stored
+
+    def put(self, unique_id: str, path: str, ingest: IngestResult, owned: bool = True) -> StoredInput:
+        """Register a file and evict if over the cap.
+
+        A downloaded file is already at path_for(unique_id); owned=False
+        registers a file elsewhere that the store must not delete.
+        """
+        if unique_id in self._entries:
+            self._total -= self._entries.pop(unique_id).size
+
+        stored = StoredInput(path, ingest.size, ingest, owned=owned)
+        self._entries[unique_id] = stored
+        self._total += stored.size
+        # Never evict the file the caller is about to use
+        self._evict(keep=unique_id)
+        return stored
+
+    def discard(self, unique_id: str):
+        """Forget an input and delete its file, e.g. when it is not a valid APK"""
+        if not self._pins.get(unique_id):
+            self._remove(unique_id)
+
+    def pin(self, unique_id: str):
+        """Keep an input on disk while a job uses it"""
+        self._pins[unique_id] = self._pins.get(unique_id, 0) + 1
+
+    def unpin(self, unique_id: str):
+        count = self._pins.get(unique_id, 0) - 1
+        if count > 0:
+            self._pins[unique_id] = count
+        else:
+            self._pins.pop(unique_id, None)
+            self._evict()
+
+    def _remove(self, unique_id: str):
+        stored = self._entries.pop(unique_id, None)
+        if stored is None:
+            return
+        self._total -= stored.size
+        if not stored.owned:
+            return
+        try:
+            os.remove(stored.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Failed to remove stored input {stored.path}: {e}")
+
+    def _evict(self, keep: Optional[str] = None):
+        for unique_id in list(self._entries):
+            if self._total <= self.max_bytes:
+                break
+            if unique_id == keep or self._pins.get(unique_id):
+                continue
+            self._remove(unique_id)
+            logger.info(f"Evicted stored input {unique_id}")
+
+# Global store instance
+input_store = InputStore()
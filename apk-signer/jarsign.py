@@ -0,0 +1,211 @@
+import base64
+import hashlib
+import logging
+import re
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import pkcs7
+
+from apkzip import ZipEntry, iter_uncompressed
+from apksig import SIG_RSA_PKCS1_SHA256, SignerKey, get_digest_executor
+
+logger = logging.getLogger(__name__)
+
+# v1 (JAR) signature constants
+MANIFEST_NAME = 'META-INF/MANIFEST.MF'
+SIGNATURE_FILE_NAME = 'META-INF/CERT.SF'
+CREATED_BY = '1.0 (APK Signer Bot)'
+MAX_LINE_LENGTH = 72  # Manifest lines are wrapped at 72 bytes, continuations start with a space
+DIGEST_BATCH_BYTES = 1024 * 1024  # Small entries are digested in batches of about this size
+MIN_SDK_SHA256 = 18  # Android 4.3; older releases only verify SHA-1 v1 signatures
+
+DIGEST_ALGORITHMS = {
+    'SHA-256': hashes.SHA256,
+    'SHA1': hashes.SHA1,  # Needed only for APKs that must verify on Android < 4.3
+    # Found in APKs signed by jarsigner; only read when verifying
+    'SHA-384': hashes.SHA384,
+    'SHA-512': hashes.SHA512,
+}
+
+# Files a previous v1 signature left behind, directly under META-INF/
+_SIGNATURE_FILE_RE = re.compile(r'^META-INF/([^/]+\.(SF|RSA|DSA|EC)|SIG-[^/]*|MANIFEST\.MF)$', re.IGNORECASE)
+
+class JarSignatureError(Exception):
+    """Raised when the v1 signature cannot be produced"""
+    pass
+
+def digest_algorithm_for(min_sdk: Optional[int], key: SignerKey) -> str:
+    """The v1 digest algorithm apksigner picks for an APK's minSdkVersion.
+
+    RSA signatures use SHA-1 while the APK still installs on Android < 4.3
+    (no minSdkVersion means API 1). ECDSA v1 signatures only verify from
+    API 18 onwards, so they always use SHA-256.
+    """
+    if key.algorithm == SIG_RSA_PKCS1_SHA256 and (min_sdk or 1) < MIN_SDK_SHA256:
+        return 'SHA1'
+    return 'SHA-256'
+
+def is_signature_file(name: str) -> bool:
+    return bool(_SIGNATURE_FILE_RE.match(name))
+
+def signable_entries(entries: Sequence[ZipEntry]) -> List[ZipEntry]:
+    """Entries that go into MANIFEST.MF: no directories, no old signature files"""
+    seen = set()
+    result = []
+    for entry in entries:
+        if entry.is_dir or is_signature_file(entry.name):
+            continue
+        # Android rejects APKs with duplicate names, and they would make the manifest ambiguous
+        if entry.raw_name in seen:
+            raise JarSignatureError(f"Duplicate entry: {entry.name}")
+        seen.add(entry.raw_name)
+        result.append(entry)
+    return result
+
+# Entry digests
+def _digest_batch(data, batch: Sequence[ZipEntry], algorithm: str) -> List[bytes]:
+    digests = []
+    for entry in batch:
+        # zlib and hashlib both release the GIL, so batches run in parallel
+        digest = hashlib.new(algorithm.replace('-', '').lower())
+        for chunk in iter_uncompressed(data, entry):
+            digest.update(chunk)
+        digests.append(digest.digest())
+    return digests
+
+def _batches(entries: Sequence[ZipEntry]) -> Iterator[List[ZipEntry]]:
+    batch, size = [], 0
+    for entry in entries:
+        batch.append(entry)
+        size += entry.compressed_size
+        if size >= DIGEST_BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+def digest_entries(data, entries: Sequence[ZipEntry], algorithm: str = 'SHA-256') -> List[bytes]:
+    """Digest of each entry's uncompressed contents, read from the archive buffer"""
+    if algorithm not in DIGEST_ALGORITHMS:
+        raise JarSignatureError(f"Unsupported digest algorithm: {algorithm}")
+
+    executor = get_digest_executor()
+    futures = [executor.submit(_digest_batch, data, batch, algorithm) for batch in _batches(entries)]
+    digests = []
+    try:
+        for future in futures:
+            digests.extend(future.result())
+    finally:
+        # A failed batch's exception references this frame; without this the
+        # cycle would keep views of the caller's mmap alive and block its close
+        futures = future = None
+    return digests
+
+# Manifest and signature file
+def _header(name: bytes, value: bytes) -> bytes:
+    """One manifest header, wrapped at 72 bytes"""
+    line = name + b': ' + value
+    if len(line) <= MAX_LINE_LENGTH:
+        return line + b'\r\n'
+
+    parts = [line[:MAX_LINE_LENGTH]]
+    for i in range(MAX_LINE_LENGTH, len(line), MAX_LINE_LENGTH - 1):
+        parts.append(b' ' + line[i:i + MAX_LINE_LENGTH - 1])
+    return b'\r\n'.join(parts) + b'\r\n'
+
+def _b64(digest: bytes) -> bytes:
+    return base64.b64encode(digest)
+
+# PKCS#7 signature block
+def _der(tag: int, *content: bytes) -> bytes:
+    body = b''.join(content)
+    if len(body) < 0x80:
+        return bytes([tag, len(body)]) + body
+    size = (len(body).bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + len(body).to_bytes(size, 'big') + body
+
+def _der_integer(value: int) -> bytes:
+    return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+_OID_SIGNED_DATA = _der(0x06, bytes.fromhex('2a864886f70d010702'))
+_OID_DATA = _der(0x06, bytes.fromhex('2a864886f70d010701'))
+_SHA1_ALGORITHM = _der(0x30, _der(0x06, bytes.fromhex('2b0e03021a')), b'\x05\x00')
+_RSA_ALGORITHM = _der(0x30, _der(0x06, bytes.fromhex('2a864886f70d010101')), b'\x05\x00')
+
+def _sha1_rsa_signature_block(signature_file: bytes, key: SignerKey) -> bytes:
+    """Detached SHA1withRSA PKCS#7 SignedData over the .SF file, without signed attributes.
+
+    cryptography's PKCS#7 builder does not sign with SHA-1, so the block
+    is encoded here, in the layout apksigner produces.
+    """
+    signature = key.private_key.sign(signature_file, padding.PKCS1v15(), hashes.SHA1())
+    signer_info = _der(0x30,
+        _der_integer(1),
+        _der(0x30, key.certificate.issuer.public_bytes(), _der_integer(key.certificate.serial_number)),
+        _SHA1_ALGORITHM,
+        _RSA_ALGORITHM,
+        _der(0x04, signature),
+    )
+    signed_data = _der(0x30,
+        _der_integer(1),
+        _der(0x31, _SHA1_ALGORITHM),
+        _der(0x30, _OID_DATA),
+        _der(0xa0, key.certificate_der),
+        _der(0x31, signer_info),
+    )
+    return _der(0x30, _OID_SIGNED_DATA, _der(0xa0, signed_data))
+
+def build_signature_files(entries: Sequence[ZipEntry], digests: Sequence[bytes], key: SignerKey,
+                          algorithm: str = 'SHA-256') -> Dict[str, bytes]:
+    """Build MANIFEST.MF, CERT.SF and the PKCS#7 signature block.
+
+    Manifest sections are generated once, in entry order, and each one is
+    hashed into CERT.SF as soon as it is written.
+    """
+    digest_name = algorithm.encode() + b'-Digest'
+    hash_name = algorithm.replace('-', '').lower()
+
+    main_attributes = _header(b'Manifest-Version', b'1.0') + _header(b'Created-By', CREATED_BY.encode()) + b'\r\n'
+    manifest = [main_attributes]
+    manifest_digest = hashlib.new(hash_name, main_attributes)
+    sf_sections = []
+    for entry, digest in zip(entries, digests):
+        section = _header(b'Name', entry.raw_name) + _header(digest_name, _b64(digest)) + b'\r\n'
+        manifest.append(section)
+        manifest_digest.update(section)
+        sf_sections.append(
+            _header(b'Name', entry.raw_name) +
+            _header(digest_name, _b64(hashlib.new(hash_name, section).digest())) + b'\r\n'
+        )
+
+    signature_file = b''.join([
+        _header(b'Signature-Version', b'1.0'),
+        _header(b'Created-By', CREATED_BY.encode()),
+        _header(digest_name + b'-Manifest', _b64(manifest_digest.digest())),
+        _header(digest_name + b'-Manifest-Main-Attributes',
+                _b64(hashlib.new(hash_name, main_attributes).digest())),
+        # Tells v2/v3-aware verifiers that stripping the v2/v3 signatures is an attack
+        _header(b'X-Android-APK-Signed', b'2, 3'),
+        b'\r\n',
+    ] + sf_sections)
+
+    if algorithm == 'SHA1':
+        if key.algorithm != SIG_RSA_PKCS1_SHA256:
+            raise JarSignatureError("SHA-1 v1 signatures need an RSA key")
+        block = _sha1_rsa_signature_block(signature_file, key)
+    else:
+        block = (
+            pkcs7.PKCS7SignatureBuilder()
+            .set_data(signature_file)
+            .add_signer(key.certificate, key.private_key, DIGEST_ALGORITHMS[algorithm]())
+            .sign(serialization.Encoding.DER, [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.NoAttributes])
+        )
+    block_name = 'META-INF/CERT.RSA' if key.algorithm == SIG_RSA_PKCS1_SHA256 else 'META-INF/CERT.EC'
+
+    return {
+        MANIFEST_NAME: b''.join(manifest),
+        SIGNATURE_FILE_NAME: signature_file,
+        block_name: block,
+    }
@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from cryptography import x509
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+import db
+from apksig import APKSignatureError, SignerKey
+from config import SIGNING_KEY_PATH, SIGNING_CERT_PATH, KEYSTORE_SECRET, KEYSTORE_SECRET_PATH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY = 'default'
+MAX_KEYSTORE_SIZE = 64 * 1024  # PKCS#12 files are a few KB
+
+class KeystoreError(Exception):
+    """Raised when a key cannot be loaded or imported"""
+    pass
+
+def user_key_ref(user_id: int) -> str:
+    return f"user:{user_id}"
+
+# Bot key files
+def create_default_key(key_path: str = SIGNING_KEY_PATH, cert_path: str = SIGNING_CERT_PATH,
+                       replace: bool = False):
+    """Generate a self-signed RSA key and certificate for the bot"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "APK Signer Bot")])
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=365 * 30))
+        .sign(key, hashes.SHA256())
+    )
+
+    os.makedirs(os.path.dirname(key_path) or '.', exist_ok=True)
+    os.makedirs(os.path.dirname(cert_path) or '.', exist_ok=True)
+    certificate_pem = certificate.public_bytes(serialization.Encoding.PEM)
+
+    # The key file carries its certificate too, and is written aside and then
+    # swapped in with one rename, so a reader gets the old pair or the new one
+    temp_path = f"{key_path}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption()
+            ) + certificate_pem)
+        if replace:
+            os.replace(temp_path, key_path)
+        else:
+            try:
+                os.link(temp_path, key_path)
+            except FileExistsError:
+                return  # Another process created the key first
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # The separate certificate file is only for people and tools; it is not read back
+    with open(cert_path + '.new', 'wb') as f:
+        f.write(certificate_pem)
+    os.replace(cert_path + '.new', cert_path)
+    logger.warning(f"Generated a new self-signed signing key at {key_path}")
+
+_CERTIFICATE_PEM_START = b'-----BEGIN CERTIFICATE-----'
+
+def _load_default_key() -> SignerKey:
+    if not os.path.exists(SIGNING_KEY_PATH):
+        create_default_key()
+
+    with open(SIGNING_KEY_PATH, 'rb') as f:
+        pem = f.read()
+    private_key = serialization.load_pem_private_key(pem, password=None)
+    if _CERTIFICATE_PEM_START in pem:
+        certificate = x509.load_pem_x509_certificate(pem[pem.index(_CERTIFICATE_PEM_START):])
+    else:
+        # Key files written before the certificate moved into them
+        with open(SIGNING_CERT_PATH, 'rb') as f:
+            certificate = x509.load_pem_x509_certificate(f.read())
+    return SignerKey(private_key, certificate)
+
+def _touch(path: str):
+    """Give a file a newer mtime than it has, whatever the filesystem's timestamp resolution"""
+    stat = os.stat(path)
+    mtime = max(time.time_ns(), stat.st_mtime_ns + 1000)
+    os.utime(path, ns=(stat.st_atime_ns, mtime))
+
+# Keystore encryption at rest
+_fernet: Optional[Fernet] = None
+
+def _get_fernet() -> Fernet:
+    """Cipher for uploaded keys, from KEYSTORE_SECRET or a secret file generated on first run"""
+    global _fernet
+    if _fernet is None:
+        secret = KEYSTORE_SECRET
+        if not secret:
+            if not os.path.exists(KEYSTORE_SECRET_PATH):
+                os.makedirs(os.path.dirname(KEYSTORE_SECRET_PATH) or '.', exist_ok=True)
+                try:
+                    fd = os.open(KEYSTORE_SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(Fernet.generate_key())
+                    logger.warning(f"Generated a new keystore secret at {KEYSTORE_SECRET_PATH}")
+                except FileExistsError:
+                    # Another process created it first
+                    pass
+            with open(KEYSTORE_SECRET_PATH, 'rb') as f:
+                secret = f.read().strip()
+        _fernet = Fernet(secret)
+    return _fernet
+
+def import_pkcs12(data: bytes, password: str) -> Tuple[str, bytes, bytes]:
+    """Decrypt an uploaded PKCS#12 keystore; returns (key_id, encrypted private key, certificate DER)"""
+    if len(data) > MAX_KEYSTORE_SIZE:
+        raise KeystoreError("Keystore file too large")
+    try:
+        private_key, certificate, _ = pkcs12.load_key_and_certificates(
+            data, password.encode() if password else None
+        )
+    except ValueError as e:
+        raise KeystoreError(f"Could not open keystore: {e}")
+    if private_key is None or certificate is None:
+        raise KeystoreError("Keystore has no private key and certificate")
+
+    try:
+        key = SignerKey(private_key, certificate)
+    except APKSignatureError as e:
+        raise KeystoreError(str(e))
+
+    plain = private_key.private_bytes(
+        serialization.Encoding.DER,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    return key.key_id, _get_fernet().encrypt(plain), key.certificate_der
+
+def _load_user_key(user_id: int) -> SignerKey:
+    row = db.get_user_keystore(user_id)
+    if row is None:
+        raise KeystoreError(f"No keystore for user {user_id}")
+    try:
+        plain = _get_fernet().decrypt(row['private_key'])
+    except InvalidToken:
+        raise KeystoreError(f"Keystore of user {user_id} cannot be decrypted with this secret")
+
+    private_key = serialization.load_der_private_key(plain, password=None)
+    certificate = x509.load_der_x509_certificate(row['certificate'])
+    return SignerKey(private_key, certificate)
+
+class KeyRegistry:
+    """Decrypted signing keys kept in memory, one registry per process.
+
+    Keys are identified by a reference ('default' or 'user:<id>') and a
+    version token read from the key's source: the bot key file's mtime or
+    the keystore row's updated_at. Replacing the key changes it, and so
+    does an evict, which touches the source. Every process (bot, daemon,
+    workers) derives the token from the same shared state, so a job
+    carrying it makes each of them reload a stale copy without a restart.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, Tuple[str, SignerKey]] = {}
+        self._lock = threading.Lock()
+
+    def _source_version(self, key_ref: str) -> Optional[str]:
+        if key_ref == DEFAULT_KEY:
+            if not os.path.exists(SIGNING_KEY_PATH):
+                create_default_key()
+            return str(os.stat(SIGNING_KEY_PATH).st_mtime_ns)
+        return db.get_user_keystore_version(int(key_ref.split(':', 1)[1]))
+
+    def current_version(self, key_ref: str) -> Optional[str]:
+        """Version token of the key as the source holds it now, or None if it does not exist"""
+        return self._source_version(key_ref)
+
+    def get(self, key_ref: str = DEFAULT_KEY, version: Optional[str] = None) -> SignerKey:
+        """Return the key, loading and decrypting it only if the cached copy is stale"""
+        if version is None:
+            version = self.current_version(key_ref)
+            if version is None:
+                raise KeystoreError(f"Unknown key {key_ref}")
+
+        cached = self._keys.get(key_ref)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._keys.get(key_ref)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            if key_ref == DEFAULT_KEY:
+                key = _load_default_key()
+            else:
+                key = _load_user_key(int(key_ref.split(':', 1)[1]))
+            self._keys[key_ref] = (version, key)
+            logger.info(f"Loaded signing key {key_ref} ({key.key_id[:16]})")
+            return key
+
+    def resolve_for_user(self, user_id: int) -> Tuple[str, str, SignerKey]:
+        """Pick the user's own key if they uploaded one, else the bot key; returns (ref, version, key)"""
+        key_ref = user_key_ref(user_id)
+        version = self.current_version(key_ref)
+        if version is None:
+            key_ref = DEFAULT_KEY
+            version = self.current_version(key_ref)
+        return key_ref, version, self.get(key_ref, version)
+
+    def evict(self, key_ref: Optional[str] = None):
+        """Drop a cached key (or all of them) here and in every process that holds it.
+
+        The key's source is touched, so its version token changes for
+        every process; each reloads the key on its next job.
+        """
+        with self._lock:
+            if key_ref is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(key_ref, None)
+        if key_ref in (None, DEFAULT_KEY) and os.path.exists(SIGNING_KEY_PATH):
+            _touch(SIGNING_KEY_PATH)
+        if key_ref != DEFAULT_KEY:
+            db.touch_user_keystore(int(key_ref.split(':', 1)[1]) if key_ref else None)
+        logger.info(f"Evicted signing key {key_ref or 'all'}")
+
+    def rotate_default_key(self) -> SignerKey:
+        """Replace the bot key with a newly generated one"""
+        create_default_key(replace=True)
+        self.evict(DEFAULT_KEY)
+        return self.get(DEFAULT_KEY)
+
+# Per-process registry; signing workers fill their own on first use
+registry = KeyRegistry()
+
+def warm():
+    """Load the bot key ahead of the first job (run in each pool worker at start)"""
+    registry.get(DEFAULT_KEY)
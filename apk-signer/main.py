@@ -3,16 +3,26 @@ import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import API_TOKEN
+from config import API_TOKEN, LOCAL_BOT_API_URL, DEPOSIT_WATCH_INTERVAL
 import db
+import async_db
+from middlewares import UserContextMiddleware
+import keystore
+import trx
+from deposit_watcher import DepositWatcher
+from input_store import input_store
+from sign_service import signing_service
 
 # Import routers
 from handlers.start import router as start_router
 from handlers.sign_apk import router as sign_apk_router
+from handlers.keystore import router as keystore_router
 from handlers.balance import router as balance_router
-from handlers.payment import router as payment_router
+from handlers.payment import router as payment_router, notify_deposits
 from handlers.support import router as support_router
 from handlers.admin_panel import router as admin_router
 
@@ -20,17 +30,28 @@ from handlers.admin_panel import router as admin_router
 async def main() -> None:
     # Initialize database
     db.init_db()
+    db.release_stale_txid_claims()
+    db.release_stale_reservations()
     
     # Configure logging
     logging.basicConfig(level=logging.INFO)
     
     # Create bot and dispatcher
-    bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    session = None
+    if LOCAL_BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(LOCAL_BOT_API_URL, is_local=True))
+        logging.info(f"Using local Bot API server at {LOCAL_BOT_API_URL}")
+    bot = Bot(token=API_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher(storage=MemoryStorage())
     
+    # Load the sender's user context once per update
+    dp.message.outer_middleware(UserContextMiddleware())
+    dp.callback_query.outer_middleware(UserContextMiddleware())
+    
     # Include routers
     dp.include_router(start_router)
     dp.include_router(sign_apk_router)
+    dp.include_router(keystore_router)
     dp.include_router(balance_router)
     dp.include_router(payment_router)
     dp.include_router(support_router)
@@ -38,7 +59,24 @@ async def main() -> None:
     
     # Start polling
     print("✅ Bot is running...")
-    await dp.start_polling(bot)
+    # Load (or create) the signing key before workers start, so only one process creates it
+    keystore.registry.get(keystore.DEFAULT_KEY)
+    input_store.start()
+    signing_service.start()
+    activity_flusher = asyncio.create_task(async_db.run_activity_flusher())
+    deposit_task = None
+    if DEPOSIT_WATCH_INTERVAL > 0:
+        watcher = DepositWatcher(on_settled=lambda deposits: notify_deposits(bot, deposits))
+        deposit_task = asyncio.create_task(watcher.run())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        activity_flusher.cancel()
+        if deposit_task is not None:
+            deposit_task.cancel()
+        await trx.tron_api.close()
+        signing_service.shutdown()
+        async_db.shutdown()
 
 
 if __name__ == "__main__":
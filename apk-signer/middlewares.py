@@ -0,0 +1,51 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import async_db as db
+from config import SIGN_PRICE_TRX
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class UserContext:
+    """Everything handlers need to know about the sender of an update"""
+    user_id: int
+    user: Optional[Dict[str, Any]]
+    sign_price: float
+    
+    @property
+    def is_blocked(self) -> bool:
+        return bool(self.user and self.user.get('is_blocked', 0))
+    
+    @property
+    def balance(self) -> float:
+        return self.user['balance'] if self.user else 0.0
+
+class UserContextMiddleware(BaseMiddleware):
+    """Load the sender's UserContext once per update and pass it as user_ctx"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get('event_from_user')
+        if from_user is not None:
+            context = await db.get_user_context(from_user.id)
+            if context is None:
+                # Database trouble: fall back to an empty context rather than dropping the update
+                context = {'user': None, 'sign_price': SIGN_PRICE_TRX}
+            
+            data['user_ctx'] = UserContext(
+                user_id=from_user.id,
+                user=context['user'],
+                sign_price=context['sign_price']
+            )
+            await db.update_user_activity(from_user.id)
+        
+        return await handler(event, data)
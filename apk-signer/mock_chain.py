@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from trx import base58_to_hex
+
+logger = logging.getLogger(__name__)
+
+MOCK_SENDER = 'TLa2f6VPqDgRE67v1736s7bJ8Ray5wYjU7'
+
+
+class MockChain:
+    """Stand-in for the TronGrid and TronScan endpoints the bot uses, for local testing.
+
+    Serves transaction lookups and confirmed account history from an
+    in-memory list of TRX transfers. Transfers are added with
+    add_transfer() or POST /mock/transfers; point TRON_API_BASE and
+    TRONSCAN_API_BASE (with /api) at the server to use it:
+
+        python mock_chain.py --port 8090
+        curl -X POST localhost:8090/mock/transfers \\
+             -d '{"to": "T...", "amount_sun": 10137000, "memo": "a1b2c3d4"}'
+    """
+
+    def __init__(self):
+        self.transactions: List[Dict[str, Any]] = []  # Block time order
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self._counter = itertools.count(1)
+
+    def add_transfer(self, to_address: str, amount_sun: int, memo: str = "",
+                     from_address: str = MOCK_SENDER, timestamp: Optional[int] = None) -> str:
+        """Record a confirmed TRX transfer between base58 addresses; returns its TXID"""
+        number = next(self._counter)
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        tx_id = hashlib.sha256(f"mock-{number}-{timestamp}".encode()).hexdigest()
+        raw_data = {
+            'contract': [{
+                'type': 'TransferContract',
+                # TronGrid returns addresses in hex
+                'parameter': {'value': {
+                    'amount': amount_sun,
+                    'owner_address': base58_to_hex(from_address),
+                    'to_address': base58_to_hex(to_address),
+                }},
+            }],
+            'timestamp': timestamp,
+        }
+        if memo:
+            raw_data['data'] = memo.encode().hex()
+        tx = {
+            'txID': tx_id,
+            'ret': [{'contractRet': 'SUCCESS'}],
+            'blockNumber': number,
+            'block_timestamp': timestamp,
+            'raw_data': raw_data,
+        }
+        self.transactions.append(tx)
+        self.transactions.sort(key=lambda t: t['block_timestamp'])
+        self.by_id[tx_id] = tx
+        return tx_id
+
+    async def _account_transactions(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        try:
+            address = base58_to_hex(request.match_info['address'])
+        except ValueError:
+            return web.json_response({'success': False, 'error': 'invalid address'}, status=400)
+        query = request.query
+        min_timestamp = int(query.get('min_timestamp', 0))
+        limit = min(int(query.get('limit', 20)), 200)
+        offset = int(query.get('fingerprint') or 0)  # Opaque to clients; here simply an offset
+
+        matching = [
+            tx for tx in self.transactions
+            if tx['block_timestamp'] >= min_timestamp
+            and (query.get('only_to') != 'true'
+                 or tx['raw_data']['contract'][0]['parameter']['value']['to_address'] == address)
+        ]
+        page = matching[offset:offset + limit]
+        meta = {'at': int(time.time() * 1000), 'page_size': len(page)}
+        if offset + limit < len(matching):
+            meta['fingerprint'] = str(offset + limit)
+        return web.json_response({'data': page, 'success': True, 'meta': meta})
+
+    async def _transaction(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        tx = self.by_id.get(request.match_info['tx_id'])
+        return web.json_response({'data': [tx] if tx else [], 'success': True})
+
+    async def _transaction_info(self, request: web.Request) -> web.Response:
+        # Everything this chain knows is already answered by the TronGrid endpoint
+        self.requests += 1
+        return web.json_response({})
+
+    async def _add_transfers(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        items = body if isinstance(body, list) else [body]
+        try:
+            tx_ids = [
+                self.add_transfer(item['to'], int(item['amount_sun']), item.get('memo', ''),
+                                  item.get('from', MOCK_SENDER), item.get('timestamp'))
+                for item in items
+            ]
+        except (KeyError, ValueError) as e:
+            return web.json_response({'error': str(e)}, status=400)
+        return web.json_response({'tx_ids': tx_ids})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v1/accounts/{address}/transactions', self._account_transactions)
+        app.router.add_get('/v1/transactions/{tx_id}', self._transaction)
+        app.router.add_get('/api/transaction-info', self._transaction_info)
+        app.router.add_post('/mock/transfers', self._add_transfers)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock TRON API server for local testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(MockChain().app(), host=args.host, port=args.port)
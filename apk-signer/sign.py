@@ -1,9 +1,20 @@
 
 import os
+import mmap
+import time
+import struct
 import logging
-import zipfile
+import zlib
 import tempfile
 from pathlib import Path
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+
+import apksig
+import apkverify
+import apkzip
+import axml
+import jarsign
+import keystore
 from config import TEMP_DIR, SIGNED_DIR, MAX_FILE_SIZE
 
 logger = logging.getLogger(__name__)
@@ -16,55 +27,278 @@ class APKSigningError(Exception):
     """Custom exception for APK signing errors"""
     pass
 
+COPY_CHUNK_SIZE = 1024 * 1024  # Buffer size when the kernel cannot copy for us
+
+# zipalign: uncompressed data must be aligned so Android can mmap it in place
+STORED_ALIGNMENT = 4
+NATIVE_LIB_ALIGNMENT = 4096  # .so files are page-aligned so they load straight from the APK
+ALIGNMENT_EXTRA_ID = 0xd935  # Extra field apksigner uses for alignment padding
+
+def get_signer_key(key_ref: str = keystore.DEFAULT_KEY, version: Optional[str] = None) -> apksig.SignerKey:
+    """Signing key for this process, from the warm key registry"""
+    return keystore.registry.get(key_ref, version)
+
+REQUIRED_APK_FILES = ('AndroidManifest.xml', 'classes.dex')
+MAX_MANIFEST_SIZE = 4 * 1024 * 1024  # Binary manifests are tens of KB; anything larger is not read
+
+class APKInspection(NamedTuple):
+    """Everything the bot reads from an APK, gathered in one pass"""
+    size: int
+    names: FrozenSet[str]
+    manifest: Optional[axml.ManifestInfo]
+    abis: Tuple[str, ...]
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in REQUIRED_APK_FILES if name not in self.names]
+
+def _read_manifest(data, entry) -> Optional[axml.ManifestInfo]:
+    """Inflate and parse AndroidManifest.xml, giving up on oversized or broken ones"""
+    chunks = []
+    size = 0
+    for chunk in apkzip.iter_uncompressed(data, entry, chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > MAX_MANIFEST_SIZE:
+            logger.warning("AndroidManifest.xml too large, skipping")
+            return None
+        chunks.append(bytes(chunk))
+    
+    try:
+        return axml.parse_manifest(b''.join(chunks))
+    except axml.AXMLError as e:
+        logger.warning(f"Could not parse AndroidManifest.xml: {e}")
+        return None
+
+def inspect_apk(file_path: str, central_directory: Optional[bytes] = None) -> APKInspection:
+    """Read the central directory and binary manifest from a single mmap of the APK.
+    
+    A central directory captured while downloading is used as is; then
+    only the manifest is read from the file.
+    """
+    size = os.path.getsize(file_path)
+    if size < apkzip.EOCD_MIN_SIZE:
+        raise apkzip.ZipFormatError("File too small to be a ZIP archive")
+    
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if central_directory is not None:
+                entries = apkzip.parse_central_directory(central_directory)
+            else:
+                entries = apkzip.read_entries(data, apkzip.find_zip_sections(data))
+            names = frozenset(entry.name for entry in entries)
+            
+            manifest = None
+            for entry in entries:
+                if entry.name == 'AndroidManifest.xml':
+                    manifest = _read_manifest(data, entry)
+                    break
+    
+    # Native libraries live in lib/<abi>/*.so
+    abis = tuple(sorted({
+        name.split('/')[1] for name in names
+        if name.startswith('lib/') and name.endswith('.so') and name.count('/') == 2
+    }))
+    return APKInspection(size, names, manifest, abis)
+
 def validate_apk(file_path: str) -> bool:
     """Validate if file is a proper APK"""
     try:
-        # Check file size
+        # Check file size before touching the archive
         if os.path.getsize(file_path) > MAX_FILE_SIZE:
             raise APKSigningError(f"File too large. Maximum size: {MAX_FILE_SIZE // (1024*1024)}MB")
         
-        # Check if it's a valid zip file (APK is essentially a zip)
-        if not zipfile.is_zipfile(file_path):
-            raise APKSigningError("Invalid APK file format")
+        # Parsing the central directory also checks it is a valid zip (APK is essentially a zip)
+        apk = inspect_apk(file_path)
         
         # Check for required APK components
-        with zipfile.ZipFile(file_path, 'r') as apk:
-            required_files = ['AndroidManifest.xml', 'classes.dex']
-            apk_files = apk.namelist()
-            
-            for required_file in required_files:
-                if required_file not in apk_files:
-                    logger.warning(f"APK missing required file: {required_file}")
+        for required_file in apk.missing:
+            logger.warning(f"APK missing required file: {required_file}")
         
         return True
         
-    except zipfile.BadZipFile:
+    except APKSigningError:
+        raise
+    except (apkzip.ZipFormatError, zlib.error):
         raise APKSigningError("Corrupted APK file")
     except Exception as e:
         logger.error(f"APK validation error: {e}")
         raise APKSigningError(f"APK validation failed: {str(e)}")
 
-def sign_apk(input_path: str, output_path: str) -> bool:
+def _stream_copy(src, dst, offset: int, length: int):
+    """Copy length bytes from offset in src to the end of dst without holding them in memory"""
+    dst.flush()
+    copied = 0
+    # In-kernel copy: no user-space buffer, may share extents on CoW filesystems
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), length - copied, offset + copied)
+                if n == 0:
+                    break
+                copied += n
+            if copied == length:
+                # The kernel moved the file position; resync the buffered writer
+                dst.seek(0, os.SEEK_END)
+                return
+        except OSError:
+            # Not supported between these files; continue with a buffer
+            pass
+    
+    src.seek(offset + copied)
+    dst.seek(0, os.SEEK_END)
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+    while copied < length:
+        n = src.readinto(view[:min(COPY_CHUNK_SIZE, length - copied)])
+        if not n:
+            break
+        dst.write(view[:n])
+        copied += n
+    if copied != length:
+        raise APKSigningError("Unexpected end of input while copying entries")
+
+def _entry_regions(entries, entries_end: int) -> dict:
+    """Map each entry's local offset to the end of its raw region (header, data, descriptor)"""
+    offsets = sorted({entry.local_offset for entry in entries})
+    ends = offsets[1:] + [entries_end]
+    return dict(zip(offsets, ends))
+
+def _alignment(entry) -> int:
+    """Required data alignment for an entry, or 0 if it has none"""
+    if entry.method != apkzip.METHOD_STORED:
+        return 0
+    if entry.name.endswith('.so'):
+        return NATIVE_LIB_ALIGNMENT
+    return STORED_ALIGNMENT
+
+def _strip_alignment_extra(extra: bytes) -> bytes:
+    """Drop a previous alignment field; extras that are not well formed are kept as they are"""
+    kept = []
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from('<HH', extra, offset)
+        if offset + 4 + size > len(extra):
+            return extra
+        if header_id != ALIGNMENT_EXTRA_ID:
+            kept.append(extra[offset:offset + 4 + size])
+        offset += 4 + size
+    if offset != len(extra):
+        return extra
+    return b''.join(kept)
+
+def _aligned_local_header(data, entry, new_offset: int) -> bytes:
+    """Local header of entry, with its extra field padded so the data lands aligned at new_offset"""
+    header_length, extra_length = apkzip.local_header_size(data, entry)
+    fixed_length = header_length - extra_length
+    header = bytes(data[entry.local_offset:entry.local_offset + fixed_length])
+    extra = bytes(data[entry.local_offset + fixed_length:entry.local_offset + header_length])
+    
+    alignment = _alignment(entry)
+    if alignment and (new_offset + header_length) % alignment:
+        extra = _strip_alignment_extra(extra)
+        data_start = new_offset + fixed_length + len(extra) + 6
+        padding = -data_start % alignment
+        extra += struct.pack('<HHH', ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + bytes(padding)
+        header = bytearray(header)
+        struct.pack_into('<H', header, 28, len(extra))
+    
+    return bytes(header) + extra
+
+def verify_alignment(file_path: str) -> list:
+    """Return the names of entries whose uncompressed data is not zipaligned"""
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            sections = apkzip.find_zip_sections(data)
+            return [
+                entry.name for entry in apkzip.read_entries(data, sections)
+                if _alignment(entry) and apkzip.data_offset(data, entry) % _alignment(entry)
+            ]
+
+def sign_apk(input_path: str, output_path: str, sections: Optional[apkzip.ZipSections] = None,
+             key_ref: str = keystore.DEFAULT_KEY, key_version: Optional[str] = None) -> bool:
     """
-    Sign APK file (simplified implementation)
-    In production, you would use jarsigner and zipalign
+    Sign APK file with v1 (JAR) and APK Signature Scheme v2/v3, in-process.
+    Entries are zipaligned and copied in a single pass, old signature files
+    and any previous signing block are dropped, and the new META-INF files
+    are appended before the central directory. The output is then verified
+    with the digests already computed for signing. Sections located at
+    ingest mean the input was already validated, so it is not inspected again.
+    key_ref/key_version select the signing key (see keystore.KeyRegistry).
     """
     try:
-        # Validate input APK
-        validate_apk(input_path)
-        
-        # For this example, we'll just copy the file with a "signed" marker
-        # In real implementation, you would:
-        # 1. Use jarsigner to sign with your certificate
-        # 2. Use zipalign to optimize the APK
-        # 3. Verify the signature
+        # Validate input APK (already done at ingest when sections are given)
+        if sections is None:
+            validate_apk(input_path)
+        key = get_signer_key(key_ref, key_version)
+        timings = {}
         
         with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
-            dst.write(src.read())
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if sections is None:
+                    sections = apkzip.find_zip_sections(data)
+                entries = apkzip.read_entries(data, sections)
+                
+                # APKs that still install on Android < 4.3 get SHA-1 v1 digests, as with apksigner
+                manifest = next((_read_manifest(data, entry) for entry in entries
+                                 if entry.name == 'AndroidManifest.xml'), None)
+                algorithm = jarsign.digest_algorithm_for(manifest.min_sdk if manifest else None, key)
+                
+                started = time.perf_counter()
+                signed = jarsign.signable_entries(entries)
+                digests = jarsign.digest_entries(data, signed, algorithm)
+                timings['digest'] = time.perf_counter() - started
+                
+                started = time.perf_counter()
+                signature_files = jarsign.build_signature_files(signed, digests, key, algorithm)
+                timings['manifest'] = time.perf_counter() - started
+                
+                # Copy kept entries in archive order, aligning them on the way,
+                # then append the new META-INF files
+                started = time.perf_counter()
+                regions = _entry_regions(entries, sections.entries_end)
+                new_offsets = {}
+                for entry in sorted(entries, key=lambda e: e.local_offset):
+                    if jarsign.is_signature_file(entry.name) or entry.local_offset in new_offsets:
+                        continue
+                    new_offset = dst.tell()
+                    new_offsets[entry.local_offset] = new_offset
+                    dst.write(_aligned_local_header(data, entry, new_offset))
+                    start = apkzip.data_offset(data, entry)
+                    _stream_copy(src, dst, start, regions[entry.local_offset] - start)
+                timings['copy'] = time.perf_counter() - started
+            
+            records = [
+                apkzip.relocated_cd_record(entry, new_offsets[entry.local_offset])
+                for entry in entries if not jarsign.is_signature_file(entry.name)
+            ]
+            for name, payload in signature_files.items():
+                local, record = apkzip.build_entry(name, payload, dst.tell())
+                dst.write(local)
+                records.append(record)
+            entries_end = dst.tell()
+        
+        central_directory = b''.join(records)
+        eocd = apkzip.build_eocd(len(records), len(central_directory), entries_end)
+        
+        started = time.perf_counter()
+        chunk_digests = apksig.sign_file(output_path, entries_end, central_directory, eocd, key)
+        timings['v2v3'] = time.perf_counter() - started
+        
+        # Verify the signature, reusing the digests computed above
+        started = time.perf_counter()
+        apkverify.verify_signed_output(
+            output_path, key, chunk_digests,
+            {entry.raw_name: digest for entry, digest in zip(signed, digests)}, algorithm
+        )
+        timings['verify'] = time.perf_counter() - started
         
-        # Add signing metadata (simplified)
         file_size = os.path.getsize(output_path)
-        logger.info(f"APK signed successfully. Size: {file_size} bytes")
+        throughput = file_size / (1024 * 1024) / max(sum(timings.values()), 1e-9)
+        logger.info(
+            f"APK signed successfully. Size: {file_size} bytes, entries: {len(records)}, " +
+            ", ".join(f"{stage}: {seconds * 1000:.1f}ms" for stage, seconds in timings.items()) +
+            f", throughput: {throughput:.0f} MB/s"
+        )
         
         return True
         
@@ -72,25 +306,47 @@ def sign_apk(input_path: str, output_path: str) -> bool:
         logger.error(f"APK signing failed: {e}")
         raise APKSigningError(f"Signing failed: {str(e)}")
 
-def get_apk_info(file_path: str) -> dict:
+def get_apk_info(file_path: str, central_directory: Optional[bytes] = None) -> dict:
     """Extract APK information"""
     try:
         info = {
             'size': os.path.getsize(file_path),
             'valid': False,
             'package_name': 'unknown',
-            'version': 'unknown'
+            'version': 'unknown',
+            'version_code': None,
+            'min_sdk': None,
+            'abis': [],
+            'signature': None
         }
         
-        if zipfile.is_zipfile(file_path):
-            info['valid'] = True
-            
-            # In production, you would use aapt to extract APK info
-            # For now, we'll just mark it as valid
-            with zipfile.ZipFile(file_path, 'r') as apk:
-                if 'AndroidManifest.xml' in apk.namelist():
-                    info['package_name'] = 'com.example.app'  # Simplified
-                    info['version'] = '1.0'  # Simplified
+        try:
+            apk = inspect_apk(file_path, central_directory)
+        except (apkzip.ZipFormatError, zlib.error):
+            return info
+        
+        info['valid'] = True
+        info['abis'] = list(apk.abis)
+        
+        manifest = apk.manifest
+        if manifest:
+            info['package_name'] = manifest.package or 'unknown'
+            info['version_code'] = manifest.version_code
+            info['min_sdk'] = manifest.min_sdk
+            if manifest.version_name and manifest.version_code is not None:
+                info['version'] = f"{manifest.version_name} ({manifest.version_code})"
+            elif manifest.version_name or manifest.version_code is not None:
+                info['version'] = str(manifest.version_name or manifest.version_code)
+        
+        # Existing signature: which schemes verify and who signed
+        result = apkverify.verify_apk(file_path)
+        signers = {signer.sha256: signer.subject for signer in result.signers}
+        info['signature'] = {
+            'schemes': list(result.verified),
+            'signers': [(subject, fingerprint) for fingerprint, subject in signers.items()],
+            'valid': result.ok,
+            'signed': bool(result.verified or result.errors),
+        }
         
         return info
         
@@ -107,7 +363,17 @@ def cleanup_temp_files(file_path: str):
     except Exception as e:
         logger.error(f"Failed to cleanup temp file {file_path}: {e}")
 
+MAX_FILENAME_BYTES = 200  # Well under the usual 255-byte limit once "_signed" is added
+
 def generate_signed_filename(original_filename: str) -> str:
-    """Generate filename for signed APK"""
-    name, ext = os.path.splitext(original_filename)
+    """Generate filename for signed APK.
+
+    The original name comes from the user's upload, so any directory
+    part, separators and leading dots are dropped: the result is a plain
+    file name that stays inside whatever directory it is joined to.
+    """
+    name = original_filename.replace('\\', '/').rsplit('/', 1)[-1]
+    name = name.replace('\x00', '').strip().lstrip('.')
+    name, ext = os.path.splitext(name)
+    name = name.encode()[:MAX_FILENAME_BYTES].decode(errors='ignore') or 'app'
     return f"{name}_signed{ext}"
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import signal
+from typing import Optional
+
+import apkzip
+import keystore
+from config import SIGN_DAEMON_SOCKET
+from sign_service import (
+    SigningService, SigningQueueFull, encode_frame, read_frame, ping_daemon,
+    MSG_PING, MSG_SIGN, MSG_QUEUED, MSG_RESULT,
+)
+
+logger = logging.getLogger(__name__)
+
+class SignDaemon:
+    """Signing pool served over a Unix socket, shared by every bot process on the machine.
+
+    Bots send the paths of the input and output files (see the protocol in
+    sign_service.py); workers and keys stay warm between jobs and across
+    bot restarts. Run it from the bot's directory so it finds the same
+    keys/ and database: python sign_daemon.py
+    """
+
+    def __init__(self, socket_path: str = SIGN_DAEMON_SOCKET, service: Optional[SigningService] = None):
+        self.socket_path = socket_path
+        # The daemon's own pool never forwards to a daemon
+        self.service = service or SigningService(daemon_socket=None)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.jobs_done = 0
+
+    async def start(self):
+        """Load the bot key, start the workers and listen on the socket"""
+        if os.path.exists(self.socket_path):
+            if ping_daemon(self.socket_path) is not None:
+                raise RuntimeError(f"A signing daemon is already running at {self.socket_path}")
+            # Left over from a daemon that did not shut down cleanly
+            os.remove(self.socket_path)
+
+        keystore.registry.get(keystore.DEFAULT_KEY)
+        self.service.start()
+
+        # Only this user's processes may submit jobs
+        old_umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        finally:
+            os.umask(old_umask)
+        logger.info(f"Signing daemon listening on {self.socket_path} with {self.service.workers} workers")
+
+    async def stop(self):
+        """Stop accepting jobs, finish running ones and remove the socket"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self.service.shutdown()
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    msg_type, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break  # Client closed the connection
+
+                if msg_type == MSG_PING:
+                    writer.write(encode_frame(MSG_RESULT, {
+                        'ok': True,
+                        'workers': self.service.workers,
+                        'queue': self.service.queue_length,
+                        'jobs_done': self.jobs_done,
+                    }))
+                    await writer.drain()
+                elif msg_type == MSG_SIGN:
+                    await self._sign(payload, writer)
+                else:
+                    logger.warning(f"Unknown message type {msg_type}, closing connection")
+                    break
+
+        except (ConnectionError, ValueError) as e:
+            # A bot that goes away mid-job loses only its reply; the job still finishes
+            logger.warning(f"Signing daemon connection error: {e}")
+        finally:
+            writer.close()
+
+    async def _sign(self, payload: dict, writer: asyncio.StreamWriter):
+        async def on_queued(position: int):
+            writer.write(encode_frame(MSG_QUEUED, {'position': position}))
+            await writer.drain()
+
+        try:
+            sections = apkzip.ZipSections(*payload['sections']) if payload.get('sections') else None
+            success = await self.service.sign_apk(
+                payload['input'], payload['output'], sections,
+                payload.get('key_ref', keystore.DEFAULT_KEY), payload.get('key_version'),
+                on_queued=on_queued
+            )
+            result = {'ok': bool(success)}
+            self.jobs_done += 1
+        except SigningQueueFull as e:
+            result = {'ok': False, 'error': str(e), 'queue_full': True}
+        except Exception as e:
+            logger.error(f"Signing job for {payload.get('input')} failed: {e}")
+            result = {'ok': False, 'error': str(e)}
+
+        writer.write(encode_frame(MSG_RESULT, result))
+        await writer.drain()
+
+async def run_daemon(socket_path: str = SIGN_DAEMON_SOCKET):
+    """Serve until SIGINT or SIGTERM"""
+    daemon = SignDaemon(socket_path)
+    await daemon.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Signing daemon shutting down")
+        await daemon.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_daemon())
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, Optional
+
+import apkzip
+import keystore
+import sign
+from config import SIGN_WORKERS, SIGN_QUEUE_SIZE, SIGN_DAEMON_SOCKET
+
+logger = logging.getLogger(__name__)
+
+# Signing daemon protocol (see sign_daemon.py): each frame is a 1-byte
+# message type and a 4-byte payload length, then a JSON payload. Jobs
+# carry file paths, never file contents.
+FRAME_HEADER = struct.Struct('!BI')
+MAX_FRAME_SIZE = 64 * 1024
+MSG_PING = 1
+MSG_SIGN = 2
+MSG_QUEUED = 3  # Sent as soon as a job is accepted: {"position": n}
+MSG_RESULT = 4  # Sent when the job is done: {"ok": bool, "error": str, "queue_full": bool}
+DAEMON_CONNECT_TIMEOUT = 1.0
+
+class SigningQueueFull(Exception):
+    """Raised when the signing queue cannot take another job"""
+    pass
+
+class DaemonUnavailable(Exception):
+    """Raised when the signing daemon cannot be reached"""
+    pass
+
+def encode_frame(msg_type: int, payload: dict) -> bytes:
+    body = json.dumps(payload).encode()
+    return FRAME_HEADER.pack(msg_type, len(body)) + body
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Read one frame; returns (type, payload)"""
+    header = await reader.readexactly(FRAME_HEADER.size)
+    msg_type, length = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {length} bytes")
+    return msg_type, json.loads(await reader.readexactly(length))
+
+def ping_daemon(socket_path: str) -> Optional[dict]:
+    """Ask the signing daemon for its status; None if it is not running"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+            sock.connect(socket_path)
+            sock.sendall(encode_frame(MSG_PING, {}))
+            with sock.makefile('rb') as f:
+                msg_type, length = FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))
+                return json.loads(f.read(length)) if msg_type == MSG_RESULT else None
+    except (OSError, ValueError, struct.error):
+        return None
+
+class SigningService:
+    """Runs APK work in a process pool so it never blocks the event loop.
+
+    At most `workers` jobs run at once and up to `max_queue` more may wait
+    for a free worker; beyond that, submissions fail with SigningQueueFull.
+    When a signing daemon listens on `daemon_socket`, signing jobs go to
+    it instead, so several bot processes share one set of warm workers;
+    the local pool is only started if the daemon is not there.
+    """
+
+    def __init__(self, workers: int = SIGN_WORKERS, max_queue: int = SIGN_QUEUE_SIZE,
+                 daemon_socket: Optional[str] = SIGN_DAEMON_SOCKET):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.daemon_socket = daemon_socket
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._active = 0  # Jobs submitted and not yet finished
+        self._daemon_up = False  # Last known daemon state, to log only when it changes
+
+    def start(self):
+        """Use the signing daemon if it answers, else create the worker pool and start every worker up front"""
+        if self.daemon_socket and not self._daemon_up:
+            status = ping_daemon(self.daemon_socket)
+            if status is not None:
+                self._daemon_up = True
+                logger.info(f"Using signing daemon at {self.daemon_socket} ({status.get('workers')} workers)")
+                return
+
+        self._start_pool()
+
+    def _start_pool(self):
+        if self._executor is not None:
+            return
+
+        # spawn: workers must not inherit the bot's threads and sockets;
+        # each one loads the bot key as it starts, before its first job
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=keystore.warm
+        )
+        logger.info(f"Signing pool started with {self.workers} workers")
+
+    def shutdown(self):
+        """Stop the worker pool, waiting for running jobs"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def queue_length(self) -> int:
+        """Number of jobs waiting for a free worker"""
+        return max(0, self._active - self.workers)
+
+    def next_queue_position(self) -> int:
+        """Queue position a job submitted now would get (0 = starts at once)"""
+        if self._active < self.workers:
+            return 0
+        return self._active - self.workers + 1
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Run func(*args) in a worker process and await its result"""
+        if self._active >= self.workers + self.max_queue:
+            raise SigningQueueFull(f"Signing queue is full ({self.max_queue} waiting)")
+
+        self._start_pool()
+        executor = self._executor
+        self._active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool as e:
+            # A worker died (OOM kill, crash in native code) and took the pool with it;
+            # the next job gets a fresh pool
+            if self._executor is executor:
+                logger.error(f"Signing worker crashed, restarting the pool: {e}")
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise sign.APKSigningError("Signing worker crashed, please try again")
+        finally:
+            self._active -= 1
+
+    async def sign_apk(self, input_path: str, output_path: str,
+                       sections: Optional[apkzip.ZipSections] = None,
+                       key_ref: str = keystore.DEFAULT_KEY, key_version: Optional[str] = None,
+                       on_queued: Optional[Callable[[int], Awaitable[Any]]] = None) -> bool:
+        """Sign an APK with the given key (the bot key by default), on the daemon or in a worker process.
+
+        on_queued is awaited with the job's queue position (0 = starts at once)
+        as soon as the job is accepted. The job is signed in-process only when
+        the daemon cannot be reached at all; once it was sent, losing the
+        daemon fails the job.
+        """
+        if self.daemon_socket:
+            try:
+                result = await self._sign_on_daemon(
+                    input_path, output_path, sections, key_ref, key_version, on_queued
+                )
+                if not self._daemon_up:
+                    logger.info(f"Signing daemon at {self.daemon_socket} is available again")
+                    self._daemon_up = True
+                return result
+            except DaemonUnavailable as e:
+                if self._daemon_up:
+                    logger.warning(f"Signing daemon unavailable, signing in-process: {e}")
+                    self._daemon_up = False
+
+        if on_queued is not None:
+            await on_queued(self.next_queue_position())
+        return await self.run(sign.sign_apk, input_path, output_path, sections, key_ref, key_version)
+
+    async def _sign_on_daemon(self, input_path: str, output_path: str,
+                              sections: Optional[apkzip.ZipSections], key_ref: str,
+                              key_version: Optional[str],
+                              on_queued: Optional[Callable[[int], Awaitable[Any]]]) -> bool:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.daemon_socket), DAEMON_CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DaemonUnavailable(str(e) or type(e).__name__)
+
+        try:
+            # The daemon may run from another directory, so paths are made absolute
+            writer.write(encode_frame(MSG_SIGN, {
+                'input': os.path.abspath(input_path),
+                'output': os.path.abspath(output_path),
+                'sections': list(sections) if sections else None,
+                'key_ref': key_ref,
+                'key_version': key_version,
+            }))
+            await writer.drain()
+
+            while True:
+                msg_type, payload = await read_frame(reader)
+                if msg_type == MSG_QUEUED:
+                    if on_queued is not None:
+                        await on_queued(payload['position'])
+                elif msg_type == MSG_RESULT:
+                    break
+
+        except (OSError, EOFError, asyncio.IncompleteReadError, ValueError) as e:
+            # The daemon may still be writing output_path, so the job is not redone
+            # locally; only a failed connect falls back to in-process signing
+            logger.warning(f"Lost the signing daemon during a job for {input_path}: {e}")
+            self._daemon_up = False
+            raise sign.APKSigningError(f"Connection to signing daemon lost: {e}")
+        finally:
+            writer.close()
+
+        if payload.get('ok'):
+            return True
+        if payload.get('queue_full'):
+            raise SigningQueueFull(payload.get('error', 'Signing daemon queue is full'))
+        raise sign.APKSigningError(payload.get('error', 'Signing failed'))
+
+# Global signing service instance
+signing_service = SigningService()
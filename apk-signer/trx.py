@@ -1,129 +1,506 @@
-
+import asyncio
+import hashlib
 import logging
-import requests
 import time
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+
+import aiohttp
+
+import async_db as db
+from cache import TTLCache
+from config import (
+    TRON_API_BASE, TRONSCAN_API_BASE, TRON_REQUEST_TIMEOUT, TRON_POOL_SIZE,
+    TRON_HEDGE_DELAY, TRON_BREAKER_FAILURES, TRON_BREAKER_COOLDOWN,
+    TRON_CACHE_SIZE, TRON_CACHE_TTL, TRON_NEGATIVE_TTL, TRON_UNCONFIRMED_TTL,
+)
 
 logger = logging.getLogger(__name__)
 
+# Provider health tuning
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 100  # Recent successful latencies kept for the p95
+MIN_P95_SAMPLES = 10  # Below this the hedge waits TRON_HEDGE_DELAY
+MIN_HEDGE_DELAY = 0.05
+
+_MISSING = object()
+
 class TronAPIError(Exception):
     """Custom exception for TRON API errors"""
     pass
 
+# TRON addresses
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+TRON_ADDRESS_PREFIX = 0x41
+
+def hex_to_base58(address: Optional[str]) -> str:
+    """TRON address as base58check ('T...'); hex addresses (41 + 20 bytes) are converted.
+
+    Raises ValueError for anything that is not a valid TRON address.
+    """
+    if not address:
+        return ""
+    if address.startswith('T'):
+        base58_to_hex(address)  # Checks the checksum
+        return address
+    
+    payload = bytes.fromhex(address)
+    if len(payload) != 21 or payload[0] != TRON_ADDRESS_PREFIX:
+        raise ValueError(f"Not a TRON address: {address}")
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number:
+        number, digit = divmod(number, 58)
+        encoded = BASE58_ALPHABET[digit] + encoded
+    return encoded
+
+def base58_to_hex(address: str) -> str:
+    """Base58check TRON address as hex; raises ValueError if it is malformed"""
+    number = 0
+    for char in address:
+        digit = BASE58_ALPHABET.find(char)
+        if digit < 0:
+            raise ValueError(f"Not a TRON address: {address}")
+        number = number * 58 + digit
+    data = number.to_bytes(25, 'big') if number < 1 << 200 else b''
+    payload, checksum = data[:21], data[21:]
+    if (len(data) != 25 or payload[0] != TRON_ADDRESS_PREFIX
+            or hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum):
+        raise ValueError(f"Not a TRON address: {address}")
+    return payload.hex()
+
+class ProviderHealth:
+    """Latency, failure rate and circuit breaker of one API provider.
+
+    The breaker opens after `max_failures` failures in a row and lets no
+    request through for `cooldown` seconds; then a single probe request
+    decides whether it closes again or stays open for another cooldown.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, max_failures: int = TRON_BREAKER_FAILURES,
+                 cooldown: float = TRON_BREAKER_COOLDOWN):
+        self.name = name
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.latency_ewma = 0.0
+        self.success_ewma = 1.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.failures = 0
+        self.primary = 0  # Lookups that asked this provider first
+        self.hedges = 0  # Times it was asked as the hedge of a slow primary
+        self.wins = 0  # Lookups answered by this provider
+
+    def available(self) -> bool:
+        """Whether a request may be sent now"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            return not self._probing
+        return self.state == self.CLOSED
+
+    def begin(self):
+        self.requests += 1
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self, latency: float):
+        self._probing = False
+        self._latencies.append(latency)
+        self.latency_ewma = latency if self.requests == 1 else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+        self.success_ewma = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.success_ewma
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            logger.info(f"TRON provider {self.name} recovered, circuit closed")
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        self.success_ewma = (1 - EWMA_ALPHA) * self.success_ewma
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.consecutive_failures >= self.max_failures
+        ):
+            logger.warning(
+                f"TRON provider {self.name} failing ({self.consecutive_failures} in a row), "
+                f"circuit open for {self.cooldown:.0f}s"
+            )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        """The request was dropped because another provider answered first"""
+        self._probing = False
+
+    @property
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < MIN_P95_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    @property
+    def score(self) -> float:
+        """Health score: recent success rate, discounted by latency"""
+        return self.success_ewma / (1 + self.latency_ewma)
+
+    def hedge_delay(self, timeout: float) -> float:
+        """How long to wait for this provider before also asking the next one"""
+        p95 = self.p95
+        delay = p95 if p95 is not None else TRON_HEDGE_DELAY
+        return min(max(delay, MIN_HEDGE_DELAY), timeout)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'score': self.score,
+            'latency_ewma': self.latency_ewma,
+            'p95': self.p95,
+            'requests': self.requests,
+            'failures': self.failures,
+            'failure_rate': self.failures / self.requests if self.requests else 0.0,
+            'primary': self.primary,
+            'hedges': self.hedges,
+            'wins': self.wins,
+        }
+
 class TronAPI:
-    """TRON blockchain API client"""
+    """TRON blockchain API client.
+
+    Requests go through one aiohttp session whose keep-alive connection
+    pool is shared by every lookup, so nothing blocks the event loop and
+    repeated lookups skip the TCP and TLS handshakes.
+
+    A lookup asks the healthiest provider first. If it has not answered
+    within its own p95 latency, the next provider is asked too and the
+    first one to return the transaction wins; providers whose circuit is
+    open are skipped.
     
-    def __init__(self):
-        self.api_base = "https://api.trongrid.io"
-        self.explorer_base = "https://apilist.tronscanapi.com/api"
-        
-    def get_transaction(self, tx_id: str) -> Optional[Dict[str, Any]]:
-        """Get transaction details by transaction ID"""
+    Lookups are cached: confirmed transactions in memory and in the
+    database, "not found" and unconfirmed answers in memory for a few
+    seconds only. The database keeps the provider's raw answer, which is
+    formatted again on every read. Concurrent lookups of one TXID share a
+    single request.
+    """
+    
+    def __init__(self, api_base: str = TRON_API_BASE, explorer_base: str = TRONSCAN_API_BASE,
+                 timeout: float = TRON_REQUEST_TIMEOUT, pool_size: int = TRON_POOL_SIZE):
+        self.api_base = api_base
+        self.explorer_base = explorer_base
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.providers = {
+            'trongrid': self._fetch_trongrid,
+            'tronscan': self._fetch_tronscan,
+        }
+        self.formatters = {
+            'trongrid': self._format_transaction,
+            'tronscan': self._format_tronscan_transaction,
+        }
+        self.health = {name: ProviderHealth(name) for name in self.providers}
+        self.lookups = 0
+        self.hedged_lookups = 0
+        self._cache = TTLCache(maxsize=TRON_CACHE_SIZE, ttl=TRON_CACHE_TTL)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.cache_hits = 0
+        self.db_hits = 0
+        self.coalesced = 0
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created on first use, inside the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300),
+                timeout=self.timeout,
+                raise_for_status=False
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the connection pool"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_json(self, url: str, params: Optional[dict] = None) -> Any:
+        async with self._get_session().get(url, params=params) as response:
+            if response.status != 200:
+                raise TronAPIError(f"HTTP {response.status}")
+            return await response.json(content_type=None)
+    
+    # Fetchers return the provider's raw transaction payload, or None if it is unknown
+    async def _fetch_trongrid(self, tx_id: str) -> Optional[Dict[str, Any]]:
+        data = await self._get_json(f"{self.api_base}/v1/transactions/{tx_id}")
+        if data and data.get('data'):
+            return data['data'][0]
+        return None
+    
+    async def _fetch_tronscan(self, tx_id: str) -> Optional[Dict[str, Any]]:
+        data = await self._get_json(f"{self.explorer_base}/transaction-info", params={'hash': tx_id})
+        return data or None
+    
+    async def _call_provider(self, name: str, tx_id: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Ask one provider, recording its latency or failure; returns (raw payload, formatted)"""
+        health = self.health[name]
+        health.begin()
+        started = time.monotonic()
         try:
-            # Try TronGrid API first
-            url = f"{self.api_base}/v1/transactions/{tx_id}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('data'):
-                    return self._format_transaction(data['data'][0])
-            
-            # Fallback to TronScan API
-            url = f"{self.explorer_base}/transaction-info"
-            params = {'hash': tx_id}
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return self._format_tronscan_transaction(data)
-            
-            return None
-            
-        except requests.RequestException as e:
-            logger.error(f"Network error getting transaction {tx_id}: {e}")
-            raise TronAPIError(f"Network error: {e}")
+            raw = await self.providers[name](tx_id)
+            tx_data = self.formatters[name](raw) if raw else None
+            result = (raw, tx_data) if tx_data else None
+        except asyncio.CancelledError:
+            health.record_cancelled()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, TronAPIError) as e:
+            health.record_failure()
+            logger.warning(f"TRON provider {name} failed for {tx_id}: {e!r}")
+            raise TronAPIError(f"{name}: {e!r}")
         except Exception as e:
-            logger.error(f"Error getting transaction {tx_id}: {e}")
-            raise TronAPIError(f"Transaction lookup failed: {e}")
+            health.record_failure()
+            logger.error(f"TRON provider {name} error for {tx_id}: {e}")
+            raise TronAPIError(f"{name}: {e}")
+        health.record_success(time.monotonic() - started)
+        return result
+    
+    def _ranked_providers(self) -> List[str]:
+        """Available providers, healthiest first (ties keep the configured order)"""
+        available = [name for name in self.providers if self.health[name].available()]
+        return sorted(available, key=lambda name: -self.health[name].score)
     
-    def _format_transaction(self, tx_data: dict) -> Dict[str, Any]:
+    async def get_transaction(self, tx_id: str) -> Optional[Dict[str, Any]]:
+        """Get transaction details by transaction ID"""
+        cached = self._cache.get(tx_id, _MISSING)
+        if cached is not _MISSING:
+            self.cache_hits += 1
+            return cached
+        
+        future = self._inflight.get(tx_id)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(self._lookup(tx_id))
+            self._inflight[tx_id] = future
+            future.add_done_callback(lambda f: self._lookup_done(tx_id, f))
+        # Shielded: a caller that gives up must not cancel the lookup for the others
+        return await asyncio.shield(future)
+    
+    def _lookup_done(self, tx_id: str, future: asyncio.Future):
+        self._inflight.pop(tx_id, None)
+        if not future.cancelled():
+            future.exception()  # Retrieved here in case every caller gave up
+    
+    def _format_stored(self, stored: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Format a stored raw payload with its provider's current formatter"""
+        formatter = self.formatters.get(stored['provider'])
+        if formatter is None:
+            return None
+        tx_data = formatter(stored['payload'])
+        # A payload the formatter no longer accepts is looked up again
+        return tx_data if tx_data and tx_data['confirmed'] else None
+    
+    async def _lookup(self, tx_id: str) -> Optional[Dict[str, Any]]:
+        stored = await db.get_tron_transaction(tx_id)
+        if stored is not None:
+            tx_data = self._format_stored(stored)
+            if tx_data is not None:
+                self.db_hits += 1
+                self._cache.set(tx_id, tx_data)
+                return tx_data
+        
+        found = await self._fetch_transaction(tx_id)
+        if found is None:
+            self._cache.set(tx_id, None, ttl=TRON_NEGATIVE_TTL)
+            return None
+        
+        provider, raw, tx_data = found
+        if not tx_data['confirmed']:
+            self._cache.set(tx_id, tx_data, ttl=TRON_UNCONFIRMED_TTL)
+        else:
+            self._cache.set(tx_id, tx_data)
+            await db.save_tron_transaction(tx_id, provider, raw)
+        return tx_data
+    
+    async def _fetch_transaction(self, tx_id: str) -> Optional[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+        """Look the transaction up on the providers, hedging a slow one.
+
+        Returns (provider, raw payload, formatted transaction), or None if
+        a provider answered that it does not know the transaction.
+        """
+        candidates = self._ranked_providers()
+        if not candidates:
+            raise TronAPIError("All TRON API providers are unavailable")
+        
+        self.lookups += 1
+        self.health[candidates[0]].primary += 1
+        pending = {}
+        errors = []
+        answered = False
+        
+        def launch(hedge: bool = False):
+            name = candidates.pop(0)
+            if hedge:
+                self.health[name].hedges += 1
+            pending[asyncio.ensure_future(self._call_provider(name, tx_id))] = name
+            return self.health[name].hedge_delay(self.timeout.total)
+        
+        try:
+            delay = launch()
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay if candidates else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # The provider is slower than usual: ask the next one as well
+                    self.hedged_lookups += 1
+                    delay = launch(hedge=True)
+                    continue
+                
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(str(task.exception()))
+                    else:
+                        answered = True
+                        if task.result():
+                            self.health[name].wins += 1
+                            return (name, *task.result())
+                
+                # Failed or did not know the transaction: the next provider gets a turn at once
+                if not pending and candidates:
+                    delay = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if not answered:
+            # Every provider asked failed; "not found" is only trusted from one that answered
+            raise TronAPIError(f"Transaction lookup failed: {'; '.join(errors)}")
+        return None
+    
+    async def get_incoming_transfers(self, address: str, min_timestamp: int, fingerprint: Optional[str] = None,
+                                     limit: int = 200) -> Tuple[List[Dict[str, Any]], Optional[str], int, int]:
+        """One page of confirmed TRX transfers to an address, oldest first, from TronGrid's account history.
+
+        Returns (transfers, fingerprint of the next page or None, block time
+        of the page's last transaction of any kind, server time), times in ms.
+        """
+        params = {
+            'only_to': 'true',
+            'only_confirmed': 'true',
+            'order_by': 'block_timestamp,asc',
+            'min_timestamp': str(min_timestamp),
+            'limit': str(limit),
+        }
+        if fingerprint:
+            params['fingerprint'] = fingerprint
+        try:
+            data = await self._get_json(f"{self.api_base}/v1/accounts/{address}/transactions", params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise TronAPIError(f"Network error: {e!r}")
+        
+        transfers = []
+        last_timestamp = min_timestamp
+        for item in data.get('data', []):
+            last_timestamp = max(last_timestamp, int(item.get('block_timestamp', 0)))
+            tx_data = self._format_transaction(item)
+            if not tx_data or not tx_data['confirmed']:
+                continue  # Other contract types (e.g. TRC20) or failed transfers
+            tx_data['block_timestamp'] = int(item.get('block_timestamp', 0))
+            transfers.append(tx_data)
+        
+        meta = data.get('meta', {})
+        return transfers, meta.get('fingerprint'), last_timestamp, int(meta.get('at', time.time() * 1000))
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Lookup and cache counters and per-provider health, for the admin status command"""
+        return {
+            'lookups': self.lookups,
+            'hedged_lookups': self.hedged_lookups,
+            'cache_hits': self.cache_hits,
+            'db_hits': self.db_hits,
+            'coalesced': self.coalesced,
+            'providers': {name: health.snapshot() for name, health in self.health.items()},
+        }
+    
+    # Both providers are formatted to the same shape, so either may answer a lookup:
+    # TRX transfers only, base58 addresses, amounts in TRX and in SUN
+    def _format_transaction(self, tx_data: dict) -> Optional[Dict[str, Any]]:
         """Format transaction data from TronGrid API"""
         try:
             contracts = tx_data.get('raw_data', {}).get('contract', [])
-            if not contracts:
-                return None
+            if not contracts or contracts[0].get('type') != 'TransferContract':
+                return None  # Not a TRX transfer (e.g. a TRC20 token transfer)
             
-            contract = contracts[0]
-            contract_type = contract.get('type')
-            
-            if contract_type == 'TransferContract':
-                value = contract.get('parameter', {}).get('value', {})
-                return {
-                    'tx_id': tx_data.get('txID'),
-                    'from_address': self._hex_to_base58(value.get('owner_address')),
-                    'to_address': self._hex_to_base58(value.get('to_address')),
-                    'amount': value.get('amount', 0) / 1_000_000,  # Convert from SUN to TRX
-                    'confirmed': tx_data.get('ret', [{}])[0].get('contractRet') == 'SUCCESS',
-                    'timestamp': tx_data.get('raw_data', {}).get('timestamp', 0),
-                    'block_number': tx_data.get('blockNumber', 0)
-                }
-            
-            return None
+            value = contracts[0].get('parameter', {}).get('value', {})
+            amount_sun = int(value.get('amount', 0))
+            return {
+                'tx_id': tx_data.get('txID'),
+                'from_address': hex_to_base58(value.get('owner_address')),
+                'to_address': hex_to_base58(value.get('to_address')),
+                'amount': amount_sun / 1_000_000,  # Convert from SUN to TRX
+                'amount_sun': amount_sun,
+                'confirmed': tx_data.get('ret', [{}])[0].get('contractRet') == 'SUCCESS',
+                'timestamp': tx_data.get('raw_data', {}).get('timestamp', 0),
+                'block_number': tx_data.get('blockNumber', 0),
+                'memo': self._decode_memo(tx_data.get('raw_data', {}).get('data'))
+            }
             
         except Exception as e:
             logger.error(f"Error formatting transaction: {e}")
             return None
     
-    def _format_tronscan_transaction(self, tx_data: dict) -> Dict[str, Any]:
+    def _format_tronscan_transaction(self, tx_data: dict) -> Optional[Dict[str, Any]]:
         """Format transaction data from TronScan API"""
         try:
             if not tx_data or 'contractRet' not in tx_data:
                 return None
+            if tx_data.get('contractType') != 1:  # TransferContract
+                return None  # Not a TRX transfer; TRC20 amounts are in token units, not SUN
             
-            transfers = tx_data.get('trc20TransferInfo', [])
-            if transfers:
-                transfer = transfers[0]
-                return {
-                    'tx_id': tx_data.get('hash'),
-                    'from_address': transfer.get('from_address'),
-                    'to_address': transfer.get('to_address'),
-                    'amount': float(transfer.get('quant', 0)) / 1_000_000,
-                    'confirmed': tx_data.get('confirmed', False),
-                    'timestamp': tx_data.get('timestamp', 0),
-                    'block_number': tx_data.get('block', 0)
-                }
-            
-            # Check for regular TRX transfer
-            if tx_data.get('contractType') == 1:  # TransferContract
-                return {
-                    'tx_id': tx_data.get('hash'),
-                    'from_address': tx_data.get('ownerAddress'),
-                    'to_address': tx_data.get('toAddress'),
-                    'amount': tx_data.get('amount', 0) / 1_000_000,
-                    'confirmed': tx_data.get('confirmed', False),
-                    'timestamp': tx_data.get('timestamp', 0),
-                    'block_number': tx_data.get('block', 0)
-                }
-            
-            return None
+            contract = tx_data.get('contractData', {})
+            amount_sun = int(contract.get('amount', tx_data.get('amount', 0)))
+            return {
+                'tx_id': tx_data.get('hash'),
+                'from_address': hex_to_base58(contract.get('owner_address') or tx_data.get('ownerAddress')),
+                'to_address': hex_to_base58(contract.get('to_address') or tx_data.get('toAddress')),
+                'amount': amount_sun / 1_000_000,
+                'amount_sun': amount_sun,
+                'confirmed': tx_data.get('contractRet') == 'SUCCESS' and bool(tx_data.get('confirmed')),
+                'timestamp': tx_data.get('timestamp', 0),
+                'block_number': tx_data.get('block', 0),
+                'memo': self._decode_memo(tx_data.get('rawData', {}).get('data'))
+            }
             
         except Exception as e:
             logger.error(f"Error formatting TronScan transaction: {e}")
             return None
     
-    def _hex_to_base58(self, hex_address: str) -> str:
-        """Convert hex address to base58 (simplified)"""
-        # This is a simplified implementation
-        # In production, use proper TRON address conversion
-        if not hex_address:
+    def _decode_memo(self, hex_data: Optional[str]) -> str:
+        """Transfer note (raw_data.data, hex encoded) as lowercase text"""
+        if not hex_data:
+            return ""
+        try:
+            return bytes.fromhex(hex_data).decode('utf-8', errors='ignore').strip().lower()
+        except ValueError:
             return ""
-        return hex_address  # Placeholder
     
-    def validate_transaction(self, tx_id: str, expected_address: str, min_amount: float = 0) -> Dict[str, Any]:
+    async def validate_transaction(self, tx_id: str, expected_address: str, min_amount: float = 0) -> Dict[str, Any]:
         """Validate a transaction meets requirements"""
         try:
-            tx_data = self.get_transaction(tx_id)
+            tx_data = await self.get_transaction(tx_id)
             
             if not tx_data:
                 return {
@@ -142,8 +519,8 @@ class TronAPI:
                     'confirmed': False
                 }
             
-            # Check destination address
-            if tx_data['to_address'].lower() != expected_address.lower():
+            # Check destination address (base58 is case-sensitive)
+            if tx_data['to_address'] != expected_address:
                 return {
                     'valid': False,
                     'error': 'Transaction sent to wrong address',
@@ -179,10 +556,10 @@ class TronAPI:
 # Global API instance
 tron_api = TronAPI()
 
-def verify_payment(tx_id: str, wallet_address: str, min_amount: float = 1.0) -> Dict[str, Any]:
+async def verify_payment(tx_id: str, wallet_address: str, min_amount: float = 1.0) -> Dict[str, Any]:
     """Verify a TRX payment transaction"""
-    return tron_api.validate_transaction(tx_id, wallet_address, min_amount)
+    return await tron_api.validate_transaction(tx_id, wallet_address, min_amount)
 
-def get_transaction_info(tx_id: str) -> Optional[Dict[str, Any]]:
+async def get_transaction_info(tx_id: str) -> Optional[Dict[str, Any]]:
     """Get transaction information"""
-    return tron_api.get_transaction(tx_id)
+    return await tron_api.get_transaction(tx_id)